@@ -0,0 +1,148 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+# 同じパス（軌道）の隣接するスライスとみなす取得時刻の間隔
+ACQUISITION_GAP = timedelta(minutes=2)
+MANIFEST_NAME = 'acquisitions.json'
+
+
+def parse_datetime(value):
+    """カタログの日時文字列（例: 2023-01-01T08:30:15Z）をdatetimeに変換"""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+def acquisition_key(item):
+    """同じパスかどうかを判定するキー（プラットフォーム・軌道方向・絶対軌道番号）"""
+    properties = item.get('properties', {})
+    return (
+        properties.get('platform', ''),
+        properties.get('sat:orbit_state', ''),
+        properties.get('sat:absolute_orbit')
+    )
+
+
+def acquisition_name(acquisition):
+    """
+    取得ごとの決定的な名前（例: s1_sentinel-1a_20230105T083015_ascending）
+
+    同じ取得からは常に同じ名前になるため、保存先のディレクトリ名に使う。
+    """
+    parts = ['s1', (acquisition['platform'] or 'unknown').lower(), acquisition['start'].strftime('%Y%m%dT%H%M%S')]
+    if acquisition['orbit_state']:
+        parts.append(acquisition['orbit_state'].lower())
+    if acquisition['absolute_orbit'] is not None:
+        parts.append(str(acquisition['absolute_orbit']))
+    return '_'.join(parts)
+
+
+def plan_acquisitions(items, max_gap=ACQUISITION_GAP):
+    """
+    カタログのアイテムを実際の取得（衛星のパス）ごとにまとめる
+
+    同じプラットフォーム・軌道方向・軌道番号で、取得時刻の間隔がmax_gap以内の
+    アイテムは同じパスの隣接するスライスとして1つの取得にまとめる。
+
+    Args:
+        items: SentinelHubCatalogの検索結果のアイテム
+        max_gap: 同じパスとみなす取得時刻の間隔
+
+    Returns:
+        取得時刻順の取得のリスト
+        {'name', 'platform', 'orbit_state', 'absolute_orbit', 'start', 'end',
+         'time_interval', 'item_ids', 'conflicting_item_ids'}
+
+        Process APIではアイテムを識別子で指定できないため、取得はtime_interval（と軌道方向）で
+        指定する。カタログの検索結果のうち、同じ時間範囲に入る別の取得のアイテムは
+        conflicting_item_idsに記録する（空であれば、時間範囲で指定してもこの取得の
+        アイテムだけが対象になる）。
+    """
+    groups = {}
+    for item in items:
+        groups.setdefault(acquisition_key(item), []).append(item)
+
+    acquisitions = []
+    for (platform, orbit_state, absolute_orbit), group in groups.items():
+        group.sort(key=lambda item: item['properties']['datetime'])
+        current = None
+        for item in group:
+            acquired = parse_datetime(item['properties']['datetime'])
+            if current is None or acquired - current['end'] > max_gap:
+                current = {
+                    'platform': platform,
+                    'orbit_state': orbit_state,
+                    'absolute_orbit': absolute_orbit,
+                    'start': acquired,
+                    'end': acquired,
+                    'item_ids': []
+                }
+                acquisitions.append(current)
+            current['end'] = acquired
+            current['item_ids'].append(item['id'])
+
+    for acquisition in acquisitions:
+        # 取得の前後1秒を含む時間範囲
+        acquisition['time_interval'] = (
+            acquisition['start'] - timedelta(seconds=1),
+            acquisition['end'] + timedelta(seconds=1)
+        )
+        acquisition['name'] = acquisition_name(acquisition)
+        window_start, window_end = acquisition['time_interval']
+        acquisition['conflicting_item_ids'] = [
+            item['id'] for item in items
+            if item['id'] not in acquisition['item_ids']
+            and window_start <= parse_datetime(item['properties']['datetime']) <= window_end
+            and (not acquisition['orbit_state']
+                 or item['properties'].get('sat:orbit_state', '') == acquisition['orbit_state'])
+        ]
+    acquisitions.sort(key=lambda acquisition: (acquisition['start'], acquisition['name']))
+    return acquisitions
+
+
+def print_acquisition_summary(items, acquisitions):
+    """取得の計画の要約を表示"""
+    print(f"カタログのアイテム: {len(items)}件 -> 取得: {len(acquisitions)}件")
+    for acquisition in acquisitions:
+        print(f"  {acquisition['name']}: {len(acquisition['item_ids'])}アイテム")
+        if acquisition['conflicting_item_ids']:
+            print(f"    時間範囲に別の取得のアイテムが含まれます: {', '.join(acquisition['conflicting_item_ids'])}")
+
+
+def load_manifest(output_dir):
+    """取得の記録（{名前: 記録}）を読み込む"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {entry['name']: entry for entry in json.load(f)}
+
+
+def save_manifest(output_dir, manifest):
+    """取得の記録を保存（一時ファイルからの置き換え）"""
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = f"{path}.tmp"
+    entries = sorted(manifest.values(), key=lambda entry: (entry['start'], entry['name']))
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def manifest_entry(acquisition, path, status, error=None, bands=None):
+    """取得の記録の1件分（bandsは保存したファイルのバンドの並び）"""
+    entry = {
+        'name': acquisition['name'],
+        'path': path,
+        'status': status,
+        'platform': acquisition['platform'],
+        'orbit_state': acquisition['orbit_state'],
+        'absolute_orbit': acquisition['absolute_orbit'],
+        'start': acquisition['start'].isoformat(),
+        'end': acquisition['end'].isoformat(),
+        'item_ids': acquisition['item_ids']
+    }
+    if bands is not None:
+        entry['bands'] = list(bands)
+    if error is not None:
+        entry['error'] = str(error)
+    return entry
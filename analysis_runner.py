@@ -0,0 +1,118 @@
+import hashlib
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_CACHE_PATH = '.analysis_cache.pkl'
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    """ファイル内容のSHA-1ハッシュを計算"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _analyze_file(analyze_fn, path):
+    """ワーカープロセスで1枚の画像を分析（例外は文字列にして返す）"""
+    try:
+        return analyze_fn(path), None
+    except Exception as e:
+        return None, str(e)
+
+
+class AnalysisRunner:
+    """
+    画像分析をプロセスプールで並列に実行し、結果をキャッシュするランナー
+
+    分析結果は (分析の名前, ファイルのハッシュ) をキーとして保存する。
+    ファイルの更新時刻とサイズが前回と同じ場合はハッシュの再計算も省略するため、
+    再実行時には新しく追加・変更された画像だけが分析される。
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, max_workers=None):
+        """
+        Args:
+            cache_path: キャッシュファイルのパス
+            max_workers: ワーカープロセス数（Noneの場合はCPUコア数）
+        """
+        self.cache_path = cache_path
+        self.max_workers = max_workers
+        self.files = {}    # パス -> (mtime_ns, size, ハッシュ)
+        self.results = {}  # (分析の名前, ハッシュ) -> 分析結果
+        self.dirty = False
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'rb') as f:
+                    cache = pickle.load(f)
+                self.files = cache['files']
+                self.results = cache['results']
+            except Exception as e:
+                print(f"分析キャッシュを読み込めませんでした（再作成します）: {e}")
+
+    def _digest(self, path):
+        stat = os.stat(path)
+        cached = self.files.get(path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = file_digest(path)
+        self.files[path] = (stat.st_mtime_ns, stat.st_size, digest)
+        self.dirty = True
+        return digest
+
+    def save(self):
+        """キャッシュをファイルに保存（一時ファイルからの置き換え）"""
+        if self.cache_path is None:
+            return
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'files': self.files, 'results': self.results}, f)
+        os.replace(tmp_path, self.cache_path)
+        self.dirty = False
+
+    def run(self, image_paths, analyze_fn, name):
+        """
+        画像を分析して {パス: 分析結果} を返す
+
+        Args:
+            image_paths: 画像ファイルのパスのリスト
+            analyze_fn: パスを受け取り分析結果を返す関数（プロセス間で受け渡すためモジュールのトップレベルに定義する）
+            name: 分析の名前（キャッシュの名前空間）
+
+        Returns:
+            {パス: 分析結果} 分析に失敗した画像の結果はNone
+        """
+        paths = list(dict.fromkeys(str(path) for path in image_paths))
+        digests = {path: self._digest(path) for path in paths}
+
+        results = {}
+        pending = []
+        for path in paths:
+            key = (name, digests[path])
+            if key in self.results:
+                results[path] = self.results[key]
+            else:
+                pending.append(path)
+        print(f"{len(paths)}枚中 {len(paths) - len(pending)}枚はキャッシュ済み、{len(pending)}枚を分析します")
+
+        if pending:
+            with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+                outputs = executor.map(
+                    _analyze_file, [analyze_fn] * len(pending), pending,
+                    chunksize=max(1, len(pending) // (4 * (self.max_workers or os.cpu_count() or 1)))
+                )
+                for path, (result, error) in zip(pending, outputs):
+                    if error is not None:
+                        print(f"画像の分析に失敗: {path}: {error}")
+                    if result is None:
+                        results[path] = None
+                        continue
+                    results[path] = result
+                    self.results[(name, digests[path])] = result
+                    self.dirty = True
+        if self.dirty:
+            self.save()
+
+        return results
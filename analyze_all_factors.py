@@ -2,43 +2,22 @@ import json
 import os
 from PIL import Image
 import numpy as np
+import pandas as pd
 from datetime import datetime
 import matplotlib.pyplot as plt
 from pathlib import Path
 from typing import Dict, List, Tuple
+from metadata_store import MetadataStore
+from image_stats import compute_image_stats
+from analysis_runner import AnalysisRunner
 
-def load_metadata() -> List[Dict]:
-    """メタデータを読み込む"""
-    with open('satellite_metadata.json', 'r') as f:
-        return json.load(f)
+# analyze_all_factorsが使う統計情報の列（画像が1枚もない場合も結合後の表に含める）
+FACTOR_STATS_COLUMNS = ['mean', 'brightness_range']
 
 def analyze_image(img: np.ndarray) -> Dict:
     """画像の統計情報を計算"""
-    # RGBチャンネルごとに分析
-    r, g, b = img[:, :, 0], img[:, :, 1], img[:, :, 2]
-    
-    # 基本統計
-    stats = {
-        'mean': np.mean(img),
-        'std': np.std(img),
-        'min': np.min(img),
-        'max': np.max(img),
-        'r_mean': np.mean(r),
-        'g_mean': np.mean(g),
-        'b_mean': np.mean(b),
-        'r_std': np.std(r),
-        'g_std': np.std(g),
-        'b_std': np.std(b)
-    }
-    
-    # ヒストグラムの計算
-    hist, bins = np.histogram(img.flatten(), bins=256, range=(0, 256))
-    stats['histogram'] = hist.tolist()
-    
-    # 画像の明るさ分布の特徴
-    stats['brightness_range'] = stats['max'] - stats['min']
-    stats['high_brightness_ratio'] = np.sum(img > 200) / img.size
-    stats['low_brightness_ratio'] = np.sum(img < 50) / img.size
+    # 基本統計・チャンネルごとの統計・ヒストグラム・明るさ分布の特徴を1回の走査で計算
+    stats = compute_image_stats(img)
     
     # エッジ検出（画像のシャープさ）
     from scipy.ndimage import gaussian_filter, sobel
@@ -49,60 +28,78 @@ def analyze_image(img: np.ndarray) -> Dict:
     
     return stats
 
-def analyze_all_factors(metadata: List[Dict], stats_list: List[Dict]) -> Dict:
-    """全ての要因を分析"""
-    analysis_results = {
-        'time_series': {},
-        'seasonal': {},
-        'weather': {},
-        'geographical': {}
-    }
-    
-    # 時間系列の分析
-    for meta, stats in zip(metadata, stats_list):
-        date = datetime.strptime(meta['datetime'], '%Y-%m-%dT%H:%M:%SZ')
-        platform = meta['platform']
-        
+def analyze_image_file(path: str) -> Dict:
+    """画像ファイルを読み込んで統計情報を計算"""
+    return analyze_image(np.array(Image.open(path)))
+
+def build_factor_frame(metadata: pd.DataFrame, results: Dict[str, Dict],
+                       images_dir: str = 'satellite_images') -> pd.DataFrame:
+    """
+    メタデータと画像の統計情報を画像パスをキーに結合
+
+    メタデータは取得日とタイルごとの1行、統計情報は画像ごとの1行で、
+    画像が存在しないメタデータや分析に失敗した画像は結合時に除外される。
+    """
+    metadata = metadata.copy()
+    metadata['date'] = metadata['datetime'].dt.strftime('%Y-%m-%d')
+    metadata['img_path'] = images_dir + '/satellite_' + metadata['date'] + '.png'
+    metadata['month'] = metadata['datetime'].dt.month
+    metadata['lat'] = (metadata['min_lat'] + metadata['max_lat']) / 2
+    metadata['lon'] = (metadata['min_lon'] + metadata['max_lon']) / 2
+
+    stats = pd.DataFrame.from_dict(
+        {path: result for path, result in results.items() if result is not None},
+        orient='index'
+    )
+    if stats.empty:
+        stats = pd.DataFrame(columns=FACTOR_STATS_COLUMNS, dtype=float)
+    frame = metadata.merge(stats, left_on='img_path', right_index=True, how='inner')
+    return frame.set_index(['date', 'tile_id']).sort_index()
+
+def summarize_brightness(grouped) -> pd.DataFrame:
+    """グループごとの平均輝度の平均・標準偏差・件数を計算"""
+    return pd.DataFrame({
+        'mean': grouped['mean'].mean(),
+        'std': grouped['mean'].std(ddof=0),
+        'count': grouped['mean'].count()
+    })
+
+def analyze_all_factors(frame: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    全ての要因を分析
+
+    時間系列・シーズンは画像ごと（同じ日の複数タイルは1枚として扱い、
+    画像の取得時と同じく雲量が最も少ないエントリを代表とする）、
+    天候（雲量）と地理的位置はタイルごとに集計する。
+    """
+    images = (frame.reset_index()
+              .sort_values('cloud_cover')
+              .drop_duplicates('img_path')
+              .sort_values('datetime'))
+    tiles = frame.reset_index()
+
+    # 雲量を10%ごとの区間に分類
+    cloud_bins = pd.cut(tiles['cloud_cover'], bins=np.arange(0, 110, 10), include_lowest=True)
+
+    return {
         # 時間系列
-        if platform not in analysis_results['time_series']:
-            analysis_results['time_series'][platform] = []
-        analysis_results['time_series'][platform].append({
-            'date': date,
-            'stats': stats
-        })
-        
+        'time_series': images[['platform', 'datetime', 'mean', 'brightness_range']],
         # シーズン
-        month = date.month
-        if month not in analysis_results['seasonal']:
-            analysis_results['seasonal'][month] = []
-        analysis_results['seasonal'][month].append(stats)
-        
-        # 天候条件（雲量が利用可能なら）
-        if meta['cloud_cover'] is not None:
-            cloud_cover = meta['cloud_cover']
-            if cloud_cover not in analysis_results['weather']:
-                analysis_results['weather'][cloud_cover] = []
-            analysis_results['weather'][cloud_cover].append(stats)
-        
+        'seasonal': summarize_brightness(images.groupby('month')),
+        # 天候条件（雲量が利用可能なもの）
+        'weather': summarize_brightness(tiles.groupby(cloud_bins, observed=True)),
         # 地理的位置
-        lat = float(meta['bbox'][1]) + (float(meta['bbox'][3]) - float(meta['bbox'][1])) / 2
-        lon = float(meta['bbox'][0]) + (float(meta['bbox'][2]) - float(meta['bbox'][0])) / 2
-        if (lat, lon) not in analysis_results['geographical']:
-            analysis_results['geographical'][(lat, lon)] = []
-        analysis_results['geographical'][(lat, lon)].append(stats)
-    
-    return analysis_results
+        'geographical': summarize_brightness(tiles.groupby(['lat', 'lon']))
+    }
 
-def plot_analysis(results: Dict, output_dir: str):
+def plot_analysis(results: Dict[str, pd.DataFrame], output_dir: str):
     """分析結果をプロット"""
     os.makedirs(output_dir, exist_ok=True)
     
     # 時間系列の可視化
     plt.figure(figsize=(12, 6))
-    for platform, data in results['time_series'].items():
-        dates = [d['date'] for d in data]
-        means = [d['stats']['mean'] for d in data]
-        plt.plot(dates, means, label=platform)
+    for platform, data in results['time_series'].groupby('platform'):
+        plt.plot(data['datetime'], data['mean'], label=platform)
     plt.title('Brightness Over Time')
     plt.xlabel('Date')
     plt.ylabel('Mean Brightness')
@@ -113,7 +110,7 @@ def plot_analysis(results: Dict, output_dir: str):
     # シーズン別の可視化
     plt.figure(figsize=(12, 6))
     months = list(range(1, 13))
-    means = [np.mean([s['mean'] for s in results['seasonal'].get(m, [])]) for m in months]
+    means = results['seasonal']['mean'].reindex(months)
     plt.bar(months, means)
     plt.title('Seasonal Brightness Pattern')
     plt.xlabel('Month')
@@ -124,43 +121,47 @@ def plot_analysis(results: Dict, output_dir: str):
 
 def main():
     # メタデータの読み込み
-    metadata = load_metadata()
+    metadata = MetadataStore().to_dataframe()
     
-    # 画像の読み込みと分析
-    stats_list = []
-    for meta in metadata:
-        img_path = f"satellite_images/satellite_{meta['datetime'][:10]}.png"
-        if not os.path.exists(img_path):
-            continue
-            
-        img = np.array(Image.open(img_path))
-        stats = analyze_image(img)
-        stats_list.append(stats)
+    # 画像の読み込みと分析（並列実行・分析済みの画像はキャッシュを使用）
+    img_paths = [
+        f"satellite_images/satellite_{date}.png"
+        for date in metadata['datetime'].dt.strftime('%Y-%m-%d').unique()
+    ]
+    img_paths = [img_path for img_path in img_paths if os.path.exists(img_path)]
+    results = AnalysisRunner().run(img_paths, analyze_image_file, 'all_factors')
     
-    # 全ての要因の分析
-    analysis_results = analyze_all_factors(metadata, stats_list)
+    # メタデータと統計情報を結合して全ての要因を分析
+    frame = build_factor_frame(metadata, results)
+    if frame.empty:
+        print("分析できた画像がありません。get_satellite_metadata.py で画像を取得してください。")
+        return
+    analysis_results = analyze_all_factors(frame)
     
     # 結果の保存と可視化
     os.makedirs('analysis_all_factors', exist_ok=True)
     plot_analysis(analysis_results, 'analysis_all_factors')
     
     # 統計の要約を保存
-    time_series_stats = {}
-    for platform, data in analysis_results['time_series'].items():
-        if data:  # データが存在する場合のみ計算
-            time_series_stats[platform] = {
-                'mean_brightness': float(np.mean([d['stats']['mean'] for d in data])),
-                'std_brightness': float(np.std([d['stats']['mean'] for d in data])),
-                'brightness_range': float(np.mean([d['stats']['brightness_range'] for d in data]))
-            }
+    time_series = analysis_results['time_series'].groupby('platform')
+    platform_summary = summarize_brightness(time_series)
+    platform_summary['brightness_range'] = time_series['brightness_range'].mean()
+    time_series_stats = {
+        platform: {
+            'mean_brightness': float(row['mean']),
+            'std_brightness': float(row['std']),
+            'brightness_range': float(row['brightness_range'])
+        }
+        for platform, row in platform_summary.iterrows()
+    }
     
-    seasonal_stats = {}
-    for month, data in analysis_results['seasonal'].items():
-        if data:
-            seasonal_stats[month] = {
-                'mean_brightness': float(np.mean([s['mean'] for s in data])),
-                'std_brightness': float(np.std([s['mean'] for s in data]))
-            }
+    seasonal_stats = {
+        int(month): {
+            'mean_brightness': float(row['mean']),
+            'std_brightness': float(row['std'])
+        }
+        for month, row in analysis_results['seasonal'].iterrows()
+    }
     
     with open('analysis_all_factors/summary.json', 'w') as f:
         json.dump({
@@ -3,6 +3,9 @@ import json
 from PIL import Image
 import numpy as np
 from pathlib import Path
+from metadata_store import MetadataStore
+from image_stats import compute_image_stats
+from analysis_runner import AnalysisRunner
 
 # 画像の品質を評価する関数
 def evaluate_image_quality(img_path):
@@ -10,17 +13,13 @@ def evaluate_image_quality(img_path):
         img = Image.open(img_path)
         img_array = np.array(img)
         
-        # 全てのピクセルが0（真っ黒）の場合
-        is_black = np.all(img_array == 0)
-        
-        # 平均値と標準偏差を計算
-        mean_value = np.mean(img_array)
-        std_dev = np.std(img_array)
+        # ヒストグラムから平均値と標準偏差を計算
+        stats = compute_image_stats(img_array)
         
         return {
-            'is_black': is_black,
-            'mean_value': mean_value,
-            'std_dev': std_dev
+            'is_black': stats['max'] == 0,  # 全てのピクセルが0（真っ黒）の場合
+            'mean_value': stats['mean'],
+            'std_dev': stats['std']
         }
     except Exception as e:
         print(f"画像の読み込みに失敗: {img_path}")
@@ -28,13 +27,12 @@ def evaluate_image_quality(img_path):
 
 def main():
     # メタデータの読み込み
-    metadata_path = Path('satellite_metadata.json')
-    if not metadata_path.exists():
+    store = MetadataStore()
+    if not store.exists():
         print("メタデータファイルが見つかりません")
         return
     
-    with open(metadata_path, 'r') as f:
-        metadata_list = json.load(f)
+    metadata_list = store.query()
     
     # 画像ディレクトリの確認
     images_dir = Path('satellite_images')
@@ -49,17 +47,21 @@ def main():
         'sentinel-2c': {'count': 0, 'black_count': 0, 'mean_values': [], 'std_devs': []}
     }
     
-    # 全てのメタデータに対して処理
+    # 画像が存在するメタデータを収集
+    pairs = []
     for meta in metadata_list:
         date_str = meta['datetime'][:10]
-        platform = meta['platform'].lower()
         img_path = images_dir / f'satellite_{date_str}.png'
-        
-        if not img_path.exists():
-            continue
-            
-        # 画像の品質評価
-        quality = evaluate_image_quality(img_path)
+        if img_path.exists():
+            pairs.append((meta, str(img_path)))
+    
+    # 画像の品質評価（並列実行・分析済みの画像はキャッシュを使用）
+    qualities = AnalysisRunner().run([img_path for _, img_path in pairs], evaluate_image_quality, 'image_quality')
+    
+    # 全てのメタデータに対して処理
+    for meta, img_path in pairs:
+        platform = meta['platform'].lower()
+        quality = qualities[img_path]
         if quality is None:
             continue
         
@@ -6,11 +6,13 @@ from datetime import datetime
 import matplotlib.pyplot as plt
 from pathlib import Path
 from typing import Dict, List, Tuple
+from metadata_store import MetadataStore
+from image_stats import compute_image_stats
+from analysis_runner import AnalysisRunner
 
-def load_metadata() -> List[Dict]:
-    """メタデータを読み込む"""
-    with open('satellite_metadata.json', 'r') as f:
-        return json.load(f)
+def load_metadata(**conditions) -> List[Dict]:
+    """メタデータストアからメタデータを読み込む（条件はMetadataStore.queryと同じ）"""
+    return MetadataStore().query(**conditions)
 
 def load_image(path: str) -> np.ndarray:
     """画像を読み込み、NumPy配列に変換"""
@@ -19,34 +21,15 @@ def load_image(path: str) -> np.ndarray:
 
 def analyze_image(img: np.ndarray) -> Dict:
     """画像の統計情報を計算"""
-    # RGBチャンネルごとに分析
-    r, g, b = img[:, :, 0], img[:, :, 1], img[:, :, 2]
-    
-    # 基本統計
-    stats = {
-        'mean': np.mean(img),
-        'std': np.std(img),
-        'min': np.min(img),
-        'max': np.max(img),
-        'r_mean': np.mean(r),
-        'g_mean': np.mean(g),
-        'b_mean': np.mean(b),
-        'r_std': np.std(r),
-        'g_std': np.std(g),
-        'b_std': np.std(b)
-    }
-    
-    # ヒストグラムの計算
-    hist, bins = np.histogram(img.flatten(), bins=256, range=(0, 256))
-    stats['histogram'] = hist.tolist()
-    
-    # 画像の明るさ分布の特徴
-    stats['brightness_range'] = stats['max'] - stats['min']
-    stats['high_brightness_ratio'] = np.sum(img > 200) / img.size
-    stats['low_brightness_ratio'] = np.sum(img < 50) / img.size
+    # 基本統計・チャンネルごとの統計・ヒストグラム・明るさ分布の特徴を1回の走査で計算
+    stats = compute_image_stats(img)
     
     return stats
 
+def analyze_image_file(path: str) -> Dict:
+    """画像ファイルを読み込んで統計情報を計算"""
+    return analyze_image(load_image(path))
+
 def analyze_time_series(metadata: List[Dict], stats_list: List[Dict]) -> Dict:
     """時間系列の分析"""
     time_series = {}
@@ -91,19 +74,22 @@ def main():
     # メタデータの読み込み
     metadata = load_metadata()
     
-    # 画像の読み込みと分析
-    stats_list = []
+    # 画像が存在するメタデータを収集
+    pairs = []
     for meta in metadata:
         img_path = f"satellite_images/satellite_{meta['datetime'][:10]}.png"
-        if not os.path.exists(img_path):
-            continue
-            
-        img = load_image(img_path)
-        stats = analyze_image(img)
-        stats_list.append(stats)
+        if os.path.exists(img_path):
+            pairs.append((meta, img_path))
+    
+    # 画像の読み込みと分析（並列実行・分析済みの画像はキャッシュを使用）
+    results = AnalysisRunner().run([img_path for _, img_path in pairs], analyze_image_file, 'image_stats')
+    pairs = [(meta, img_path) for meta, img_path in pairs if results[img_path] is not None]
     
-    # 時間系列の分析
-    time_series = analyze_time_series(metadata, stats_list)
+    # 時間系列の分析（画像が存在するメタデータと統計情報を対応させる）
+    time_series = analyze_time_series(
+        [meta for meta, _ in pairs],
+        [results[img_path] for _, img_path in pairs]
+    )
     
     # プラットフォームごとの分析結果の保存
     for platform, data in time_series.items():
@@ -1,52 +1,352 @@
+import argparse
 import os
 import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 import pandas as pd
+from functools import cached_property, partial
 from pathlib import Path
-from rasterio.warp import reproject, Resampling
+from rasterio.windows import Window
+from aoi import AOI, SADO_BBOX
+from dem_cache import DEMResampler
+from speckle import SpeckleFilter, SPECKLE_METHODS
+from tile_scheduler import TileScheduler, DEFAULT_TILE_SIZE
+from elevation_lut import ElevationLUT, MoistureClassifier, MOISTURE_NODATA, MOISTURE_LABELS
+from polarimetry import SAR_BANDS, POLARIMETRIC_PRODUCTS, band_index, dual_pol_products
 
-def process_sar_tiff(tiff_path):
+# ブロック読み込み時の1ブロックあたりの目安の画素数（ストリップ構成のTIFFで使用）
+BLOCK_TARGET_PIXELS = 4 * 1024 * 1024
+
+# 佐渡島の解析範囲
+SADO_AOI = AOI.from_bbox(SADO_BBOX)
+
+# 標高帯ごとの地形補正値（0-200m: 0dB ... 1500-2000m: +6dB、範囲外は0dB）
+TERRAIN_CORRECTION_LUT = ElevationLUT(
+    bins=[0, 200, 400, 600, 800, 1000, 1500, 2000],
+    values=[0, 1, 2, 3, 4, 5, 6]
+)
+
+# 標高帯ごとの水分量推定の閾値（高水分の上限, 中水分の上限）
+MOISTURE_CLASSIFIER = MoistureClassifier.from_bands(
+    bins=[0, 500, 1000, 1500, 2000],
+    thresholds=[
+        (-15, -5),   # 低地帯
+        (-20, -10),  # 山麓
+        (-25, -15),  # 山地
+        (-30, -20)   # 高地
+    ]
+)
+
+def linear_to_db(vv_linear):
+    """
+    線形の後方散乱係数をdBに変換（float32、ゼロや負の値はNaN）
+
+    変換はfloat32のコピー1つの上でインプレースに行い、一時配列を作らない。
+    """
+    vv_db = np.array(vv_linear, dtype=np.float32)
+
+    # Sentinel-1データには対数変換に無効なゼロ値が含まれている可能性があるため、
+    # 変換前にゼロや負の値をNaNに置き換えます。
+    vv_db[~(vv_db > 0)] = np.nan
+
+    # dBに変換
+    np.log10(vv_db, out=vv_db)
+    vv_db *= 10
+    return vv_db
+
+def despeckle_to_db(vv_linear, speckle):
+    """
+    スペックルフィルタをかけてからdBに変換
+    """
+    return linear_to_db(speckle(vv_linear))
+
+def process_sar_tiff(tiff_path, aoi=None, scheduler=None, speckle=None):
     """
     GeoTIFFファイルを読み込み、線形の後方散乱係数をdBに変換してデータ配列を返します。
+
+    aoiを指定した場合は範囲を覆うウィンドウだけを読み込み、メタデータもウィンドウに合わせます。
+    scheduler（TileScheduler）を指定した場合はdBへの変換をタイルごとに並列に行います。
+    speckle（SpeckleFilter）を指定した場合はdBに変換する前の線形の値にフィルタをかけます。
+    aoiとspeckleの両方を指定した場合は、ウィンドウの周囲にフィルタの窓の半径分を追加で読み込み、
+    フィルタをかけてから切り落とします（AOIの端の画素もシーン全体にかけた場合と同じ値になります）。
+    """
+    if aoi is not None:
+        vv_linear, meta, crop = read_aoi_padded(tiff_path, aoi, speckle.halo if speckle is not None else 0)
+    else:
+        with rasterio.open(tiff_path) as src:
+            # 最初のバンドを読み込む
+            vv_linear, meta = src.read(1), src.meta
+        crop = (slice(None), slice(None))
+
+    # dBに変換
+    if speckle is not None:
+        if scheduler is not None:
+            if scheduler.halo < speckle.halo:
+                raise ValueError(f"タイルのhalo（{scheduler.halo}）がスペックルフィルタの窓の半径（{speckle.halo}）より小さいです")
+            return scheduler.map(despeckle_to_db, vv_linear, speckle=speckle)[crop], meta
+        return despeckle_to_db(vv_linear, speckle)[crop], meta
+    if scheduler is not None:
+        return scheduler.map(linear_to_db, vv_linear), meta
+    return linear_to_db(vv_linear), meta
+
+def pad_window(src, window, halo):
+    """
+    ウィンドウの周囲をhalo画素広げる（ラスタの範囲内に限る）
+
+    Returns:
+        (広げたウィンドウ, 広げたウィンドウの配列から元のウィンドウを切り出すスライス)
+    """
+    padded = Window(window.col_off - halo, window.row_off - halo,
+                    window.width + 2 * halo, window.height + 2 * halo)
+    padded = padded.intersection(Window(0, 0, src.width, src.height))
+    row = int(window.row_off - padded.row_off)
+    col = int(window.col_off - padded.col_off)
+    return padded, (slice(row, row + int(window.height)), slice(col, col + int(window.width)))
+
+def read_aoi_padded(tiff_path, aoi, halo=0, band=1):
+    """
+    AOIを覆うウィンドウを周囲にhalo画素広げて読み込む
+
+    Returns:
+        (広げたウィンドウのデータ, AOIのウィンドウに合わせたメタデータ, 元のウィンドウを切り出すスライス)
     """
     with rasterio.open(tiff_path) as src:
-        # 最初のバンドを読み込む
-        vv_linear = src.read(1).astype(float)
+        window = aoi.window_for(src)
+        if window is None:
+            raise ValueError(f"{tiff_path} は解析範囲と重なっていません")
+        padded, crop = pad_window(src, window, halo)
+        data = src.read(band, window=padded)
+        meta = src.meta.copy()
+        meta.update({
+            'width': int(window.width),
+            'height': int(window.height),
+            'transform': src.window_transform(window)
+        })
+    return data, meta, crop
+
+def sar_block_windows(src, window=None, target_pixels=BLOCK_TARGET_PIXELS):
+    """
+    TIFFの内部タイル構成に揃えたウィンドウを順に返す
+
+    内部タイル（ストリップ構成の場合はストリップ）を横方向、縦方向の順に
+    まとめてtarget_pixels程度のブロックにする。ブロックの境界は常に内部タイルの
+    境界と一致するため、各タイルは1回だけデコードされる。
+    windowを指定した場合はその範囲と重なる部分だけを返す。
+    """
+    tile_height, tile_width = src.block_shapes[0]
+    tiles_across = -(-src.width // tile_width)
+    block_width = tile_width * max(1, min(tiles_across, target_pixels // (tile_width * tile_height)))
+    block_height = tile_height * max(1, target_pixels // (block_width * tile_height))
+
+    if window is None:
+        window = Window(0, 0, src.width, src.height)
+    row_start = max(int(window.row_off), 0)
+    col_start = max(int(window.col_off), 0)
+    row_stop = min(int(window.row_off + window.height), src.height)
+    col_stop = min(int(window.col_off + window.width), src.width)
 
-        # Sentinel-1データには対数変換に無効なゼロ値が含まれている可能性があるため、
-        # 変換前にゼロや負の値をNaNに置き換えます。
-        vv_linear[vv_linear <= 0] = np.nan
+    for row in range(row_start // block_height * block_height, row_stop, block_height):
+        for col in range(col_start // block_width * block_width, col_stop, block_width):
+            top, left = max(row, row_start), max(col, col_start)
+            bottom = min(row + block_height, row_stop)
+            right = min(col + block_width, col_stop)
+            if bottom > top and right > left:
+                yield Window(left, top, right - left, bottom - top)
 
-        # dBに変換
-        vv_db = 10 * np.log10(vv_linear)
+def read_sar_block(src, block_window, band=1, speckle=None):
+    """
+    ブロックを読み込んでdBに変換
+
+    speckleを指定した場合は、ブロックの周囲にフィルタの窓の半径分（halo）を追加で読み込み、
+    フィルタをかけてから切り落とす。シーン全体にフィルタをかけた場合と同じ結果になる。
+    """
+    if speckle is None or speckle.halo == 0:
+        return linear_to_db(src.read(band, window=block_window))
 
-        return vv_db, src.meta
+    padded, crop = pad_window(src, block_window, speckle.halo)
+    return linear_to_db(speckle(src.read(band, window=padded))[crop])
+
+def mask_sar_block(src, block_window, vv_db, aoi):
+    """
+    ブロックのAOIの範囲外の画素をNaNにする（マスクが不要なAOIの場合は何もしない）
+    """
+    if aoi is not None and aoi.needs_mask(src.crs):
+        vv_db[~aoi.mask(src.window_transform(block_window), vv_db.shape, src.crs, cache=False)] = np.nan
+    return vv_db
+
+def iter_sar_blocks(tiff_path, window=None, band=1, speckle=None, aoi=None, target_pixels=BLOCK_TARGET_PIXELS):
+    """
+    GeoTIFFをブロックごとに読み込み、dBに変換したブロックを順に返すジェネレータ
+
+    シーン全体をメモリに読み込まないため、メモリ使用量はブロックサイズで決まる。
+    aoiを指定した場合、範囲外の画素はNaNにする。
+
+    Yields:
+        (ウィンドウ, dBのブロック(float32))
+    """
+    with rasterio.open(tiff_path) as src:
+        for block_window in sar_block_windows(src, window, target_pixels):
+            yield block_window, mask_sar_block(src, block_window, read_sar_block(src, block_window, band, speckle), aoi)
+
+def bbox_window(src, bbox):
+    """
+    経度緯度のbbox (min_lon, min_lat, max_lon, max_lat) に対応するピクセルのウィンドウを計算
+    """
+    return AOI.from_bbox(bbox).window_for(src)
+
+class BlockStats:
+    """
+    ブロックごとに更新できるNaNを除いた統計値（件数・最小・最大・平均・標準偏差）
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, block):
+        valid = block[~np.isnan(block)]
+        if valid.size == 0:
+            return
+        valid = valid.astype(np.float64)
+        self.count += valid.size
+        self.total += valid.sum()
+        self.total_sq += np.dot(valid, valid)
+        self.min = min(self.min, float(valid.min()))
+        self.max = max(self.max, float(valid.max()))
+
+    def summary(self):
+        if self.count == 0:
+            return {'count': 0, 'min': np.nan, 'max': np.nan, 'mean': np.nan, 'std': np.nan}
+        mean = self.total / self.count
+        var = max(self.total_sq / self.count - mean * mean, 0.0)
+        return {'count': self.count, 'min': self.min, 'max': self.max, 'mean': mean, 'std': float(np.sqrt(var))}
+
+def sar_stats_blocked(tiff_path, window=None, speckle=None, aoi=None, target_pixels=BLOCK_TARGET_PIXELS):
+    """
+    ブロックごとに読み込みながらSARデータ（dB）の統計値を計算
+    """
+    stats = BlockStats()
+    for _, vv_db in iter_sar_blocks(tiff_path, window, speckle=speckle, aoi=aoi, target_pixels=target_pixels):
+        stats.update(vv_db)
+    return stats.summary()
+
+def process_sar_blocked(tiff_path, dem, corrected_path, moisture_path, window=None, speckle=None, aoi=None,
+                        target_pixels=BLOCK_TARGET_PIXELS):
+    """
+    ブロックごとに地形補正と水分量推定を行い、結果をGeoTIFFに書き出す
+
+    シーンより大きなメモリを必要とせず、ピークメモリはブロックサイズで決まる。
+
+    Args:
+        tiff_path: SARデータのGeoTIFF
+        dem: 処理する範囲（window）のグリッドのDEM（配列またはメモリマップ）
+        corrected_path: 地形補正後のdBの出力先
+        moisture_path: 水分量のクラス（uint8、255は欠損）の出力先
+        window: 処理する範囲（クリッピング）。Noneの場合はシーン全体
+        speckle: 地形補正の前にかけるスペックルフィルタ（SpeckleFilter）
+        aoi: 範囲外の画素をNaNにするAOI
+        target_pixels: 1ブロックの画素数の目安
+
+    Returns:
+        (補正前の統計値, 補正後の統計値)
+    """
+    raw_stats = BlockStats()
+    corrected_stats = BlockStats()
+    with rasterio.open(tiff_path) as src:
+        if window is None:
+            window = Window(0, 0, src.width, src.height)
+        profile = src.profile.copy()
+        profile.update(
+            driver='GTiff', count=1, dtype='float32', nodata=np.nan,
+            width=int(window.width), height=int(window.height),
+            transform=src.window_transform(window),
+            tiled=True, blockxsize=256, blockysize=256, compress='deflate'
+        )
+
+        moisture_profile = profile.copy()
+        moisture_profile.update(dtype='uint8', nodata=MOISTURE_NODATA)
+
+        with rasterio.open(corrected_path, 'w', **profile) as corrected_dst, \
+                rasterio.open(moisture_path, 'w', **moisture_profile) as moisture_dst:
+            for block_window in sar_block_windows(src, window, target_pixels):
+                vv_db = mask_sar_block(src, block_window, read_sar_block(src, block_window, speckle=speckle), aoi)
+                out_window = Window(block_window.col_off - window.col_off, block_window.row_off - window.row_off,
+                                    block_window.width, block_window.height)
+                rows, cols = out_window.toslices()
+                dem_block = np.asarray(dem[rows, cols])
+
+                corrected = apply_terrain_correction(vv_db, dem_block, None, verbose=False)
+                moisture_map, _ = estimate_moisture_by_elevation(corrected, dem_block, None)
+
+                corrected_dst.write(corrected.astype(np.float32), 1, window=out_window)
+                moisture_dst.write(moisture_map, 1, window=out_window)
+                raw_stats.update(vv_db)
+                corrected_stats.update(corrected)
+
+    return raw_stats.summary(), corrected_stats.summary()
+
+def process_scene_blocked(tiff_path, tag, output_dir, aoi=SADO_AOI, dem_resampler=None, speckle=None,
+                          target_pixels=BLOCK_TARGET_PIXELS):
+    """
+    1シーンをブロックごとに処理（シーン全体をメモリに読み込まない）
+
+    AOIを覆うウィンドウの統計値を表示し、DEMがある場合は地形補正後のdBと
+    水分量のクラスを <tag>_corrected.tif・<tag>_moisture.tif に出力する。
+    DEMはウィンドウのグリッドにリサンプリングしたメモリマップ（キャッシュ）を使う。
+
+    Returns:
+        {'raw': 補正前の統計値, 'corrected': 補正後の統計値（DEMがない場合はなし）}
+    """
+    with rasterio.open(tiff_path) as src:
+        window = aoi.window_for(src)
+        if window is None:
+            raise ValueError(f"{tiff_path} は解析範囲と重なっていません")
+        meta = src.meta.copy()
+        meta.update({
+            'width': int(window.width),
+            'height': int(window.height),
+            'transform': src.window_transform(window)
+        })
+
+    if dem_resampler is None:
+        stats = {'raw': sar_stats_blocked(tiff_path, window, speckle, aoi, target_pixels)}
+    else:
+        output_dir = Path(output_dir)
+        raw, corrected = process_sar_blocked(
+            tiff_path, dem_resampler.resample_to(meta),
+            output_dir / f"{tag}_corrected.tif", output_dir / f"{tag}_moisture.tif",
+            window, speckle, aoi, target_pixels
+        )
+        stats = {'raw': raw, 'corrected': corrected}
+        print(f"地形補正と水分量のGeoTIFFを保存しました: {output_dir / f'{tag}_corrected.tif'}, "
+              f"{output_dir / f'{tag}_moisture.tif'}")
+
+    for name, summary in stats.items():
+        print(f"{tag} の{'補正後' if name == 'corrected' else '補正前'}統計: {summary['count']}画素, "
+              f"min={summary['min']:.2f}dB, max={summary['max']:.2f}dB, "
+              f"mean={summary['mean']:.2f}dB, std={summary['std']:.2f}dB")
+    return stats
 
 def load_and_resample_dem(dem_path, ref_meta):
     """
     DEMを読み込み、SAR画像（ref_meta）に合わせてリサンプリング
+
+    SAR画像の範囲を覆うDEMのウィンドウだけを再投影し、結果はグリッドごとにキャッシュされる。
     """
-    with rasterio.open(dem_path) as dem_src:
-        dem = dem_src.read(1).astype(float)
-        dem_resampled = np.empty((ref_meta['height'], ref_meta['width']), dtype=float)
-        reproject(
-            source=dem,
-            destination=dem_resampled,
-            src_transform=dem_src.transform,
-            src_crs=dem_src.crs,
-            dst_transform=ref_meta['transform'],
-            dst_crs=ref_meta['crs'],
-            resampling=Resampling.bilinear
-        )
-    return dem_resampled
+    return DEMResampler(dem_path).resample_to(ref_meta)
 
-def apply_terrain_correction(vv_db, dem, metadata):
+def apply_terrain_correction(vv_db, dem, metadata, verbose=True, lut=TERRAIN_CORRECTION_LUT):
     """
     SARデータに標高に基づいた地形補正を適用
+
+    標高帯の判定と補正値の参照は参照テーブル（ElevationLUT）で1回ずつ行う。
+    lutに連続的な補正曲線を持つテーブルを渡すと、標高で補間した補正値を使う。
     """
     # データの統計値を計算
-    valid_data = vv_db[~np.isnan(vv_db)]
+    valid_data = vv_db[~np.isnan(vv_db)] if verbose else []
     if len(valid_data) > 0:
         data_min = np.min(valid_data)
         data_max = np.max(valid_data)
@@ -54,50 +354,22 @@ def apply_terrain_correction(vv_db, dem, metadata):
         
         print(f"データ統計: min={data_min:.2f}dB, max={data_max:.2f}dB, mean={data_mean:.2f}dB")
     
-    # 標高帯ごとの補正値を定義（より細かい調整）
-    elevation_correction = {
-        '0-200m': 0,      # 低地帯: 0dB補正
-        '200-400m': 1,    # 軽い丘陵: +1dB補正
-        '400-600m': 2,    # 中程度の丘陵: +2dB補正
-        '600-800m': 3,    # 山麓: +3dB補正
-        '800-1000m': 4,   # 山地: +4dB補正
-        '1000-1500m': 5,  # 高地: +5dB補正
-        '1500-2000m': 6   # 高山: +6dB補正
-    }
-    
-    # 標高帯を定義
-    elevation_bins = [0, 200, 400, 600, 800, 1000, 1500, 2000]
+    # 補正マップを作成（範囲外の標高は0dB補正）
+    band_index = lut.bin_index(dem) if lut.bins is not None else None
+    correction_map = lut.lookup(dem, band_index)
     
-    # 補正マップを作成
-    correction_map = np.zeros_like(dem)
+    # 補正値の適用範囲を確認
+    if verbose and band_index is not None:
+        for elev_range, count in zip(lut.labels, lut.band_counts(band_index)):
+            if count > 0:
+                print(f"標高帯 {elev_range}: {count} ピクセル")
     
-    # 標高帯ごとに補正値を適用
-    for i in range(len(elevation_bins)-1):
-        low = elevation_bins[i]
-        high = elevation_bins[i+1]
-        elev_range = f"{low}-{high}m"
-        
-        # 標高帯のマスク
-        mask = np.logical_and(dem >= low, dem < high)
-        
-        # 補正値を適用
-        correction_map[mask] = elevation_correction[elev_range]
-        
-        # 補正値の適用範囲を確認
-        if np.any(mask):
-            print(f"標高帯 {elev_range}: {np.sum(mask)} ピクセル")
-    
-    # 補正を適用
+    # 補正を適用してデータの範囲を調整（NaNはNaNのまま）
     corrected_vv = vv_db + correction_map
-    
-    # NaN値の処理
-    corrected_vv = np.where(np.isnan(corrected_vv), vv_db, corrected_vv)
-    
-    # データの範囲を調整
-    corrected_vv = np.clip(corrected_vv, -20, 0)
+    np.clip(corrected_vv, -20, 0, out=corrected_vv)
     
     # 補正後のデータの統計を表示
-    valid_corrected = corrected_vv[~np.isnan(corrected_vv)]
+    valid_corrected = corrected_vv[~np.isnan(corrected_vv)] if verbose else []
     if len(valid_corrected) > 0:
         corrected_min = np.min(valid_corrected)
         corrected_max = np.max(valid_corrected)
@@ -105,141 +377,60 @@ def apply_terrain_correction(vv_db, dem, metadata):
         print(f"補正後統計: min={corrected_min:.2f}dB, max={corrected_max:.2f}dB, mean={corrected_mean:.2f}dB")
     
     return corrected_vv
-    
-    # 標高帯ごとに補正値を適用
-    for i in range(len(elevation_bins)-1):
-        low = elevation_bins[i]
-        high = elevation_bins[i+1]
-        elev_range = f"{low}-{high}m"
-        
-        # 標高帯のマスク
-        mask = np.logical_and(dem >= low, dem < high)
-        
-        # 補正値を適用
-        correction_map[mask] = elevation_correction[elev_range]
-    
-    # 補正を適用
-    corrected_vv = vv_db + correction_map
-    
-    # NaN値の処理
-    corrected_vv = np.where(np.isnan(corrected_vv), vv_db, corrected_vv)
-    
-    # データの範囲を調整
-    corrected_vv = np.clip(corrected_vv, -20, 0)
-    
-    return corrected_vv
 
-def estimate_moisture_by_elevation(vv_db, dem, metadata):
+def estimate_moisture_by_elevation(vv_db, dem, metadata, classifier=MOISTURE_CLASSIFIER):
     """
     標高帯ごとに水分量を推定
+
+    Returns:
+        (水分量のクラス, 水分レベル)
+        水分量のクラスは uint8（0: 低水分, 1: 中水分, 2: 高水分, 255: 標高範囲外・欠損）、
+        水分レベルは標高範囲外・欠損をマスクしたvv_dbのビュー（コピーしない）
     """
-    # 標高帯を定義
-    elevation_bins = [0, 500, 1000, 1500, 2000]
-    
-    # 水分量推定用の閾値（標高帯ごとに異なる）
-    moisture_thresholds = {
-        '0-500m': (-15, -5),    # 低地帯
-        '500-1000m': (-20, -10),  # 山麓
-        '1000-1500m': (-25, -15), # 山地
-        '1500-2000m': (-30, -20)  # 高地
-    }
-    
-    # 結果を格納するマップ
-    moisture_map = np.zeros_like(vv_db)
-    moisture_levels = np.zeros_like(vv_db)
-    
-    for i in range(len(elevation_bins)-1):
-        low = elevation_bins[i]
-        high = elevation_bins[i+1]
-        elev_range = f"{low}-{high}m"
-        
-        # 標高帯のマスク
-        mask = np.logical_and(dem >= low, dem < high)
-        
-        # 水分量推定
-        moisture_map[mask] = np.where(
-            vv_db[mask] < moisture_thresholds[elev_range][0],
-            1,  # 高水分
-            np.where(
-                vv_db[mask] < moisture_thresholds[elev_range][1],
-                0.5,  # 中水分
-                0    # 低水分
-            )
-        )
-        
-        # 水分レベルの追加情報を保存
-        moisture_levels[mask] = vv_db[mask]
-    
+    moisture_map = classifier.classify(vv_db, dem)
+    moisture_levels = np.ma.masked_array(vv_db, mask=moisture_map == MOISTURE_NODATA, copy=False)
     return moisture_map, moisture_levels
 
 def sado_island_clip(data, metadata):
     """
     佐渡島の範囲（bbox）でデータをクリッピング
+
+    読み込み済みの配列を切り出すため、新しいコードではAOI.readで範囲だけを読み込むこと。
     """
-    # 佐渡島の範囲（bbox）
-    sado_bbox = {
-        'min_lon': 138.17,  # 経度最小
-        'min_lat': 37.81,   # 緯度最小
-        'max_lon': 138.61,  # 経度最大
-        'max_lat': 38.34    # 緯度最大
-    }
-    
-    # メタデータから変換行列を取得
-    transform = metadata['transform']
-    
-    # 経度緯度をピクセル座標に変換
-    def lonlat_to_pixel(lon, lat):
-        # rasterioのwindow_from_coordinatesを使用
-        window = rasterio.windows.from_bounds(
-            left=lon,
-            bottom=lat,
-            right=lon,
-            top=lat,
-            transform=transform
-        )
-        return int(window.col_off), int(window.row_off)
-    
-    # ピクセル座標を計算
-    left, top = lonlat_to_pixel(sado_bbox['min_lon'], sado_bbox['max_lat'])
-    right, bottom = lonlat_to_pixel(sado_bbox['max_lon'], sado_bbox['min_lat'])
-    
-    # クリッピング範囲を計算
-    width = right - left
-    height = bottom - top
+    window = SADO_AOI.window(metadata['transform'], data.shape[1], data.shape[0], metadata.get('crs'))
+    if window is None:
+        raise ValueError("データが佐渡島の範囲と重なっていません")
     
     # データをクリッピング
-    clipped_data = data[top:bottom, left:right]
+    clipped_data = data[window.toslices()]
     
     # クリップ後のメタデータを更新
     clipped_meta = metadata.copy()
     clipped_meta.update({
-        'width': width,
-        'height': height,
-        'transform': rasterio.Affine(
-            transform[0], transform[1], 
-            left * transform[0] + transform[2],
-            transform[3], transform[4], 
-            top * transform[4] + transform[5]
-        )
+        'width': int(window.width),
+        'height': int(window.height),
+        'transform': rasterio.windows.transform(window, metadata['transform'])
     })
     
     return clipped_data, clipped_meta
 
-def visualize_moisture_with_elevation(vv_db, dem, metadata, output_path):
+def visualize_moisture_with_elevation(vv_db, dem, metadata, output_path, corrected_vv=None, moisture=None):
     """
     地形補正後の水分量を標高データとともに可視化
+
+    vv_dbとdemは同じグリッド（クリッピング済み）のデータを渡す。
+    corrected_vv・moisture（estimate_moisture_by_elevationの結果）を渡した場合は再計算しない。
     """
     plt.figure(figsize=(18, 6))
     
-    # 佐渡島範囲でのクリッピング
-    vv_db, metadata = sado_island_clip(vv_db, metadata)
-    dem, _ = sado_island_clip(dem, metadata)
-    
     # 地形補正を適用
-    corrected_vv = apply_terrain_correction(vv_db, dem, metadata)
+    if corrected_vv is None:
+        corrected_vv = apply_terrain_correction(vv_db, dem, metadata)
     
     # 水分量推定
-    moisture_map, moisture_levels = estimate_moisture_by_elevation(corrected_vv, dem, metadata)
+    if moisture is None:
+        moisture = estimate_moisture_by_elevation(corrected_vv, dem, metadata)
+    moisture_map, moisture_levels = moisture
     
     # サブプロット1: 地形補正後のSARデータ
     plt.subplot(1, 4, 1)
@@ -249,11 +440,11 @@ def visualize_moisture_with_elevation(vv_db, dem, metadata, output_path):
     
     # サブプロット2: 水分量マップ
     plt.subplot(1, 4, 2)
-    plt.imshow(moisture_map, cmap='Blues', vmin=0, vmax=1)
+    plt.imshow(np.ma.masked_equal(moisture_map, MOISTURE_NODATA), cmap='Blues', vmin=0, vmax=2)
     plt.title('Estimated Moisture Content')
     cbar = plt.colorbar(label='Moisture Level')
-    cbar.set_ticks([0, 0.5, 1])
-    cbar.set_ticklabels(['Low', 'Medium', 'High'])
+    cbar.set_ticks([0, 1, 2])
+    cbar.set_ticklabels(MOISTURE_LABELS)
     
     # サブプロット3: 水分レベルの分布
     plt.subplot(1, 4, 3)
@@ -285,12 +476,13 @@ def analyze_sar_by_elevation(vv_db, dem, output_path):
         high = elevation_bins[i+1]
         mask = np.logical_and(dem >= low, dem < high)
         valid_pixels = vv_db[mask]
+        valid_pixels = valid_pixels[~np.isnan(valid_pixels)]  # 欠損と解析範囲外を除く
         
         if len(valid_pixels) > 0:
             stats.append({
                 'elevation_range': f"{low}-{high}m",
-                'mean': np.nanmean(valid_pixels),
-                'std': np.nanstd(valid_pixels),
+                'mean': np.mean(valid_pixels),
+                'std': np.std(valid_pixels),
                 'count': len(valid_pixels)
             })
     
@@ -333,6 +525,53 @@ def visualize_raw_sar(db_data, metadata, output_path):
     plt.close()
     print(f"原始SARデータを保存しました: {output_path}")
 
+def write_polarimetric_tiff(products, metadata, output_path):
+    """
+    偏波のプロダクト（dual_pol_productsの結果）を多バンドのGeoTIFFで保存
+    """
+    profile = {
+        'driver': 'GTiff',
+        'count': products.shape[0],
+        'dtype': 'float32',
+        'nodata': np.nan,
+        'crs': metadata['crs'],
+        'transform': metadata['transform'],
+        'height': products.shape[1],
+        'width': products.shape[2],
+        'tiled': True,
+        'blockxsize': 256,
+        'blockysize': 256,
+        'compress': 'deflate'
+    }
+    with rasterio.open(output_path, 'w', **profile) as dst:
+        dst.write(products)
+        for band, name in enumerate(POLARIMETRIC_PRODUCTS, start=1):
+            dst.set_band_description(band, name)
+
+def visualize_polarimetric(products, output_path):
+    """
+    VV/VH比・RVI・交差偏波（VH）のdBを並べて可視化
+    """
+    panels = [
+        ('vv_vh_ratio_db', 'VV/VH Ratio', 'Ratio (dB)', 'viridis'),
+        ('rvi', 'Radar Vegetation Index', 'RVI', 'YlGn'),
+        ('cross_pol_db', 'Cross-pol (VH)', 'Backscatter (dB)', 'gray')
+    ]
+    fig, axes = plt.subplots(1, len(panels), figsize=(18, 6))
+    for ax, (name, title, label, cmap) in zip(axes, panels):
+        data = products[POLARIMETRIC_PRODUCTS.index(name)]
+        if np.isnan(data).all():
+            vmin, vmax = 0, 1
+        else:
+            vmin, vmax = np.nanpercentile(data, [1, 99])
+        im = ax.imshow(data, cmap=cmap, vmin=vmin, vmax=vmax)
+        ax.set_title(title)
+        fig.colorbar(im, ax=ax, fraction=0.046, pad=0.04).set_label(label)
+    plt.tight_layout()
+    plt.savefig(output_path, dpi=300, bbox_inches='tight')
+    plt.close()
+    print(f"偏波のプロダクトを保存しました: {output_path}")
+
 def visualize_soil_moisture(db_data, metadata, output_path):
     """
     土壌水分量を可視化
@@ -374,17 +613,185 @@ def visualize_soil_moisture(db_data, metadata, output_path):
     plt.close()
     print(f"可視化結果を保存しました: {output_path}")
 
+class SARScene:
+    """
+    1シーン分のSARデータ
+
+    解析範囲（AOI）を覆うウィンドウだけを1回読み込み、全てのプロダクトで共有する。
+    AOIがポリゴンの場合と、ラスタと座標系が異なる場合は、範囲外の画素はNaNにして統計や可視化から除く。
+    DEMと地形補正後のデータは必要になったときに1回だけ計算する。
+    scheduler（TileScheduler）を指定した場合、画素ごとの処理はタイルに分割して並列に行う。
+    speckle（SpeckleFilter）を指定した場合、読み込み時にスペックルフィルタをかける。
+    """
+
+    def __init__(self, tiff_path, tag, dem_resampler=None, aoi=SADO_AOI, scheduler=None, speckle=None):
+        self.tiff_path = tiff_path
+        self.tag = tag
+        self.dem_resampler = dem_resampler
+        self.aoi = aoi
+        self.scheduler = scheduler
+        self.speckle = speckle
+        self.vv_db, self.meta = process_sar_tiff(tiff_path, aoi, scheduler, speckle)
+        if aoi.needs_mask(self.meta['crs']):
+            self.vv_db[~aoi.mask(self.meta['transform'], self.vv_db.shape, self.meta['crs'])] = np.nan
+
+    @property
+    def has_cross_pol(self):
+        """VHバンドを含むか（VV・VH・dataMaskの順の多バンドのTIFF）"""
+        return self.meta['count'] >= band_index('VH')
+
+    @cached_property
+    def polarimetric(self):
+        """
+        VV/VH比・RVI・交差偏波のdB（dual_pol_productsの結果、(4, 行, 列)）
+
+        VV・VH・dataMaskを1回で読み込み、全てのプロダクトを1回の走査で計算する。
+        """
+        if not self.has_cross_pol:
+            raise ValueError(f"{self.tiff_path} にVHバンドがありません")
+        bands = [band_index(name) for name in SAR_BANDS if band_index(name) <= self.meta['count']]
+        # スペックルフィルタはAOIの周囲に窓の半径分を広げて読み込んだ範囲にかけてから切り落とす
+        halo = self.speckle.halo if self.speckle is not None else 0
+        data, _, crop = read_aoi_padded(self.tiff_path, self.aoi, halo, band=bands)
+        vv_linear = data[band_index('VV') - 1]
+        vh_linear = data[band_index('VH') - 1]
+        if self.speckle is not None:
+            vv_linear = self.speckle(vv_linear)
+            vh_linear = self.speckle(vh_linear)
+        vv_linear, vh_linear = vv_linear[crop], vh_linear[crop]
+        data_mask = data[band_index('dataMask') - 1][crop] if len(bands) >= band_index('dataMask') else None
+        products = dual_pol_products(vv_linear, vh_linear, data_mask)
+        if self.aoi.needs_mask(self.meta['crs']):
+            products[:, ~self.aoi.mask(self.meta['transform'], products.shape[1:], self.meta['crs'])] = np.nan
+        return products
+
+    @cached_property
+    def dem(self):
+        """クリッピング後のグリッドにリサンプリングしたDEM"""
+        if self.dem_resampler is None:
+            raise ValueError("DEMが設定されていません")
+        return self.dem_resampler.resample_to(self.meta)
+
+    @cached_property
+    def corrected_vv(self):
+        """地形補正後のデータ"""
+        if self.scheduler is not None:
+            return self.scheduler.map(partial(apply_terrain_correction, metadata=None, verbose=False),
+                                      self.vv_db, self.dem)
+        return apply_terrain_correction(self.vv_db, self.dem, self.meta)
+
+    @cached_property
+    def moisture(self):
+        """水分量のクラスと水分レベル（estimate_moisture_by_elevationの結果）"""
+        if self.scheduler is not None:
+            return self.scheduler.map(partial(estimate_moisture_by_elevation, metadata=None),
+                                      self.corrected_vv, self.dem)
+        return estimate_moisture_by_elevation(self.corrected_vv, self.dem, self.meta)
+
+
+# プロダクト名 -> (シーンと出力ディレクトリを受け取る関数, DEMが必要か)
+SAR_PRODUCTS = {}
+
+def register_product(name, needs_dem=False):
+    """
+    シーンから出力を作るプロダクトを登録するデコレータ
+    """
+    def decorator(fn):
+        SAR_PRODUCTS[name] = (fn, needs_dem)
+        return fn
+    return decorator
+
+@register_product('raw')
+def raw_product(scene, output_dir):
+    """原始SARデータの可視化"""
+    visualize_raw_sar(scene.vv_db, scene.meta, output_dir / f"{scene.tag}_raw.png")
+
+@register_product('moisture', needs_dem=True)
+def moisture_product(scene, output_dir):
+    """水分量と標高の重ね合わせ可視化"""
+    moisture_output = output_dir / f"{scene.tag}_moisture.png"
+    visualize_moisture_with_elevation(scene.vv_db, scene.dem, scene.meta, moisture_output,
+                                      corrected_vv=scene.corrected_vv, moisture=scene.moisture)
+    print(f"水分量と標高の重ね合わせ可視化を保存しました: {moisture_output}")
+
+@register_product('elevation_stats', needs_dem=True)
+def elevation_stats_product(scene, output_dir):
+    """標高帯ごとのSAR値の統計"""
+    stats_output = output_dir / f"{scene.tag}_elevation_stats.csv"
+    analyze_sar_by_elevation(scene.vv_db, scene.dem, stats_output)
+    print(f"標高帯ごとの統計を保存しました: {stats_output}")
+
+@register_product('polarimetric')
+def polarimetric_product(scene, output_dir):
+    """VV/VH比・RVI・交差偏波のGeoTIFFと可視化（VHバンドがないシーンは出力しない）"""
+    if not scene.has_cross_pol:
+        print(f"{scene.tag} はVHバンドを含まないため、偏波のプロダクトを出力しません")
+        return
+    tiff_output = output_dir / f"{scene.tag}_polarimetric.tif"
+    write_polarimetric_tiff(scene.polarimetric, scene.meta, tiff_output)
+    print(f"偏波のプロダクトのGeoTIFFを保存しました: {tiff_output}")
+    visualize_polarimetric(scene.polarimetric, output_dir / f"{scene.tag}_polarimetric.png")
+
+@register_product('soil_moisture')
+def soil_moisture_product(scene, output_dir):
+    """土壌水分量の可視化"""
+    visualize_soil_moisture(scene.vv_db, scene.meta, output_dir / f"{scene.tag}_analysis.png")
+
+def run_products(scene, products, output_dir):
+    """
+    1シーンから選択されたプロダクトを順に出力
+
+    Returns:
+        {プロダクト名: エラーメッセージ} 失敗したプロダクトのみ
+    """
+    errors = {}
+    for name in products:
+        fn, _ = SAR_PRODUCTS[name]
+        try:
+            fn(scene, output_dir)
+        except Exception as e:
+            print(f"{scene.tag} の {name} の出力に失敗しました。エラー: {e}")
+            errors[name] = str(e)
+    return errors
+
 def main():
     """
     sar_dataディレクトリ内のすべてのTIFFファイルを処理するメイン関数。
+
+    各シーンは1回だけ読み込み・クリッピングし、選択された全てのプロダクトに渡す。
     """
+    parser = argparse.ArgumentParser(description='Sentinel-1 SARデータの分析')
+    parser.add_argument('--products', nargs='+', choices=list(SAR_PRODUCTS), default=list(SAR_PRODUCTS),
+                        help='出力するプロダクト（デフォルトは全て）')
+    aoi_group = parser.add_mutually_exclusive_group()
+    aoi_group.add_argument('--aoi', help='解析範囲のポリゴンのベクタファイル（GeoJSON・Shapefileなど）')
+    aoi_group.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                           help='解析範囲のbbox（デフォルトは佐渡島）')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='シーンを並列に処理するプロセス数（2以上でプロセスプールを使用）')
+    parser.add_argument('--tile-workers', type=int, default=1,
+                        help='1シーンをタイルに分割して並列に処理するスレッド数（2以上で使用）')
+    parser.add_argument('--tile-size', type=int, default=DEFAULT_TILE_SIZE, help='タイルの一辺の画素数')
+    parser.add_argument('--speckle', choices=('none',) + SPECKLE_METHODS, default='none',
+                        help='地形補正の前にかけるスペックルフィルタ')
+    parser.add_argument('--speckle-size', type=int, default=7, help='スペックルフィルタの窓の大きさ（奇数）')
+    parser.add_argument('--blocked', action='store_true',
+                        help='シーン全体を読み込まずにブロックごとに処理する（統計値と、DEMが必要なプロダクトを'
+                             '選択した場合は地形補正・水分量のGeoTIFFを出力し、画像は出力しない）')
+    args = parser.parse_args()
+
+    if args.aoi:
+        aoi = AOI.from_file(args.aoi)
+    elif args.bbox:
+        aoi = AOI.from_bbox(args.bbox)
+    else:
+        aoi = SADO_AOI
+
     input_dir = Path('sar_data')
     output_dir = Path('analysis_results')
     output_dir.mkdir(exist_ok=True)
 
     dem_path = Path('dem/dem.tif')
-    dem_loaded = False
-    dem = None
 
     if not input_dir.exists():
         print(f"エラー: 入力ディレクトリ '{input_dir}' が見つかりません。")
@@ -396,41 +803,63 @@ def main():
         print(f"'{input_dir}' にTIFFファイルが見つかりません。")
         return
 
-    if not dem_path.exists():
-        print(f"エラー: DEMファイル '{dem_path}' が見つかりません。dem_download.py を使ってダウンロードしてください。")
+    # DEMはDEMが必要なプロダクトを選択した場合のみ使用
+    products = list(dict.fromkeys(args.products))
+    dem_resampler = None
+    if any(SAR_PRODUCTS[name][1] for name in products):
+        if not dem_path.exists():
+            print(f"エラー: DEMファイル '{dem_path}' が見つかりません。dem_download.py を使ってダウンロードしてください。")
+            return
+        # DEMはシーンごとのグリッドに合わせてリサンプリング（同じグリッドはキャッシュを使用）
+        dem_resampler = DEMResampler(dem_path)
+
+    speckle = None if args.speckle == 'none' else SpeckleFilter(args.speckle, args.speckle_size)
+
+    if args.blocked:
+        # メモリに収まらない大きなシーンはブロックごとに処理（ピークメモリはブロックサイズで決まる）
+        for tiff_file in tiff_files:
+            tag = tiff_file.relative_to(input_dir).parts[0]
+            print(f"{tiff_file.name} をブロックごとに処理中...")
+            try:
+                process_scene_blocked(tiff_file, tag, output_dir, aoi, dem_resampler, speckle)
+            except Exception as e:
+                print(f"{tiff_file.name} の処理に失敗しました。エラー: {e}")
+        if dem_resampler is not None:
+            dem_resampler.print_stats()
         return
 
-    for tiff_path in tiff_files:
-        tag = str(tiff_path).split('/')[1]
-        vv_db, meta = process_sar_tiff(tiff_path)
-        if not dem_loaded:
-            dem = load_and_resample_dem(str(dem_path), meta)
-            dem_loaded = True
-        
-        # 水分量と標高の重ね合わせ可視化
-        moisture_output = output_dir / (tag + '_moisture.png')
-        visualize_moisture_with_elevation(vv_db, dem, meta, moisture_output)
-        print(f"水分量と標高の重ね合わせ可視化を保存しました: {moisture_output}")
-        
-        # 通常のSAR可視化も従来通り実行
+    if args.workers > 1:
+        # シーンをプロセスプールで並列に処理（DEMは共有メモリで共有）
+        from sar_parallel import SARSceneRunner
+        runner = SARSceneRunner(products, output_dir, aoi, dem_resampler, max_workers=args.workers, speckle=speckle)
+        scenes = [(tiff_file, tiff_file.relative_to(input_dir).parts[0]) for tiff_file in tiff_files]
+        results = runner.run(scenes)
+        failed = sum(1 for result in results if result['error'] is not None or result['errors'])
+        print(f"{len(results)}シーンを処理しました（失敗: {failed}シーン）")
+        if dem_resampler is not None:
+            dem_resampler.print_stats()
+        return
+
+    scheduler = None
+    if args.tile_workers > 1:
+        scheduler = TileScheduler(tile_size=args.tile_size, halo=speckle.halo if speckle else 0,
+                                  max_workers=args.tile_workers)
 
     for tiff_file in tiff_files:
-        print(str(tiff_file).split('/')[1])
+        tag = tiff_file.relative_to(input_dir).parts[0]
+        print(tag)
         print(f"{tiff_file.name} を処理中...")
         try:
-            db_data, metadata = process_sar_tiff(tiff_file)
-            db_data, metadata = sado_island_clip(db_data, metadata)
-
-            # 原始SARデータの保存
-            raw_output = output_dir / f"{str(tiff_file).split('/')[1]}_raw.png"
-            visualize_raw_sar(db_data, metadata, raw_output)
-
-            # 出力ファイル名を作成
-            output_filename = output_dir / f"{str(tiff_file).split('/')[1]}_analysis.png"
-
-            visualize_soil_moisture(db_data, metadata, output_filename)
+            scene = SARScene(tiff_file, tag, dem_resampler, aoi, scheduler, speckle)
         except Exception as e:
             print(f"{tiff_file.name} の処理に失敗しました。エラー: {e}")
+            continue
+        run_products(scene, products, output_dir)
+        if scheduler is not None:
+            scheduler.print_timings()
+
+    if dem_resampler is not None:
+        dem_resampler.print_stats()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,146 @@
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.errors import WindowError
+from rasterio.features import geometry_mask
+from rasterio.warp import transform_bounds, transform_geom
+from rasterio.windows import Window, from_bounds
+from shapely.geometry import box, mapping
+from shapely.ops import unary_union
+
+# 佐渡島の範囲（min_lon, min_lat, max_lon, max_lat）
+SADO_BBOX = (138.17, 37.81, 138.61, 38.34)
+
+
+class AOI:
+    """
+    解析対象の範囲（Area of Interest）
+
+    bboxまたはshapely/geopandasのポリゴンで範囲を指定し、
+    ラスタを読み込む前に範囲を覆うウィンドウを計算して、範囲内の画素だけを読み込む。
+    ポリゴンの場合は、グリッドごとにラスタ化したマスクをキャッシュして統計に使う。
+    """
+
+    def __init__(self, geometry, crs='EPSG:4326'):
+        """
+        Args:
+            geometry: 範囲のshapelyのジオメトリ
+            crs: ジオメトリの座標系
+        """
+        self.geometry = geometry
+        self.crs = CRS.from_user_input(crs)
+        self.is_box = geometry.equals(box(*geometry.bounds))
+        self._masks = {}
+
+    @classmethod
+    def from_bbox(cls, bbox, crs='EPSG:4326'):
+        """bbox (min_x, min_y, max_x, max_y) から作成"""
+        return cls(box(*bbox), crs)
+
+    @classmethod
+    def from_geodataframe(cls, gdf):
+        """GeoDataFrameの全てのジオメトリを結合した範囲を作成"""
+        return cls(unary_union(list(gdf.geometry)), gdf.crs or 'EPSG:4326')
+
+    @classmethod
+    def from_file(cls, path):
+        """ベクタファイル（GeoJSON・Shapefileなど）から作成"""
+        import geopandas as gpd
+        return cls.from_geodataframe(gpd.read_file(path))
+
+    def bounds_in(self, crs):
+        """指定した座標系での範囲の外接矩形"""
+        crs = self.crs if crs is None else CRS.from_user_input(crs)
+        if crs == self.crs:
+            return self.geometry.bounds
+        return transform_bounds(self.crs, crs, *self.geometry.bounds, densify_pts=21)
+
+    def geometry_in(self, crs):
+        """指定した座標系に変換したジオメトリ（GeoJSON形式）"""
+        crs = self.crs if crs is None else CRS.from_user_input(crs)
+        if crs == self.crs:
+            return mapping(self.geometry)
+        return transform_geom(self.crs, crs, mapping(self.geometry))
+
+    def window(self, transform, width, height, crs=None):
+        """
+        範囲を覆うピクセルのウィンドウを計算（ラスタと重ならない場合はNone）
+
+        Args:
+            transform: ラスタのアフィン変換
+            width, height: ラスタのサイズ
+            crs: ラスタの座標系（Noneの場合は範囲と同じ座標系とみなす）
+        """
+        window = from_bounds(*self.bounds_in(crs), transform=transform)
+        col_start = int(np.floor(window.col_off))
+        row_start = int(np.floor(window.row_off))
+        col_stop = int(np.ceil(window.col_off + window.width))
+        row_stop = int(np.ceil(window.row_off + window.height))
+        window = Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
+        try:
+            return window.intersection(Window(0, 0, width, height))
+        except WindowError:
+            return None
+
+    def window_for(self, src):
+        """開いているデータセットに対するウィンドウ"""
+        return self.window(src.transform, src.width, src.height, src.crs)
+
+    def needs_mask(self, crs=None):
+        """
+        ウィンドウ内に範囲外の画素があり得るか
+
+        ポリゴンの場合と、ラスタの座標系が範囲と異なるbboxの場合（変換したbboxは
+        ラスタの軸に平行にならず、ウィンドウの角が範囲外になる）はTrue。
+        """
+        if not self.is_box:
+            return True
+        return crs is not None and CRS.from_user_input(crs) != self.crs
+
+    def mask(self, transform, shape, crs=None, cache=True):
+        """
+        範囲内の画素をTrueとするマスク（グリッドごとにキャッシュ）
+
+        Args:
+            transform: グリッドのアフィン変換
+            shape: グリッドの形状 (height, width)
+            crs: グリッドの座標系
+            cache: キャッシュするか（ブロックごとのマスクなど、再利用しない場合はFalse）
+        """
+        shape = (int(shape[0]), int(shape[1]))
+        crs_key = None if crs is None else CRS.from_user_input(crs).to_wkt()
+        key = (crs_key, tuple(transform)[:6], shape)
+        mask = self._masks.get(key)
+        if mask is None:
+            if not self.needs_mask(crs):
+                # 座標系が同じbboxの場合、ウィンドウ内は全て範囲内
+                mask = np.ones(shape, dtype=bool)
+            else:
+                mask = geometry_mask([self.geometry_in(crs)], out_shape=shape, transform=transform, invert=True)
+            mask.flags.writeable = False
+            if cache:
+                self._masks[key] = mask
+        return mask
+
+    def read(self, tiff_path, band=1):
+        """
+        範囲を覆うウィンドウだけを読み込む
+
+        ウィンドウ内の範囲外の画素はそのまま返すため、needs_maskがTrueの場合は
+        maskで範囲外の画素を除くこと。
+
+        Returns:
+            (データ, ウィンドウに合わせて更新したメタデータ)
+        """
+        with rasterio.open(tiff_path) as src:
+            window = self.window_for(src)
+            if window is None:
+                raise ValueError(f"{tiff_path} は解析範囲と重なっていません")
+            data = src.read(band, window=window)
+            meta = src.meta.copy()
+            meta.update({
+                'width': int(window.width),
+                'height': int(window.height),
+                'transform': src.window_transform(window)
+            })
+        return data, meta
@@ -0,0 +1,194 @@
+import math
+import os
+import time
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from sentinelhub import BBox, MimeType
+from sentinelhub.decoding import decode_data
+from sentinelhub.geo_utils import to_utm_bbox
+
+from scene_downloader import SceneDownloader
+
+MAX_REQUEST_PIXELS = 2500  # Process APIの1リクエストあたりの幅・高さの上限
+
+
+class TilingPlan:
+    """
+    大きなAOIをProcess APIの画素数の上限以下のタイルに分割した計画
+
+    AOIはUTMに変換して解像度の格子に合わせ、上限を超える場合はタイルの境界を
+    (上限の画素数 × 解像度) の大域的な格子に揃える。
+    同じ解像度であれば、重なるAOIのタイルは同じ範囲になる。
+    """
+
+    def __init__(self, crs, resolution, min_x, max_y, width, height, tiles):
+        self.crs = crs
+        self.resolution = resolution
+        self.width = width
+        self.height = height
+        self.transform = from_origin(min_x, max_y, resolution, resolution)
+        self.tiles = tiles  # [{'bbox': BBox, 'size': (width, height), 'window': Window}]
+
+    @property
+    def needs_tiling(self):
+        return len(self.tiles) > 1
+
+    def __repr__(self):
+        return f"TilingPlan({self.width}x{self.height}px, {len(self.tiles)}タイル, {self.crs})"
+
+
+def plan_tiles(bbox, resolution, max_pixels=MAX_REQUEST_PIXELS):
+    """
+    AOIをグリッドに揃えたタイルに分割
+
+    Args:
+        bbox: AOIのBBox
+        resolution: 解像度（m）
+        max_pixels: 1タイルの幅・高さの上限
+
+    Returns:
+        TilingPlan
+    """
+    utm_bbox = to_utm_bbox(bbox)
+    # 解像度の格子での画素の番号（整数）で計算し、座標には最後に変換する
+    # （解像度がfloatでもrangeで格子の境界を列挙できる）
+    min_col = math.floor(utm_bbox.min_x / resolution)
+    min_row = math.floor(utm_bbox.min_y / resolution)
+    max_col = math.ceil(utm_bbox.max_x / resolution)
+    max_row = math.ceil(utm_bbox.max_y / resolution)
+    width = max_col - min_col
+    height = max_row - min_row
+    min_x = min_col * resolution
+    max_y = max_row * resolution
+
+    if width <= max_pixels and height <= max_pixels:
+        # 上限以下の場合は分割しない
+        tiles = [{
+            'bbox': BBox((min_x, min_row * resolution, max_col * resolution, max_y), crs=utm_bbox.crs),
+            'size': (width, height),
+            'window': Window(0, 0, width, height)
+        }]
+        return TilingPlan(utm_bbox.crs, resolution, min_x, max_y, width, height, tiles)
+
+    tiles = []
+    # 北から南、西から東の順に大域的な格子（max_pixels画素ごと）の境界で区切る
+    row_edges = [max_row] + [
+        row for row in range((max_row // max_pixels) * max_pixels, min_row, -max_pixels)
+        if min_row < row < max_row
+    ] + [min_row]
+    col_edges = [min_col] + [
+        col for col in range(-(-min_col // max_pixels) * max_pixels, max_col, max_pixels)
+        if min_col < col < max_col
+    ] + [max_col]
+    for top, bottom in zip(row_edges[:-1], row_edges[1:]):
+        for left, right in zip(col_edges[:-1], col_edges[1:]):
+            tiles.append({
+                'bbox': BBox((left * resolution, bottom * resolution, right * resolution, top * resolution),
+                             crs=utm_bbox.crs),
+                'size': (right - left, top - bottom),
+                'window': Window(left - min_col, max_row - top, right - left, top - bottom)
+            })
+    return TilingPlan(utm_bbox.crs, resolution, min_x, max_y, width, height, tiles)
+
+
+class Mosaic:
+    """
+    タイルの画像を1枚の配列に組み立てる（取得に失敗したタイルは0のまま）
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.data = None
+        self.received = 0
+        self.errors = {}
+
+    @property
+    def done(self):
+        return self.received + len(self.errors) == len(self.plan.tiles)
+
+    def add(self, index, tile):
+        """タイルの画像 (H, W) または (H, W, C) を配置"""
+        tile = np.asarray(tile)
+        if self.data is None:
+            self.data = np.zeros((self.plan.height, self.plan.width) + tile.shape[2:], dtype=tile.dtype)
+        rows, cols = self.plan.tiles[index]['window'].toslices()
+        self.data[rows, cols] = tile
+        self.received += 1
+
+    def add_error(self, index, error):
+        self.errors[index] = error
+
+    def write_geotiff(self, output_path):
+        """
+        組み立てた画像をGeoTIFF（タイル構成・deflate圧縮）で保存
+        """
+        if self.data is None:
+            raise ValueError("取得できたタイルがありません")
+        data = self.data if self.data.ndim == 3 else self.data[..., np.newaxis]
+        os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+        profile = {
+            'driver': 'GTiff',
+            'width': self.plan.width,
+            'height': self.plan.height,
+            'count': data.shape[2],
+            'dtype': data.dtype,
+            'crs': f"EPSG:{self.plan.crs.epsg}",
+            'transform': self.plan.transform,
+            'tiled': True,
+            'blockxsize': 256,
+            'blockysize': 256,
+            'compress': 'deflate'
+        }
+        with rasterio.open(output_path, 'w', **profile) as dst:
+            dst.write(np.moveaxis(data, 2, 0))
+        return output_path
+
+
+def download_mosaic(plan, make_request, sh_config, output_path=None, mime_type=MimeType.TIFF,
+                    max_workers=4, rate=5.0, downloader=None, cache=None, allow_partial=False):
+    """
+    タイルを並列にダウンロードして1枚の画像に組み立てる
+
+    取得できなかったタイルがある場合は、その範囲が0の画像を返さずにNoneを返す
+    （allow_partial=Trueの場合は組み立てた画像を返す）。
+
+    Args:
+        plan: TilingPlan
+        make_request: (タイルのBBox, サイズ) を受け取りSentinelHubRequestを返す関数
+        sh_config: SentinelHubの設定
+        output_path: GeoTIFFの保存先（Noneの場合は配列を返す）
+        mime_type: レスポンスの形式
+        max_workers: 同時にダウンロードするタイル数
+        rate: 1秒あたりのリクエスト数の上限
+        downloader: SceneDownloader（Noneの場合は作成する）
+        cache: RequestCache
+        allow_partial: 一部のタイルを取得できなかった場合も画像を返すか
+
+    Returns:
+        (GeoTIFFのパスまたは配列（取得できなかった場合はNone）, {タイル番号: エラー})
+    """
+    download_requests = [
+        make_request(tile['bbox'], tile['size']).download_list[0] for tile in plan.tiles
+    ]
+    if downloader is None:
+        downloader = SceneDownloader(sh_config, max_workers=max_workers, rate=rate, cache=cache)
+
+    print(f"{plan.width}x{plan.height}px の範囲を{len(plan.tiles)}タイルに分割してダウンロードします")
+    start = time.monotonic()
+    mosaic = Mosaic(plan)
+    for index, content, error in downloader.download(download_requests):
+        if error is not None:
+            print(f"タイル{index}を取得できませんでした: {error}")
+            mosaic.add_error(index, error)
+            continue
+        mosaic.add(index, decode_data(content, mime_type))
+    print(f"{mosaic.received}/{len(plan.tiles)}タイルを取得しました（{time.monotonic() - start:.1f}秒）")
+
+    if mosaic.data is None or (mosaic.errors and not allow_partial):
+        return None, mosaic.errors
+    if output_path is not None:
+        return mosaic.write_geotiff(output_path), mosaic.errors
+    return mosaic.data, mosaic.errors
@@ -0,0 +1,206 @@
+import os
+from itertools import combinations
+from pathlib import Path
+
+import numpy as np
+import rasterio
+
+from analyze_sar_data import sar_block_windows
+
+CHANGE_METHODS = ('log_ratio', 'db_difference')
+PAIR_MODES = ('consecutive', 'all')
+# 1入力あたり1ブロック（float32で4MB）。数十シーンを同時に開いてもメモリに収まる大きさ
+CHANGE_BLOCK_PIXELS = 1024 * 1024
+# 同時に開く出力ファイル数の上限（'all'では組の数がシーン数の2乗で増え、ファイル記述子の上限を超えるため）
+MAX_OPEN_OUTPUTS = 64
+
+
+def scene_pairs(count, mode='consecutive'):
+    """
+    比較するシーンの組 (前, 後) のインデックスのリスト
+
+    Args:
+        count: シーン数
+        mode: 'consecutive'（隣り合うシーン）または 'all'（すべての組み合わせ）
+    """
+    if mode not in PAIR_MODES:
+        raise ValueError(f"pairsは{PAIR_MODES}のいずれかを指定してください: {mode}")
+    if mode == 'consecutive':
+        return [(i, i + 1) for i in range(count - 1)]
+    return list(combinations(range(count), 2))
+
+
+def scene_name(path):
+    """出力ファイル名に使うシーン名（sar_data/<取得名>/response.tiff の場合は取得名）"""
+    path = Path(path)
+    return path.parent.name if path.stem == 'response' else path.stem
+
+
+def change_output_path(output_dir, before, after, method):
+    """変化量のGeoTIFFの保存先（例: <前>__<後>_log_ratio.tif）"""
+    return os.path.join(output_dir, f"{scene_name(before)}__{scene_name(after)}_{method}.tif")
+
+
+def check_alignment(sources):
+    """
+    すべてのラスタが同じグリッド（CRS・transform・サイズ）かを確認
+
+    Raises:
+        ValueError: グリッドが一致しない場合
+    """
+    reference = sources[0]
+    for src in sources[1:]:
+        if src.crs != reference.crs:
+            raise ValueError(f"CRSが一致しません: {reference.name} ({reference.crs}) と {src.name} ({src.crs})")
+        if (src.width, src.height) != (reference.width, reference.height):
+            raise ValueError(f"サイズが一致しません: {reference.name} ({reference.width}x{reference.height}) と "
+                             f"{src.name} ({src.width}x{src.height})")
+        if not src.transform.almost_equals(reference.transform):
+            raise ValueError(f"transformが一致しません: {reference.name} と {src.name}")
+
+
+def to_log_scale(data, method, input_db=False, nodata=None):
+    """
+    変化量を差として求められる対数スケールに変換（欠損はNaN）
+
+    log_ratioは ln(後/前) = ln(後) - ln(前)、db_differenceは dB(後) - dB(前) であり、
+    どちらもシーンごとに1回だけ対数をとれば、各組の変化量は引き算だけで求まる。
+
+    Args:
+        data: 後方散乱係数のブロック
+        method: 'log_ratio' または 'db_difference'
+        input_db: 入力がdBの場合はTrue（Falseの場合は線形）
+        nodata: 入力の欠損値
+    """
+    data = data.astype(np.float32)
+    if nodata is not None and not np.isnan(nodata):
+        data[data == nodata] = np.nan
+    if input_db:
+        if method == 'log_ratio':
+            data *= np.float32(np.log(10) / 10)
+        return data
+    with np.errstate(invalid='ignore', divide='ignore'):
+        data = np.log(data) if method == 'log_ratio' else 10 * np.log10(data)
+    data[~np.isfinite(data)] = np.nan
+    return data
+
+
+def check_alignment_paths(paths):
+    """
+    すべてのラスタが同じグリッドかを、1枚目と1枚ずつ比べて確認（同時に開くのは2ファイルまで）
+
+    Raises:
+        ValueError: グリッドが一致しない場合
+    """
+    with rasterio.open(paths[0]) as reference:
+        for path in paths[1:]:
+            with rasterio.open(path) as src:
+                check_alignment([reference, src])
+
+
+def pair_batches(pairs, output_paths, batch_size):
+    """組と保存先をbatch_size組ずつに分ける"""
+    for start in range(0, len(pairs), batch_size):
+        yield pairs[start:start + batch_size], output_paths[start:start + batch_size]
+
+
+def detect_changes(paths, output_dir=None, method='log_ratio', pairs='consecutive', input_db=False,
+                   band=1, output_paths=None, target_pixels=CHANGE_BLOCK_PIXELS, max_open_outputs=MAX_OPEN_OUTPUTS):
+    """
+    複数のSARシーンの変化量をブロックごとに計算してGeoTIFFに保存
+
+    すべてのシーンを同じブロック（1枚目の内部タイルに揃えたウィンドウ）の順に読み、
+    各組の変化量（後 - 前）をブロック単位で書き出す。メモリに保持するのは
+    1ブロックあたり各シーン1枚分だけで、使い終わったシーンのブロックはすぐに破棄する。
+    組はmax_open_outputs組ずつのバッチで処理し、バッチごとにその組で使うシーンと
+    出力だけを開くため、同時に開くファイル数はシーン数・組の数によらず
+    3 × max_open_outputs 以下になる。
+
+    Args:
+        paths: 取得順のSARデータ（TIFF）のパスのリスト
+        output_dir: 出力ディレクトリ（output_pathsを指定しない場合）
+        method: 'log_ratio'（自然対数の比）または 'db_difference'（dBの差）
+        pairs: 'consecutive'・'all'、または (前, 後) のインデックスのリスト
+        input_db: 入力がdBの場合はTrue（Falseの場合は線形）
+        band: 読み込むバンド
+        output_paths: 組ごとの保存先（Noneの場合はoutput_dirに自動で命名）
+        target_pixels: 1ブロックの画素数の目安
+        max_open_outputs: 1バッチの組の数（同時に開く出力ファイル数の上限）
+
+    Returns:
+        組ごとの結果のリスト {'before', 'after', 'path'}
+    """
+    if method not in CHANGE_METHODS:
+        raise ValueError(f"methodは{CHANGE_METHODS}のいずれかを指定してください: {method}")
+    paths = [str(path) for path in paths]
+    if len(paths) < 2:
+        raise ValueError("変化の検出には2シーン以上が必要です")
+    if isinstance(pairs, str):
+        pairs = scene_pairs(len(paths), pairs)
+    pairs = [(int(before), int(after)) for before, after in pairs]
+    if output_paths is None:
+        if output_dir is None:
+            raise ValueError("output_dirかoutput_pathsを指定してください")
+        output_paths = [change_output_path(output_dir, paths[before], paths[after], method)
+                        for before, after in pairs]
+    if len(output_paths) != len(pairs):
+        raise ValueError("output_pathsの数が組の数と一致しません")
+
+    check_alignment_paths(paths)
+    with rasterio.open(paths[0]) as reference:
+        profile = reference.profile.copy()
+        windows = list(sar_block_windows(reference, target_pixels=target_pixels))
+    profile.update(
+        driver='GTiff', count=1, dtype='float32', nodata=np.nan,
+        tiled=True, blockxsize=256, blockysize=256, compress='deflate'
+    )
+
+    batches = list(pair_batches(pairs, output_paths, max(1, max_open_outputs)))
+    print(f"{len(paths)}シーン・{len(pairs)}組の変化量を{len(windows)}ブロック・{len(batches)}バッチで計算します（{method}）")
+    for batch_pairs, batch_output_paths in batches:
+        _detect_changes_batch(paths, batch_pairs, batch_output_paths, profile, windows, method, input_db, band)
+
+    return [
+        {'before': paths[before], 'after': paths[after], 'path': str(output_path)}
+        for (before, after), output_path in zip(pairs, output_paths)
+    ]
+
+
+def _detect_changes_batch(paths, pairs, output_paths, profile, windows, method, input_db, band):
+    """
+    1バッチの組の変化量を計算して保存（バッチで使うシーンと出力だけを開く）
+    """
+    # 各シーンのブロックを最後に使う組の番号（以降は破棄できる）
+    last_use = {}
+    for index, (before, after) in enumerate(pairs):
+        last_use[before] = index
+        last_use[after] = index
+
+    sources = {}
+    outputs = []
+    try:
+        for scene in sorted(last_use):
+            sources[scene] = rasterio.open(paths[scene])
+        for (before, after), output_path in zip(pairs, output_paths):
+            os.makedirs(os.path.dirname(str(output_path)) or '.', exist_ok=True)
+            dst = rasterio.open(output_path, 'w', **profile)
+            outputs.append(dst)
+            dst.update_tags(method=method, before=paths[before], after=paths[after])
+
+        for block_window in windows:
+            blocks = {}
+            for index, (before, after) in enumerate(pairs):
+                for scene in (before, after):
+                    if scene not in blocks:
+                        src = sources[scene]
+                        blocks[scene] = to_log_scale(src.read(band, window=block_window), method,
+                                                     input_db, src.nodata)
+                outputs[index].write(blocks[after] - blocks[before], 1, window=block_window)
+                for scene in (before, after):
+                    if last_use[scene] == index:
+                        del blocks[scene]
+    finally:
+        for dst in outputs:
+            dst.close()
+        for src in sources.values():
+            src.close()
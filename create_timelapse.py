@@ -3,55 +3,159 @@ import os
 from pathlib import Path
 import json
 from datetime import datetime
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from metadata_store import MetadataStore
 
-def create_timelapse(output_dir='output', output_file='timelapse.mp4', fps=3.33):
+def build_date_index(metadata):
+    """
+    取得日（YYYY-MM-DD）からメタデータを引く索引を作成
+
+    同じ日に複数のエントリ（MGRSタイル）がある場合は、画像の取得時と同じく
+    雲量が最も少ないエントリを採用する。
+    """
+    index = {}
+    for entry in metadata:
+        date = entry['datetime'][:10]
+        cloud_cover = entry['cloud_cover']
+        current = index.get(date)
+        if current is None or (cloud_cover is not None and
+                               (current['cloud_cover'] is None or cloud_cover < current['cloud_cover'])):
+            index[date] = entry
+    return index
+
+def select_frames(images_dir, cloud_cover_below=70, frames_from_store=True):
+    """
+    タイムラプスに使用する画像ファイルを選択
+
+    frames_from_store=Trueの場合はメタデータストアで雲量の条件を満たす
+    取得日を絞り込み、対応する画像ファイルだけを候補とする。
+    Falseの場合はimages_dir内の画像を列挙し、日付の索引で雲量を確認する。
+
+    Returns:
+        (日付順の画像ファイルのリスト, 雲量によりスキップした枚数)
+    """
+    store = MetadataStore()
+    if frames_from_store:
+        selected = build_date_index(store.query(cloud_cover_below=cloud_cover_below))
+        image_files = [images_dir / f'satellite_{date}.png' for date in sorted(selected)]
+        image_files = [image_file for image_file in image_files if image_file.exists()]
+        all_dates = {ts.strftime('%Y-%m-%d') for ts in store.read_table(columns=['datetime'])['datetime'].to_pylist()}
+        cloudy_dates = all_dates - set(selected)
+        skipped_count = sum((images_dir / f'satellite_{date}.png').exists() for date in cloudy_dates)
+        return image_files, skipped_count
+
+    index = build_date_index(store.query())
+    image_files = []
+    skipped_count = 0
+    for image_file in sorted(images_dir.glob('*')):
+        # ファイル名から日付を取得（例: satellite_2024-07-03.png）
+        entry = index.get(image_file.stem.split('_')[1])
+        if entry is None:
+            continue
+        if entry['cloud_cover'] is not None and entry['cloud_cover'] < cloud_cover_below:
+            image_files.append(image_file)
+        else:
+            skipped_count += 1
+    return image_files, skipped_count
+
+def load_frame(image_file, size):
+    """
+    画像を読み込み、動画のサイズに合わせてリサイズし、日付を描画したフレームを返す
+
+    Parameters:
+    image_file (Path): 画像ファイルのパス
+    size (tuple): 動画のサイズ (width, height)
+    """
+    frame = cv2.imread(str(image_file))
+    if frame is None:
+        raise ValueError("画像を読み込めませんでした")
+    
+    # サイズが異なる画像は動画のサイズに合わせる（VideoWriterはサイズ違いのフレームを黙って捨てる）
+    width, height = size
+    if (frame.shape[1], frame.shape[0]) != size:
+        frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+    
+    # ファイル名から日付情報を抽出（例: satellite_2025-06-25.png -> 2025/06/25）
+    date_str = image_file.stem
+    date_str = date_str.split('_')[1].replace(')', '')
+    date_str = date_str.replace('-', '/')
+    
+    # 日付を画像に追加
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = 0.5
+    thickness = 1
+    color = (0, 0, 0)  # 白色
+    
+    # 日付の位置を計算（右端から少し左にずらす）
+    text_size = cv2.getTextSize(date_str, font, font_scale, thickness)[0]
+    text_x = width - text_size[0] - 10  # 右端から10ピクセル左
+    text_y = height - 10  # 下端から10ピクセル上
+    
+    # 日付を描画
+    cv2.putText(frame, date_str, (text_x, text_y), font, font_scale, color, thickness)
+    return frame
+
+def iter_frames(image_files, size, max_workers=None, max_pending=None):
+    """
+    ワーカースレッドでフレームを先読みし、元の順番で返すジェネレータ
+
+    デコードと日付の描画はスレッドプールで並列に行う（OpenCVの処理はGILを解放する）。
+    先読みするフレーム数をmax_pendingに制限するため、枚数によらずメモリ使用量は一定。
+
+    Parameters:
+    image_files (list): 画像ファイルのリスト
+    size (tuple): 動画のサイズ (width, height)
+    max_workers (int): ワーカー数（Noneの場合はCPUコア数）
+    max_pending (int): 先読みするフレーム数の上限（Noneの場合はワーカー数の2倍）
+
+    Yields:
+    (画像ファイル, フレーム, エラー) フレームの読み込みに失敗した場合はフレームがNone
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or max_workers * 2
+    files = iter(image_files)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque(
+            (image_file, executor.submit(load_frame, image_file, size))
+            for image_file in islice(files, max_pending)
+        )
+        while pending:
+            image_file, future = pending.popleft()
+            next_file = next(files, None)
+            if next_file is not None:
+                pending.append((next_file, executor.submit(load_frame, next_file, size)))
+            try:
+                yield image_file, future.result(), None
+            except Exception as e:
+                yield image_file, None, e
+
+def create_timelapse(output_dir='output', output_file='timelapse.mp4', fps=3.33,
+                     cloud_cover_below=70, frames_from_store=True, max_workers=None, max_pending=None):
     """
     satellite_imagesディレクトリ内の画像からタイムラプス動画を作成します。
-    cloud_coverが80%以上の画像はスキップします。
+    cloud_coverがcloud_cover_below%以上の画像はスキップします。
     
     Parameters:
     output_dir (str): 出力ディレクトリのパス
     output_file (str): 出力する動画ファイル名
     fps (float): フレームレート（1画像あたり0.3秒で表示するため、3.33fps）
+    cloud_cover_below (float): 使用する画像の雲量の上限（%、この値未満を使用）
+    frames_from_store (bool): 候補の画像をメタデータストアから取得するかどうか
+    max_workers (int): フレームを読み込むワーカー数（Noneの場合はCPUコア数）
+    max_pending (int): 先読みするフレーム数の上限
     """
     # 出力ディレクトリの作成
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True)
     
-    # メタデータの読み込み
-    with open('satellite_metadata.json', 'r') as f:
-        metadata = json.load(f)
-    
-    # 画像ファイルのパスを取得
+    # 雲量の条件を満たす画像ファイルを取得
     images_dir = Path('satellite_images')
-    image_files = sorted(images_dir.glob('*'))
-    
-    # cloud_coverが80%以上の画像を除外
-    filtered_files = []
-    skipped_count = 0
-    for image_file in image_files:
-        # ファイル名から日付を取得（例: satellite_2024-07-03.png）
-        date_str = image_file.stem.split('_')[1]
-        date = datetime.strptime(date_str, '%Y-%m-%d')
-        
-        # メタデータから該当するエントリを検索
-        for entry in metadata:
-            entry_date = datetime.strptime(entry['datetime'][:10], '%Y-%m-%d')
-            if entry_date == date:
-                if entry['cloud_cover'] < 70:
-                    filtered_files.append(image_file)
-                else:
-                    skipped_count += 1
-                break
-    
-    image_files = filtered_files
-    image_files = sorted(image_files)
+    image_files, skipped_count = select_frames(images_dir, cloud_cover_below, frames_from_store)
     if skipped_count > 0:
-        print(f"cloud_coverが80%以上の画像 {skipped_count}枚をスキップしました")
-    if not image_files:
-        print("エラー: 画像ファイルが見つかりません")
-        return
-    
+        print(f"cloud_coverが{cloud_cover_below}%以上の画像 {skipped_count}枚をスキップしました")
     if not image_files:
         print("エラー: 画像ファイルが見つかりません")
         return
@@ -67,40 +171,26 @@ def create_timelapse(output_dir='output', output_file='timelapse.mp4', fps=3.33)
     output_video_path = output_path / output_file
     video_writer = cv2.VideoWriter(str(output_video_path), fourcc, fps, (width, height))
     
-    # 画像を順番にビデオに追加
-    for i, image_file in enumerate(image_files, 1):
-        try:
-            # 画像の読み込みと日付情報の取得
-            frame = cv2.imread(str(image_file))
-            # ファイル名から日付情報を抽出（例: 20250625_1200.png -> 2025/06/25 12:00）
-            date_str = image_file.stem
-            date_str = date_str.split('_')[1].replace(')', '')
-            date_str = date_str.replace('-', '/')
-            
-            # 日付を画像に追加
-            font = cv2.FONT_HERSHEY_SIMPLEX
-            font_scale = 0.5
-            thickness = 1
-            color = (0, 0, 0)  # 白色
-            
-            # 日付の位置を計算（右端から少し左にずらす）
-            text_size = cv2.getTextSize(date_str, font, font_scale, thickness)[0]
-            text_x = width - text_size[0] - 10  # 右端から10ピクセル左
-            text_y = height - 10  # 下端から10ピクセル上
-            
-            # 日付を描画
-            cv2.putText(frame, date_str, (text_x, text_y), font, font_scale, color, thickness)
-            
-            video_writer.write(frame)
-            print(f"処理中: {i}/{len(image_files)} ({i/len(image_files)*100:.1f}%)", end='\r')
-        except Exception as e:
-            print(f"エラー: {image_file.name}の処理中にエラーが発生しました: {str(e)}")
+    # ワーカーで先読みしたフレームを順番にビデオに追加
+    start = time.monotonic()
+    written = 0
+    for i, (image_file, frame, error) in enumerate(
+            iter_frames(image_files, (width, height), max_workers, max_pending), 1):
+        if error is not None:
+            print(f"エラー: {image_file.name}の処理中にエラーが発生しました: {str(error)}")
+            continue
+        video_writer.write(frame)
+        written += 1
+        print(f"処理中: {i}/{len(image_files)} ({i/len(image_files)*100:.1f}%)", end='\r')
+    elapsed = time.monotonic() - start
     
     # リソースの解放
     video_writer.release()
     print(f"\nタイムラプス動画が作成されました: {output_video_path}")
     print(f"動画のフレームレート: {fps:.2f} fps")
     print(f"動画のサイズ: {width}x{height} pixels")
+    if elapsed > 0:
+        print(f"エンコード速度: {written / elapsed:.1f} frames/sec（{written}フレーム, {elapsed:.1f}秒）")
 
 if __name__ == '__main__':
     create_timelapse()
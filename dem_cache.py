@@ -0,0 +1,141 @@
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.errors import WindowError
+from rasterio.transform import array_bounds
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds
+
+DEFAULT_CACHE_DIR = '.dem_cache'
+WINDOW_PADDING = 3  # リサンプリングのカーネルが参照する周辺の画素数
+
+
+class DEMResampler:
+    """
+    DEMを対象のグリッド（CRS・transform・形状）に合わせてリサンプリングし、
+    結果をディスクにキャッシュするサービス
+
+    DEMは対象の範囲を覆うウィンドウだけを読み込み、マルチスレッドで再投影する。
+    結果は (DEMファイル, CRS, transform, 形状, リサンプリング方法) をキーとした
+    .npyファイルに保存し、同じグリッドのシーン（同じ軌道のシーンなど）では
+    再投影せずにメモリマップで読み込む。
+    """
+
+    def __init__(self, dem_path, cache_dir=DEFAULT_CACHE_DIR, resampling=Resampling.bilinear, num_threads=None):
+        """
+        Args:
+            dem_path: DEMのGeoTIFF
+            cache_dir: キャッシュディレクトリ（Noneの場合はキャッシュしない）
+            resampling: リサンプリング方法
+            num_threads: 再投影のスレッド数（Noneの場合はCPUコア数）
+        """
+        self.dem_path = str(dem_path)
+        self.cache_dir = cache_dir
+        self.resampling = resampling
+        self.num_threads = num_threads or os.cpu_count() or 1
+        self.hits = 0
+        self.misses = 0
+
+    def cache_key(self, crs, transform, shape):
+        """対象のグリッドとDEMファイルの状態からキャッシュのキーを作成"""
+        stat = os.stat(self.dem_path)
+        key = {
+            'dem': os.path.abspath(self.dem_path),
+            'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'crs': CRS.from_user_input(crs).to_wkt(),
+            'transform': [round(v, 12) for v in tuple(transform)[:6]],
+            'shape': [int(v) for v in shape],
+            'resampling': self.resampling.name
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _source_window(self, src, crs, transform, shape):
+        """対象の範囲を覆うDEMのウィンドウ（範囲外の場合はNone）"""
+        bounds = array_bounds(shape[0], shape[1], transform)
+        west, south, east, north = transform_bounds(crs, src.crs, bounds[0], bounds[1], bounds[2], bounds[3], densify_pts=21)
+        window = from_bounds(west, south, east, north, transform=src.transform)
+        window = Window(
+            int(np.floor(window.col_off)) - WINDOW_PADDING,
+            int(np.floor(window.row_off)) - WINDOW_PADDING,
+            int(np.ceil(window.width)) + 2 * WINDOW_PADDING + 1,
+            int(np.ceil(window.height)) + 2 * WINDOW_PADDING + 1
+        )
+        try:
+            return window.intersection(Window(0, 0, src.width, src.height))
+        except WindowError:
+            return None
+
+    def _reproject(self, crs, transform, shape):
+        dem_resampled = np.full(shape, np.nan, dtype=np.float32)
+        with rasterio.open(self.dem_path) as dem_src:
+            window = self._source_window(dem_src, crs, transform, shape)
+            if window is None:
+                print(f"警告: DEM '{self.dem_path}' は対象の範囲を含んでいません")
+                return dem_resampled
+            dem = dem_src.read(1, window=window).astype(np.float32)
+            reproject(
+                source=dem,
+                destination=dem_resampled,
+                src_transform=dem_src.window_transform(window),
+                src_crs=dem_src.crs,
+                src_nodata=dem_src.nodata,
+                dst_transform=transform,
+                dst_crs=crs,
+                dst_nodata=np.nan,
+                resampling=self.resampling,
+                num_threads=self.num_threads
+            )
+        return dem_resampled
+
+    def resample(self, crs, transform, shape):
+        """
+        DEMを対象のグリッドにリサンプリング
+
+        Args:
+            crs: 対象のCRS
+            transform: 対象のアフィン変換
+            shape: 対象の形状 (height, width)
+
+        Returns:
+            リサンプリング後のDEM（float32、範囲外はNaN）。
+            キャッシュを使う場合は読み取り専用のメモリマップ
+        """
+        shape = (int(shape[0]), int(shape[1]))
+        if self.cache_dir is None:
+            self.misses += 1
+            return self._reproject(crs, transform, shape)
+
+        cache_path = os.path.join(self.cache_dir, f"{self.cache_key(crs, transform, shape)}.npy")
+        if os.path.exists(cache_path):
+            self.hits += 1
+            return np.load(cache_path, mmap_mode='r')
+
+        self.misses += 1
+        dem_resampled = self._reproject(crs, transform, shape)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, dem_resampled)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return np.load(cache_path, mmap_mode='r')
+
+    def resample_to(self, ref_meta):
+        """
+        rasterioのメタデータ（crs・transform・height・width）のグリッドにリサンプリング
+        """
+        return self.resample(ref_meta['crs'], ref_meta['transform'], (ref_meta['height'], ref_meta['width']))
+
+    def print_stats(self):
+        """キャッシュの利用状況を表示"""
+        print(f"DEMリサンプリング: キャッシュヒット {self.hits}件, 再投影 {self.misses}件")
@@ -0,0 +1,165 @@
+import numpy as np
+
+
+class ElevationLUT:
+    """
+    標高から補正値や閾値を引く参照テーブル
+
+    標高帯の境界（bins）と標高帯ごとの値（values）で定義する段階的なテーブルと、
+    標高と値の対応点（curve）を線形補間する連続的なテーブルのどちらにも対応する。
+    標高帯の判定はnp.digitizeの1回、値の参照はテーブルのgather 1回で行い、
+    標高帯ごとの画素数もbincountの1回で求める。
+    """
+
+    def __init__(self, bins=None, values=None, curve=None, fill_value=0.0, dtype=np.float32):
+        """
+        Args:
+            bins: 標高帯の境界（昇順、例: [0, 200, 400]）。各帯は [low, high) の範囲
+            values: 標高帯ごとの値（len(bins) - 1個）
+            curve: 連続的なテーブルの (標高のリスト, 値のリスト)
+            fill_value: 標高帯の範囲外（とNaN）の画素に割り当てる値
+            dtype: 参照結果の型
+        """
+        if bins is None and curve is None:
+            raise ValueError("binsかcurveのどちらかを指定してください")
+        if bins is not None:
+            bins = np.asarray(bins, dtype=np.float64)
+            if values is not None and len(values) != len(bins) - 1:
+                raise ValueError("valuesの数はbinsの数 - 1 と同じにしてください")
+        if curve is not None:
+            elevations, curve_values = (np.asarray(v, dtype=np.float64) for v in curve)
+            if len(elevations) != len(curve_values) or np.any(np.diff(elevations) <= 0):
+                raise ValueError("curveの標高は昇順で、値と同じ数にしてください")
+            curve = (elevations, curve_values)
+        self.bins = bins
+        self.values = values
+        self.curve = curve
+        self.fill_value = fill_value
+        self.dtype = dtype
+
+    @property
+    def n_bands(self):
+        return 0 if self.bins is None else len(self.bins) - 1
+
+    @property
+    def labels(self):
+        """標高帯の名前（例: '0-200m'）"""
+        return [f"{low:g}-{high:g}m" for low, high in zip(self.bins[:-1], self.bins[1:])]
+
+    def bin_index(self, dem):
+        """
+        画素ごとの標高帯の番号を返す（範囲外とNaNはn_bands）
+        """
+        index = np.digitize(dem, self.bins) - 1
+        index[index < 0] = self.n_bands
+        return index
+
+    def table(self, values=None):
+        """標高帯の番号から値を引くテーブル（最後の要素が範囲外の値）"""
+        values = self.values if values is None else values
+        return np.append(np.asarray(values, dtype=self.dtype), self.dtype(self.fill_value))
+
+    def lookup(self, dem, index=None):
+        """
+        画素ごとの値を返す
+
+        連続的なテーブルの場合は標高で線形補間する（両端の外側は端の値）。
+        段階的なテーブルの場合は標高帯の番号（indexを渡せば再計算しない）から値を引く。
+        """
+        if self.curve is not None:
+            result = np.interp(dem, *self.curve).astype(self.dtype, copy=False)
+            result[np.isnan(dem)] = self.fill_value
+            return result
+        if index is None:
+            index = self.bin_index(dem)
+        return self.table()[index]
+
+    def band_counts(self, index):
+        """標高帯ごとの画素数をbincountの1回で計算"""
+        return np.bincount(np.ravel(index), minlength=self.n_bands + 1)[:self.n_bands]
+
+
+# 水分量の分類（uint8）
+MOISTURE_LOW = 0
+MOISTURE_MEDIUM = 1
+MOISTURE_HIGH = 2
+MOISTURE_NODATA = 255
+MOISTURE_LABELS = ('Low', 'Medium', 'High')
+
+
+class MoistureClassifier:
+    """
+    標高に応じた閾値で後方散乱係数（dB）を水分量の3クラスに分類する
+
+    高水分の閾値と中水分の閾値をそれぞれElevationLUTで持ち、
+    画素ごとの閾値を参照テーブルから引いて1回の比較で分類する。
+    結果は uint8（0: 低水分, 1: 中水分, 2: 高水分, 255: 標高範囲外・欠損）で返す。
+    """
+
+    def __init__(self, high_lut, medium_lut):
+        """
+        Args:
+            high_lut: この値未満を高水分とする閾値のテーブル
+            medium_lut: この値未満を中水分とする閾値のテーブル
+        """
+        self.high_lut = high_lut
+        self.medium_lut = medium_lut
+
+    @classmethod
+    def from_bands(cls, bins, thresholds):
+        """
+        標高帯ごとの閾値から作成
+
+        Args:
+            bins: 標高帯の境界
+            thresholds: 標高帯ごとの (高水分の閾値, 中水分の閾値)
+        """
+        high, medium = zip(*thresholds)
+        return cls(ElevationLUT(bins=bins, values=high, fill_value=np.nan),
+                   ElevationLUT(bins=bins, values=medium, fill_value=np.nan))
+
+    @classmethod
+    def from_curves(cls, elevations, high, medium):
+        """
+        標高で線形補間する閾値の曲線から作成（両端の外側は端の値）
+
+        Args:
+            elevations: 曲線の標高（昇順）
+            high: 各標高での高水分の閾値
+            medium: 各標高での中水分の閾値
+        """
+        return cls(ElevationLUT(curve=(elevations, high), fill_value=np.nan),
+                   ElevationLUT(curve=(elevations, medium), fill_value=np.nan))
+
+    def _shared_bins(self):
+        return (self.high_lut.curve is None and self.medium_lut.curve is None
+                and np.array_equal(self.high_lut.bins, self.medium_lut.bins))
+
+    def classify(self, vv_db, dem):
+        """
+        画素ごとの水分量のクラスを返す
+
+        Args:
+            vv_db: 後方散乱係数（dB）
+            dem: vv_dbと同じグリッドの標高
+
+        Returns:
+            水分量のクラス（uint8、vv_dbと同じ形状）
+        """
+        if self._shared_bins():
+            # 標高帯の判定は1回だけ行い、両方の閾値を同じ番号から引く
+            index = self.high_lut.bin_index(dem)
+            high = self.high_lut.table()[index]
+            medium = self.medium_lut.table()[index]
+            nodata = index == self.high_lut.n_bands
+        else:
+            high = self.high_lut.lookup(dem)
+            medium = self.medium_lut.lookup(dem)
+            nodata = np.isnan(dem)
+
+        # 高水分の閾値 <= 中水分の閾値なので、2つの比較結果の和がクラスになる
+        classes = np.less(vv_db, medium).view(np.uint8)
+        classes += np.less(vv_db, high)
+        nodata |= np.isnan(vv_db)
+        classes[nodata] = MOISTURE_NODATA
+        return classes
@@ -1,5 +1,5 @@
 import os
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import json
 from sentinelhub import (
     SHConfig,
@@ -23,10 +23,22 @@ import time
 from pathlib import Path
 import configparser
 import io
+import argparse
+from sentinelhub.decoding import decode_data
+from scene_downloader import SceneDownloader
+from aoi_tiling import plan_tiles, download_mosaic, Mosaic
+from scene_planner import plan_scene_requests, print_plan_summary
+from request_cache import RequestCache, get_data
+from metadata_store import MetadataStore, DEFAULT_STORE_PATH, LEGACY_JSON_PATH
+
+SATELLITE_RESOLUTION = 10  # Sentinel-2画像の解像度（m）
+SKIPPED_IMAGES_NAME = 'skipped_images.json'  # 明るさチェックで保存しなかった取得日の記録
 
-def get_satellite_image(sh_config, bbox, metadata, output_dir):
+def build_satellite_request(sh_config, bbox, metadata, size=None):
     """
-    Sentinel-2の衛星画像を取得して保存
+    メタデータに対応するSentinel-2画像のSentinelHubRequestを作成
+
+    sizeを省略した場合は解像度10mのサイズ（分割したタイルではタイルのサイズを渡す）
     """
     # プラットフォームに応じた評価スクリプトの定義
     platform = metadata['platform'].lower()
@@ -128,24 +140,12 @@ def get_satellite_image(sh_config, bbox, metadata, output_dir):
         }
         """
 
-    # 画像の保存ディレクトリを作成
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # メタデータから時間範囲を取得
-    date_str = metadata['datetime'][:10]  # YYYY-MM-DD形式
-    
-    # 画像のファイル名を生成
-    img_filename = f"satellite_{date_str}.png"
-    img_path = os.path.join(output_dir, img_filename)
-    
-    # 画像データの取得
-    print(f"\n{date_str}の画像を取得中...")
-    request = SentinelHubRequest(
+    return SentinelHubRequest(
         evalscript=evalscript,
         input_data=[
             SentinelHubRequest.input_data(
                 data_collection=DataCollection.SENTINEL2_L2A,
-                time_interval=(metadata['datetime'], metadata['datetime']),
+                time_interval=metadata.get('time_interval', (metadata['datetime'], metadata['datetime'])),
                 mosaicking_order='leastCC'
             )
         ],
@@ -153,23 +153,47 @@ def get_satellite_image(sh_config, bbox, metadata, output_dir):
             SentinelHubRequest.output_response('default', MimeType.TIFF)
         ],
         bbox=bbox,
-        size=bbox_to_dimensions(bbox, resolution=10),
+        size=size or bbox_to_dimensions(bbox, resolution=10),
         config=sh_config
     )
-    
-    # 画像データの取得
-    data = request.get_data()
-    
-    if not data:
-        print(f"{metadata['datetime']}の画像を取得できませんでした")
-        return
+
+def load_skipped_dates(output_dir):
+    """
+    明るさチェックで保存しなかった取得日の記録（{日付: 理由}）を読み込む
+    """
+    path = os.path.join(output_dir, SKIPPED_IMAGES_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def record_skipped_date(output_dir, date, reason):
+    """
+    保存しなかった取得日を記録する（一時ファイルからの置き換え）
+    """
+    skipped = load_skipped_dates(output_dir)
+    skipped[date] = reason
+    path = os.path.join(output_dir, SKIPPED_IMAGES_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(sorted(skipped.items())), f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def save_satellite_image(img_array, metadata, output_dir):
+    """
+    取得した画像データを明るさチェックの上でPNGとして保存
+
+    暗いまたは白いため保存しなかった取得日は記録し、差分取得で再ダウンロードしない。
+    """
+    # 画像の保存ディレクトリを作成
+    os.makedirs(output_dir, exist_ok=True)
 
     # 画像を保存
     date = metadata['datetime'][:10]
     img_path = os.path.join(output_dir, f'satellite_{date}.png')
     
     # 画像の明るさチェック
-    img_array = np.array(data[0])
+    img_array = np.array(img_array)
     
     # 各ピクセルの明るさを計算
     brightness = np.mean(img_array, axis=2)
@@ -182,24 +206,106 @@ def get_satellite_image(sh_config, bbox, metadata, output_dir):
     else:
         if dark_ratio >= 0.9:
             print(f"{date}の画像は90%以上が暗いため、保存をスキップしました")
+            record_skipped_date(output_dir, date, 'dark')
         else:
             print(f"{date}の画像は90%以上が白いため、保存をスキップしました")
+            record_skipped_date(output_dir, date, 'white')
 
     return img_path if os.path.exists(img_path) else None
 
-def download_satellite_images(sh_config, metadata_list, bbox, output_dir):
+def get_satellite_image(sh_config, bbox, metadata, output_dir, cache=None):
+    """
+    Sentinel-2の衛星画像を取得して保存
+    """
+    # 画像データの取得
+    print(f"\n{metadata['datetime'][:10]}の画像を取得中...")
+    plan = plan_tiles(bbox, SATELLITE_RESOLUTION)
+    if plan.needs_tiling:
+        # 画素数の上限を超える範囲はタイルに分割して取得し、1枚に組み立てる
+        mosaic, _ = download_mosaic(
+            plan, lambda tile_bbox, size: build_satellite_request(sh_config, tile_bbox, metadata, size),
+            sh_config, cache=cache
+        )
+        data = [mosaic] if mosaic is not None else []
+    else:
+        request = build_satellite_request(sh_config, bbox, metadata)
+        data = get_data(request, cache)
+    
+    if not data:
+        print(f"{metadata['datetime']}の画像を取得できませんでした")
+        return
+
+    return save_satellite_image(data[0], metadata, output_dir)
+
+def download_satellite_images(sh_config, metadata_list, bbox, output_dir, max_workers=4, rate=5.0, downloader=None, cache=None):
     """
     メタデータリストから衛星画像を一括でダウンロード
+
+    リクエストはSceneDownloaderで並列に実行し、固定のsleepではなく
+    APIのレート制限ヘッダに従って発行間隔を調整する。
+    downloaderを渡すとそれを使用する（スタブサーバでの確認用など）。
     """
     print("\n衛星画像のダウンロードを開始します...")
     total = len(metadata_list)
+    if downloader is None:
+        downloader = SceneDownloader(sh_config, max_workers=max_workers, rate=rate, cache=cache)
+
+    plan = plan_tiles(bbox, SATELLITE_RESOLUTION)
+    if plan.needs_tiling:
+        print(f"範囲が画素数の上限を超えるため、各画像を{len(plan.tiles)}タイルに分割して取得します")
+        download_tiled_satellite_images(sh_config, metadata_list, plan, output_dir, downloader)
+        return
+
+    download_requests = [
+        build_satellite_request(sh_config, bbox, metadata).download_list[0]
+        for metadata in metadata_list
+    ]
     
-    for i, metadata in enumerate(metadata_list, 1):
+    start = time.monotonic()
+    for i, (index, content, error) in enumerate(downloader.download(download_requests), 1):
+        metadata = metadata_list[index]
         print(f"\n[{i}/{total}] {metadata['datetime']} の画像を処理中...")
-        get_satellite_image(sh_config, bbox, metadata, output_dir)
-        time.sleep(1)  # APIの負荷を考慮して1秒待機
+        if error is not None:
+            print(f"{metadata['datetime']}の画像を取得できませんでした: {error}")
+            continue
+        save_satellite_image(decode_data(content, MimeType.TIFF), metadata, output_dir)
+
+    print(f"\n画像のダウンロードが完了しました（{time.monotonic() - start:.1f}秒）")
+
+
+def download_tiled_satellite_images(sh_config, metadata_list, plan, output_dir, downloader):
+    """
+    全ての画像のタイルをまとめて並列にダウンロードし、画像ごとに組み立てて保存
+
+    画像のタイルが揃った時点で保存する。一部のタイルを取得できなかった画像は保存しない。
+    """
+    tile_requests = [
+        (scene_index, tile_index, build_satellite_request(sh_config, tile['bbox'], metadata, tile['size']).download_list[0])
+        for scene_index, metadata in enumerate(metadata_list)
+        for tile_index, tile in enumerate(plan.tiles)
+    ]
+    mosaics = [Mosaic(plan) for _ in metadata_list]
+
+    start = time.monotonic()
+    saved = 0
+    for index, content, error in downloader.download([request for _, _, request in tile_requests]):
+        scene_index, tile_index, _ = tile_requests[index]
+        mosaic = mosaics[scene_index]
+        if error is not None:
+            mosaic.add_error(tile_index, error)
+        else:
+            mosaic.add(tile_index, decode_data(content, MimeType.TIFF))
+        if not mosaic.done:
+            continue
 
-    print("\n画像のダウンロードが完了しました")
+        metadata = metadata_list[scene_index]
+        if mosaic.errors:
+            print(f"{metadata['datetime']}の画像の{len(mosaic.errors)}タイルを取得できませんでした")
+        elif save_satellite_image(mosaic.data, metadata, output_dir):
+            saved += 1
+        mosaics[scene_index] = None  # 保存した画像のメモリを解放
+
+    print(f"\n{saved}/{len(metadata_list)}枚の画像を保存しました（{time.monotonic() - start:.1f}秒）")
 
 
 def get_satellite_metadata(sh_config, bbox, time_interval):
@@ -235,17 +341,77 @@ def get_satellite_metadata(sh_config, bbox, time_interval):
     
     return metadata_list
 
+def open_metadata_store(output_dir):
+    """
+    output_dir内のメタデータストアを開く
+    """
+    return MetadataStore(
+        os.path.join(output_dir, DEFAULT_STORE_PATH),
+        legacy_json_path=os.path.join(output_dir, LEGACY_JSON_PATH)
+    )
+
 def save_metadata(metadata_list, output_dir):
     """
-    メタデータをJSONファイルとして保存
+    メタデータをメタデータストア（Parquet）に保存
     """
     os.makedirs(output_dir, exist_ok=True)
-    metadata_file = os.path.join(output_dir, 'satellite_metadata.json')
-    with open(metadata_file, 'w') as f:
-        json.dump(metadata_list, f, indent=2)
-    print(f"メタデータを {metadata_file} に保存しました")
+    store = open_metadata_store(output_dir)
+    store.write(metadata_list)
+    print(f"メタデータを {store.path} に保存しました")
+
+def load_metadata(output_dir):
+    """
+    保存済みのメタデータを読み込む（存在しない場合は空のリスト）
+    """
+    return open_metadata_store(output_dir).query()
+
+def sync_metadata(sh_config, bbox, output_dir, days=365):
+    """
+    メタデータを差分で同期する
+
+    保存済みのメタデータで最も新しい日時以降だけをカタログで検索し、
+    tile_idをキーにマージして保存する。保存済みのメタデータがない場合は
+    過去days日分を検索する。
+
+    Returns:
+        新規に追加されたメタデータのリスト
+    """
+    store = open_metadata_store(output_dir)
+    # カタログの時間範囲は両端ともUTCのdatetimeで指定する（naiveとawareは比較できない）
+    end = datetime.now(timezone.utc)
+    latest = store.latest_datetime()
+    if latest is None:
+        start = end - timedelta(days=days)
+    else:
+        start = datetime.fromisoformat(latest.replace('Z', '+00:00'))
+    print(f"メタデータを差分同期します: {start:%Y-%m-%dT%H:%M:%SZ} 〜 {end:%Y-%m-%dT%H:%M:%SZ}")
+
+    new_items = get_satellite_metadata(sh_config, bbox, (start, end))
+    added = store.upsert(new_items)
+    print(f"新規メタデータ: {len(added)}件")
+    return added
+
+def filter_missing_images(plan, images_dir):
+    """
+    画像がまだ保存されていないリクエストだけを返す
+
+    以前のダウンロードで取得できなかった取得日は対象になり、
+    暗いまたは白いため保存しなかった取得日（load_skipped_datesの記録）は対象にならない。
+    """
+    skipped = load_skipped_dates(images_dir)
+    return [
+        entry for entry in plan
+        if entry['datetime'][:10] not in skipped
+        and not os.path.exists(os.path.join(images_dir, f"satellite_{entry['datetime'][:10]}.png"))
+    ]
 
 def main():
+    parser = argparse.ArgumentParser(description='Sentinel-2のメタデータと画像を取得')
+    parser.add_argument('--incremental', action='store_true',
+                        help='保存済みのメタデータ以降だけを検索し、未取得の画像だけをダウンロードする')
+    args = parser.parse_args()
+
+
     # 設定ファイルの読み込み
     config_path = Path(__file__).parent / 'config.ini'
     config = configparser.ConfigParser(interpolation=None)
@@ -263,17 +429,26 @@ def main():
     longitude = 138.4147  # 経度（例：東京駅）
     bbox = BBox(bbox=[longitude - 0.01, latitude - 0.01, longitude + 0.01, latitude + 0.01], crs=CRS.WGS84)
     
-    # 時間範囲設定
-    today = datetime.now()
-    date = today.strftime("%Y%m%d")
-    one_month_ago = (datetime.strptime(date, "%Y%m%d") - timedelta(days=365)).strftime("%Y%m%d")
-    time_interval = (one_month_ago, date)
-    
-    # メタデータ取得
-    metadata_list = get_satellite_metadata(sh_config, bbox, time_interval)
-    
-    # メタデータの保存
-    save_metadata(metadata_list, '.')
+    images_dir = 'satellite_images'
+
+    if args.incremental:
+        # 差分同期した上で、保存済みのメタデータ全件を処理対象とする
+        # （新規分だけを対象にすると、以前に取得できなかった画像が再取得されない）
+        added = sync_metadata(sh_config, bbox, '.')
+        metadata_list = load_metadata('.')
+        print(f"保存済みのメタデータ: {len(metadata_list)}件（うち新規 {len(added)}件）")
+    else:
+        # 時間範囲設定
+        today = datetime.now()
+        date = today.strftime("%Y%m%d")
+        one_month_ago = (datetime.strptime(date, "%Y%m%d") - timedelta(days=365)).strftime("%Y%m%d")
+        time_interval = (one_month_ago, date)
+        
+        # メタデータ取得
+        metadata_list = get_satellite_metadata(sh_config, bbox, time_interval)
+        
+        # メタデータの保存
+        save_metadata(metadata_list, '.')
     
     # メタデータの表示
     print("\n取得したメタデータの概要:")
@@ -291,9 +466,17 @@ def main():
         if cloud_cover is not None and cloud_cover > 80:
             print("警告: 雲量が非常に高い可能性があります")
 
+    # 取得日ごとにリクエストを集約（同じ観測の別タイルを重複して取得しない）
+    plan = plan_scene_requests(metadata_list, bbox)
+    print_plan_summary(metadata_list, plan)
+    if args.incremental:
+        plan = filter_missing_images(plan, images_dir)
+        print(f"未取得の画像: {len(plan)}件")
+
     # 画像データのダウンロード
-    images_dir = 'satellite_images'
-    download_satellite_images(sh_config, metadata_list, bbox, images_dir)
+    cache = RequestCache()
+    download_satellite_images(sh_config, plan, bbox, images_dir, cache=cache)
+    cache.print_stats()
 
 if __name__ == '__main__':
     main()
@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import configparser
 import time
 import numpy as np
@@ -21,6 +22,20 @@ from sentinelhub import (
 from PIL import Image
 from datetime import datetime, timedelta
 from pathlib import Path
+from request_cache import RequestCache, get_data
+from sentinelhub.decoding import decode_data
+from aoi_tiling import plan_tiles, download_mosaic, Mosaic
+from scene_downloader import SceneDownloader
+from polarimetry import SAR_BANDS
+from acquisition_planner import (
+    ACQUISITION_GAP,
+    parse_datetime,
+    plan_acquisitions,
+    print_acquisition_summary,
+    load_manifest,
+    save_manifest,
+    manifest_entry
+)
 
 
 def get_sentinel_config():
@@ -44,50 +59,48 @@ def get_sentinel_1_metadata(sh_config, bbox, time_interval):
             'include': [
                 'properties.datetime',
                 'properties.platform',
-                'properties.eo:cloud_cover'
+                'properties.eo:cloud_cover',
+                'properties.sat:orbit_state',
+                'properties.sat:absolute_orbit'
             ]
         }
     )
     return metadata
 
 
-def limit_image_size(size, max_dim=2500):
+def sar_evalscript(bands=SAR_BANDS):
+    """
+    指定したバンド（例: VV・VH・dataMask）をFLOAT32の多バンド画像で返すevalscript
+
+    1回のリクエストで全ての偏波を取得するため、偏波ごとに取得し直す必要がない。
     """
-    画像サイズ(width, height)の上限をmax_dimに制限する
+    band_list = ', '.join(f'"{band}"' for band in bands)
+    values = ', '.join(f'sample.{band}' for band in bands)
+    return f"""
+    //VERSION=3
+    function setup() {{
+        return {{
+            input: [{band_list}],
+            output: {{ bands: {len(bands)}, sampleType: "FLOAT32" }}
+        }};
+    }}
+    function evaluatePixel(sample) {{
+        return [{values}];
+    }}
     """
-    width = min(size[0], max_dim)
-    height = min(size[1], max_dim)
-    return (width, height)
 
 
-def get_sar_data_by_id(sh_config, item_id, bbox, output_dir, resolution=10):
+SAR_EVALSCRIPT = sar_evalscript()
+
+
+def build_sar_request(sh_config, bbox, size, output_dir, input_data, bands=SAR_BANDS):
     """
-    Sentinel-1のitem_idを指定してSARデータをダウンロードしGeoTIFFで保存
+    Sentinel-1のバンド（デフォルトはVV・VH・dataMask）をFLOAT32のGeoTIFFで取得するSentinelHubRequestを作成
     """
-    evalscript = """
-    //VERSION=3
-    function setup() {
-        return {
-            input: ["VV"],
-            output: { bands: 1 }
-        };
-    }
-    function evaluatePixel(sample) {
-        return [sample.VV];
-    }
-    """
-    size = bbox_to_dimensions(bbox, resolution)
-    size = limit_image_size(size)
-    print(size)
-    request = SentinelHubRequest(
+    return SentinelHubRequest(
         data_folder=output_dir,
-        evalscript=evalscript,
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.SENTINEL1_IW,
-                identifier=item_id
-            )
-        ],
+        evalscript=SAR_EVALSCRIPT if tuple(bands) == SAR_BANDS else sar_evalscript(bands),
+        input_data=[input_data],
         responses=[
             SentinelHubRequest.output_response('default', MimeType.TIFF)
         ],
@@ -95,73 +108,203 @@ def get_sar_data_by_id(sh_config, item_id, bbox, output_dir, resolution=10):
         size=size,
         config=sh_config
     )
-    data = request.get_data(save_data=True)
-    return request.get_filename_list()[0] if request.get_filename_list() else None
 
 
-def get_sar_data(sh_config, bbox, date_time, output_dir):
+def mosaic_path(output_dir, bbox, resolution, input_data, bands=SAR_BANDS):
     """
-    指定範囲・日時のSentinel-1 SARデータをダウンロードしGeoTIFFで保存
+    タイルに分割して取得したモザイクの保存先（リクエストの内容から決まる）
     """
-    evalscript = """
-    //VERSION=3
-    function setup() {
-        return {
-            input: ["VV"],
-            output: { bands: 1 }
-        };
-    }
-    function evaluatePixel(sample) {
-        return [sample.VV];
-    }
+    key = json.dumps({
+        'bbox': list(bbox),
+        'crs': str(bbox.crs),
+        'resolution': resolution,
+        'input': input_data,
+        'bands': list(bands)
+    }, sort_keys=True, default=str)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(output_dir, f'mosaic_{digest}', 'response.tiff')
+
+
+def download_sar(sh_config, bbox, output_dir, input_data, resolution=10, cache=None, max_workers=4, downloader=None,
+                 bands=SAR_BANDS):
+    """
+    SARデータをダウンロードしGeoTIFF（bandsの順の多バンド）で保存
+
+    AOIがProcess APIの画素数の上限を超える場合は、グリッドに揃えたタイルに分割して
+    並列にダウンロードし、1枚のGeoTIFFに組み立てる（解像度は下げない）。
+    取得できなかったタイルがある場合は、一部が0のGeoTIFFを保存せずにNoneを返す。
+    """
+    plan = plan_tiles(bbox, resolution)
+    if not plan.needs_tiling:
+        size = bbox_to_dimensions(bbox, resolution)
+        print(size)
+        request = build_sar_request(sh_config, bbox, size, output_dir, input_data, bands)
+        get_data(request, cache, save_data=True)
+        return request.get_filename_list()[0] if request.get_filename_list() else None
+
+    output_path = mosaic_path(output_dir, bbox, resolution, input_data, bands)
+    path, errors = download_mosaic(
+        plan,
+        lambda tile_bbox, size: build_sar_request(sh_config, tile_bbox, size, output_dir, input_data, bands),
+        sh_config, output_path=output_path, max_workers=max_workers, downloader=downloader, cache=cache
+    )
+    if errors:
+        print(f"{len(errors)}タイルを取得できませんでした。SARデータを保存しません")
+        return None
+    return path
+
+
+def find_acquisition(sh_config, item_id, bbox):
+    """
+    item_idのアイテムを含む取得（plan_acquisitionsの1件）をカタログから求める
+
+    アイテムの取得時刻の前後ACQUISITION_GAPのアイテムを検索し、取得ごとにまとめる。
+    """
+    catalog = SentinelHubCatalog(config=sh_config)
+    item = catalog.get_feature(DataCollection.SENTINEL1_IW, item_id)
+    acquired = parse_datetime(item['properties']['datetime'])
+    items = list(get_sentinel_1_metadata(sh_config, bbox, (acquired - ACQUISITION_GAP, acquired + ACQUISITION_GAP)))
+    if all(other['id'] != item_id for other in items):
+        items.append(item)
+    for acquisition in plan_acquisitions(items):
+        if item_id in acquisition['item_ids']:
+            return acquisition
+
+
+def get_sar_data_by_id(sh_config, item_id, bbox, output_dir, resolution=10, cache=None, max_workers=4,
+                       bands=SAR_BANDS):
+    """
+    Sentinel-1のitem_idのアイテムを含む取得のSARデータ（デフォルトはVV・VH・dataMask）をダウンロードしGeoTIFFで保存
+
+    Process APIではアイテムを識別子で指定できないため、download_acquisitionsと同じく
+    アイテムを含む取得の時間範囲（前後1秒）と軌道方向で指定する。同じ範囲に別の取得の
+    アイテムが含まれる場合は、そのアイテムのデータだけを取得できないためValueErrorとする。
+    """
+    acquisition = find_acquisition(sh_config, item_id, bbox)
+    if acquisition['conflicting_item_ids']:
+        raise ValueError(f"{item_id} の取得の時間範囲に別の取得のアイテムが含まれます: "
+                         f"{', '.join(acquisition['conflicting_item_ids'])}")
+    input_data = SentinelHubRequest.input_data(
+        data_collection=acquisition_collection(acquisition),
+        time_interval=acquisition['time_interval']
+    )
+    return download_sar(sh_config, bbox, output_dir, input_data, resolution, cache, max_workers, bands=bands)
+
+
+def get_sar_data(sh_config, bbox, date_time, output_dir, cache=None, max_workers=4, bands=SAR_BANDS):
+    """
+    指定範囲・日時のSentinel-1 SARデータ（デフォルトはVV・VH・dataMask）をダウンロードしGeoTIFFで保存
     """
     resolution = 10  # 10m解像度
-    size = bbox_to_dimensions(bbox, resolution)
-    size = limit_image_size(size)
-    request = SentinelHubRequest(
-        data_folder=output_dir,
-        evalscript=evalscript,
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.SENTINEL1_IW,
-                time_interval=(date_time[0], date_time[1])
-            )
-        ],
-        responses=[
-            SentinelHubRequest.output_response('default', MimeType.TIFF)
-        ],
-        bbox=bbox,
-        size=size,
-        config=sh_config
+    input_data = SentinelHubRequest.input_data(
+        data_collection=DataCollection.SENTINEL1_IW,
+        time_interval=(date_time[0], date_time[1])
     )
-    request.get_data(save_data=True)
-    # res_data = request.get_data(save_data=True)
     # 保存ファイルパスを返す
-    if request.get_filename_list()[0]:
-        return request.get_filename_list()[0]
-    else:
-        return None
+    return download_sar(sh_config, bbox, output_dir, input_data, resolution, cache, max_workers, bands=bands)
+
+
+def acquisition_collection(acquisition):
+    """取得の軌道方向に絞ったSentinel-1 IWのデータコレクション"""
+    orbit_state = (acquisition['orbit_state'] or '').lower()
+    if orbit_state == 'ascending':
+        return DataCollection.SENTINEL1_IW_ASC
+    if orbit_state == 'descending':
+        return DataCollection.SENTINEL1_IW_DES
+    return DataCollection.SENTINEL1_IW
+
+
+def download_acquisitions(sh_config, acquisitions, bbox, output_dir, resolution=10, max_workers=4,
+                          downloader=None, cache=None, bands=SAR_BANDS):
+    """
+    取得（パス）ごとにSARデータを1回だけダウンロードし、決定的なファイル名で保存
+
+    Process APIではアイテムを識別子で指定できないため、取得のアイテムの前後1秒の時間範囲と
+    軌道方向で指定する。カタログの検索結果からその範囲に別の取得のアイテムが入らないことを
+    確認しており（plan_acquisitions）、入る取得はダウンロードせずに失敗として記録する。
+    全ての取得のタイルをまとめてSceneDownloaderで並列にダウンロードし、
+    取得ごとに組み立てて <output_dir>/<取得の名前>/response.tiff に保存する。
+    同じバンドで取得済みの記録がありファイルが存在する取得はダウンロードしない。
+
+    Returns:
+        取得ごとの記録のリスト（取得の順序どおり）
+    """
+    manifest = load_manifest(output_dir)
+    plan = plan_tiles(bbox, resolution)
+
+    def output_path(acquisition):
+        return os.path.join(output_dir, acquisition['name'], 'response.tiff')
+
+    pending = [
+        acquisition for acquisition in acquisitions
+        if not (manifest.get(acquisition['name'], {}).get('status') == 'ok'
+                and manifest[acquisition['name']].get('bands') == list(bands)
+                and os.path.exists(output_path(acquisition)))
+    ]
+    downloaded = len(acquisitions) - len(pending)
+    ambiguous = [acquisition for acquisition in pending if acquisition.get('conflicting_item_ids')]
+    for acquisition in ambiguous:
+        error = f"時間範囲に別の取得のアイテムが含まれます: {', '.join(acquisition['conflicting_item_ids'])}"
+        print(f"{acquisition['name']} をダウンロードしません。{error}")
+        manifest[acquisition['name']] = manifest_entry(acquisition, None, 'failed', error, bands)
+    if ambiguous:
+        save_manifest(output_dir, manifest)
+        pending = [acquisition for acquisition in pending if not acquisition.get('conflicting_item_ids')]
+    print(f"{len(acquisitions)}件の取得のうち {downloaded}件は取得済み、{len(ambiguous)}件は対象外、"
+          f"{len(pending)}件をダウンロードします（1件あたり{len(plan.tiles)}タイル）")
+
+    tile_requests = []
+    for acquisition_index, acquisition in enumerate(pending):
+        input_data = SentinelHubRequest.input_data(
+            data_collection=acquisition_collection(acquisition),
+            time_interval=acquisition['time_interval']
+        )
+        for tile_index, tile in enumerate(plan.tiles):
+            request = build_sar_request(sh_config, tile['bbox'], tile['size'], output_dir, input_data, bands)
+            tile_requests.append((acquisition_index, tile_index, request.download_list[0]))
+
+    if downloader is None:
+        downloader = SceneDownloader(sh_config, max_workers=max_workers, cache=cache)
+    mosaics = [Mosaic(plan) for _ in pending]
+    start = time.monotonic()
+    for index, content, error in downloader.download([request for _, _, request in tile_requests]):
+        acquisition_index, tile_index, _ = tile_requests[index]
+        mosaic = mosaics[acquisition_index]
+        if error is not None:
+            mosaic.add_error(tile_index, error)
+        else:
+            mosaic.add(tile_index, decode_data(content, MimeType.TIFF))
+        if not mosaic.done:
+            continue
+
+        acquisition = pending[acquisition_index]
+        if mosaic.errors:
+            error = next(iter(mosaic.errors.values()))
+            print(f"{acquisition['name']} を取得できませんでした: {error}")
+            manifest[acquisition['name']] = manifest_entry(acquisition, None, 'failed', error, bands)
+        else:
+            path = mosaic.write_geotiff(output_path(acquisition))
+            print(f"{acquisition['name']} を保存しました: {path}")
+            manifest[acquisition['name']] = manifest_entry(acquisition, path, 'ok', bands=bands)
+        mosaics[acquisition_index] = None
+        save_manifest(output_dir, manifest)
+
+    print(f"ダウンロードが完了しました（{time.monotonic() - start:.1f}秒）")
+    return [manifest[acquisition['name']] for acquisition in acquisitions if acquisition['name'] in manifest]
 
 
 def main():
     sh_config = get_sentinel_config()
     bbox = BBox(bbox=(138.17, 38.34, 138.61, 37.81), crs=CRS.WGS84)
     time_interval = ('2023-01-01', '2023-02-15')
-    metadata = get_sentinel_1_metadata(sh_config, bbox, time_interval)
-    os.makedirs('sar_data', exist_ok=True)
-    for item in metadata:
-        # print(item['bbox'])
-        # 小数点4桁に丸める
-        rounded_bbox = [round(coord, 4) for coord in item['bbox']]
-        tmp_bbox = BBox(
-            bbox=(
-                rounded_bbox[0], rounded_bbox[1],
-                rounded_bbox[2], rounded_bbox[3]
-            ),
-            crs=CRS.WGS84
-        )
-        # get_sar_data_by_id(sh_config, item['id'], tmp_bbox, 'sar_data')
-        get_sar_data(sh_config, tmp_bbox, time_interval, 'sar_data')
+    items = list(get_sentinel_1_metadata(sh_config, bbox, time_interval))
+
+    # カタログのアイテムを実際の取得（パス）ごとにまとめ、取得ごとに1回だけダウンロード
+    acquisitions = plan_acquisitions(items)
+    print_acquisition_summary(items, acquisitions)
+    cache = RequestCache()
+    download_acquisitions(sh_config, acquisitions, bbox, 'sar_data', cache=cache)
+    cache.print_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,110 @@
+import numpy as np
+
+CHANNEL_NAMES = ('r', 'g', 'b')
+HIGH_BRIGHTNESS_THRESHOLD = 200  # この値より大きい画素を高輝度とする
+LOW_BRIGHTNESS_THRESHOLD = 50    # この値未満の画素を低輝度とする
+# ヒストグラムの索引を作る1チャンクの画素数（索引の一時配列は 画素数 × チャンネル数 × 8バイト）
+HISTOGRAM_CHUNK_PIXELS = 64 * 1024
+
+
+def compute_histograms(images, chunk_pixels=HISTOGRAM_CHUNK_PIXELS):
+    """
+    画像スタックのチャンネルごとのヒストグラムを1回の走査で計算
+
+    画素値にチャンネルごとのオフセットを加えた索引を作り、1回のbincountで
+    全チャンネルのヒストグラムを同時に数える。索引（intp）は画像全体ではなく
+    chunk_pixels画素ずつ作るため、一時配列の大きさは画像の大きさによらない。
+
+    Args:
+        images: uint8の画像スタック (N, H, W, C) または (N, H, W)
+        chunk_pixels: 1回のbincountで数える画素数
+
+    Returns:
+        ヒストグラム (N, C, 256)
+    """
+    images = np.asarray(images)
+    if images.dtype != np.uint8:
+        raise ValueError(f"uint8の画像のみ対応しています: {images.dtype}")
+    if images.ndim == 3:
+        images = images[..., np.newaxis]
+    n, channels = images.shape[0], images.shape[-1]
+    pixels = images.reshape(n, -1, channels)
+
+    offsets = np.arange(channels, dtype=np.intp) * 256
+    index = np.empty((min(chunk_pixels, pixels.shape[1]), channels), dtype=np.intp)
+    hist = np.zeros((n, channels * 256), dtype=np.int64)
+    for i in range(n):
+        for start in range(0, pixels.shape[1], chunk_pixels):
+            chunk = pixels[i, start:start + chunk_pixels]
+            chunk_index = index[:len(chunk)]
+            np.add(chunk, offsets, out=chunk_index)
+            hist[i] += np.bincount(chunk_index.ravel(), minlength=channels * 256)
+    return hist.reshape(n, channels, 256)
+
+
+def _moments(hist):
+    """ヒストグラム（最後の軸が画素値）から画素数・平均・標準偏差を計算"""
+    values = np.arange(256, dtype=np.int64)
+    count = hist.sum(axis=-1)
+    total = hist @ values
+    total_sq = hist @ (values * values)
+    mean = total / count
+    var = np.maximum(total_sq / count - mean * mean, 0)
+    return count, mean, np.sqrt(var)
+
+
+def stats_from_histograms(hist):
+    """
+    チャンネルごとのヒストグラムから画像の統計情報を導出
+
+    Args:
+        hist: ヒストグラム (N, C, 256)
+
+    Returns:
+        画像ごとの統計情報の辞書のリスト
+    """
+    hist = np.asarray(hist, dtype=np.int64)
+    overall = hist.sum(axis=1)
+    count, mean, std = _moments(overall)
+    _, channel_mean, channel_std = _moments(hist)
+
+    nonzero = overall > 0
+    min_value = np.argmax(nonzero, axis=1)
+    max_value = 255 - np.argmax(nonzero[:, ::-1], axis=1)
+    high = overall[:, HIGH_BRIGHTNESS_THRESHOLD + 1:].sum(axis=1)
+    low = overall[:, :LOW_BRIGHTNESS_THRESHOLD].sum(axis=1)
+
+    stats_list = []
+    for i in range(hist.shape[0]):
+        stats = {
+            'mean': float(mean[i]),
+            'std': float(std[i]),
+            'min': int(min_value[i]),
+            'max': int(max_value[i]),
+        }
+        for c, name in enumerate(CHANNEL_NAMES[:hist.shape[1]]):
+            stats[f'{name}_mean'] = float(channel_mean[i, c])
+        for c, name in enumerate(CHANNEL_NAMES[:hist.shape[1]]):
+            stats[f'{name}_std'] = float(channel_std[i, c])
+        stats['histogram'] = overall[i].tolist()
+        stats['brightness_range'] = stats['max'] - stats['min']
+        stats['high_brightness_ratio'] = float(high[i] / count[i])
+        stats['low_brightness_ratio'] = float(low[i] / count[i])
+        stats_list.append(stats)
+    return stats_list
+
+
+def compute_image_stats(img):
+    """
+    1枚の画像の統計情報を計算
+
+    平均・標準偏差・最小値・最大値・チャンネルごとの平均と標準偏差・
+    明るさの割合は、すべて1回の走査で求めたヒストグラムから導出する。
+
+    Args:
+        img: uint8の画像 (H, W, C) または (H, W)
+
+    Returns:
+        統計情報の辞書
+    """
+    return stats_from_histograms(compute_histograms(np.asarray(img)[np.newaxis]))[0]
@@ -0,0 +1,194 @@
+import json
+import os
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+DEFAULT_STORE_PATH = 'satellite_metadata.parquet'
+LEGACY_JSON_PATH = 'satellite_metadata.json'
+
+SCHEMA = pa.schema([
+    ('datetime', pa.timestamp('s', tz='UTC')),
+    ('cloud_cover', pa.float64()),
+    ('tile_id', pa.string()),
+    ('platform', pa.string()),
+    ('min_lon', pa.float64()),
+    ('min_lat', pa.float64()),
+    ('max_lon', pa.float64()),
+    ('max_lat', pa.float64()),
+    ('resolution', pa.int32()),
+])
+
+DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def _to_timestamp(value):
+    """文字列・datetimeをUTCのdatetimeに変換"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def records_to_table(metadata_list):
+    """メタデータの辞書のリストを型付きのArrowテーブルに変換"""
+    columns = {name: [] for name in SCHEMA.names}
+    for meta in metadata_list:
+        bbox = meta['bbox']
+        columns['datetime'].append(_to_timestamp(meta['datetime']))
+        columns['cloud_cover'].append(meta.get('cloud_cover'))
+        columns['tile_id'].append(meta['tile_id'])
+        columns['platform'].append(meta['platform'])
+        columns['min_lon'].append(float(bbox[0]))
+        columns['min_lat'].append(float(bbox[1]))
+        columns['max_lon'].append(float(bbox[2]))
+        columns['max_lat'].append(float(bbox[3]))
+        columns['resolution'].append(meta.get('resolution', 10))
+    return pa.table(columns, schema=SCHEMA)
+
+
+def table_to_records(table):
+    """Arrowテーブルを従来のJSON形式と同じ辞書のリストに変換"""
+    records = []
+    for row in table.to_pylist():
+        records.append({
+            'datetime': row['datetime'].strftime(DATETIME_FORMAT),
+            'cloud_cover': row['cloud_cover'],
+            'tile_id': row['tile_id'],
+            'platform': row['platform'],
+            'bbox': [row['min_lon'], row['min_lat'], row['max_lon'], row['max_lat']],
+            'resolution': row['resolution']
+        })
+    return records
+
+
+class MetadataStore:
+    """
+    衛星メタデータのParquetストア
+
+    datetime, cloud_cover, platform, tile_id, bboxを型付きの列として保持し、
+    日付範囲・雲量・プラットフォーム・範囲の条件はParquetの行グループ統計を
+    使って読み込み時に絞り込む（predicate pushdown）。
+    Parquetファイルがなく従来のsatellite_metadata.jsonがある場合は、
+    初回アクセス時にそこから移行する。
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH, legacy_json_path=LEGACY_JSON_PATH,
+                 row_group_size=4096):
+        """
+        Args:
+            path: Parquetファイルのパス
+            legacy_json_path: 移行元のJSONファイルのパス
+            row_group_size: 1行グループあたりの行数
+        """
+        self.path = path
+        self.legacy_json_path = legacy_json_path
+        self.row_group_size = row_group_size
+
+    def exists(self):
+        if os.path.exists(self.path):
+            return True
+        return self.legacy_json_path is not None and os.path.exists(self.legacy_json_path)
+
+    def _ensure_migrated(self):
+        if os.path.exists(self.path):
+            return True
+        if self.legacy_json_path is None or not os.path.exists(self.legacy_json_path):
+            return False
+        with open(self.legacy_json_path, 'r') as f:
+            self.write(json.load(f))
+        print(f"{self.legacy_json_path} を {self.path} に移行しました")
+        return True
+
+    def write(self, metadata_list):
+        """
+        メタデータ全体を書き込む
+
+        日時順に並べて書き込むことで、行グループごとの日時の統計が
+        重ならず、日付範囲の条件で不要な行グループを読み飛ばせる。
+        """
+        table = records_to_table(metadata_list)
+        table = table.sort_by([('datetime', 'ascending'), ('tile_id', 'ascending')])
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        pq.write_table(table, tmp_path, row_group_size=self.row_group_size)
+        os.replace(tmp_path, self.path)
+
+    def upsert(self, metadata_list):
+        """
+        tile_idをキーとしてメタデータを追加・更新する
+
+        Returns:
+            新規に追加されたメタデータのリスト
+        """
+        existing = self.query() if self._ensure_migrated() else []
+        merged = {meta['tile_id']: meta for meta in existing}
+        added = [meta for meta in metadata_list if meta['tile_id'] not in merged]
+        for meta in metadata_list:
+            merged[meta['tile_id']] = meta
+        self.write(list(merged.values()))
+        return added
+
+    def read_table(self, start=None, end=None, cloud_cover_below=None, platform=None,
+                   bbox=None, columns=None):
+        """
+        条件に合うメタデータをArrowテーブルとして読み込む
+
+        Args:
+            start: この日時以降（含む）
+            end: この日時より前（含まない）
+            cloud_cover_below: 雲量がこの値未満（雲量が不明なものは除外）
+            platform: プラットフォーム名（例: 'sentinel-2a'）
+            bbox: (min_lon, min_lat, max_lon, max_lat) と重なるもの
+            columns: 読み込む列（Noneの場合はすべて）
+
+        Returns:
+            新しい順に並べたpyarrow.Table
+        """
+        if not self._ensure_migrated():
+            return SCHEMA.empty_table()
+
+        filters = []
+        if start is not None:
+            filters.append(('datetime', '>=', _to_timestamp(start)))
+        if end is not None:
+            filters.append(('datetime', '<', _to_timestamp(end)))
+        if cloud_cover_below is not None:
+            filters.append(('cloud_cover', '<', float(cloud_cover_below)))
+        if platform is not None:
+            filters.append(('platform', '=', platform.lower()))
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox)
+            filters += [
+                ('min_lon', '<=', max_lon), ('max_lon', '>=', min_lon),
+                ('min_lat', '<=', max_lat), ('max_lat', '>=', min_lat),
+            ]
+
+        table = pq.read_table(self.path, columns=columns, filters=filters or None)
+        if 'datetime' in table.column_names:
+            table = table.sort_by([('datetime', 'descending')])
+        return table
+
+    def query(self, **conditions):
+        """
+        条件に合うメタデータを従来のJSON形式と同じ辞書のリストで返す
+
+        条件はread_tableと同じ。
+        """
+        return table_to_records(self.read_table(**conditions))
+
+    def to_dataframe(self, **conditions):
+        """条件に合うメタデータをpandas.DataFrameで返す"""
+        return self.read_table(**conditions).to_pandas()
+
+    def latest_datetime(self):
+        """保存されている最も新しい取得日時を返す（空の場合はNone）"""
+        if not self._ensure_migrated():
+            return None
+        latest = pc.max(pq.read_table(self.path, columns=['datetime'])['datetime']).as_py()
+        return latest.strftime(DATETIME_FORMAT) if latest is not None else None
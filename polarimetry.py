@@ -0,0 +1,69 @@
+import numpy as np
+
+# 取得するSARデータのバンドの並び（1始まりのバンド番号の順）
+SAR_BANDS = ('VV', 'VH', 'dataMask')
+# dual_pol_productsが返すプロダクトの並び
+POLARIMETRIC_PRODUCTS = ('vv_db', 'cross_pol_db', 'vv_vh_ratio_db', 'rvi')
+# 1回に処理する行数（4つのプロダクトの計算中、入力の行がCPUキャッシュに残る大きさ）
+FUSED_CHUNK_ROWS = 64
+
+
+def band_index(name, bands=SAR_BANDS):
+    """バンド名からrasterioのバンド番号（1始まり）を返す"""
+    return bands.index(name) + 1
+
+
+def _fill_products(vv, vh, valid, out):
+    """
+    1チャンク分の4つのプロダクトをoutに書き込む（一時配列を作らない）
+
+    無効な画素は計算せず（未初期化の値のまま）、最後にまとめてNaNにする。
+    """
+    vv_db, cross_db, ratio_db, rvi = out
+    np.log10(vv, out=vv_db, where=valid)
+    vv_db *= 10
+    np.log10(vh, out=cross_db, where=valid)
+    cross_db *= 10
+    # VV/VH比（dB）= VV(dB) - VH(dB)
+    np.subtract(vv_db, cross_db, out=ratio_db)
+    # デュアル偏波のレーダー植生指数 RVI = 4 VH / (VV + VH)
+    np.add(vv, vh, out=rvi)
+    np.divide(vh, rvi, out=rvi, where=valid)
+    rvi *= 4
+    out[:, ~valid] = np.nan
+
+
+def dual_pol_products(vv_linear, vh_linear, data_mask=None, chunk_rows=FUSED_CHUNK_ROWS):
+    """
+    VV・VHの後方散乱係数（線形）から偏波のプロダクトを1回の走査で計算
+
+    数行ずつのチャンクごとに、dBへの変換・VV/VH比・RVIをまとめて計算して
+    出力配列に直接書き込む。入力は1回だけ読まれ、シーン全体の大きさの一時配列は作らない。
+    VV・VHのどちらかがゼロ以下またはNaNの画素と、dataMaskが0の画素はNaNになる。
+
+    Args:
+        vv_linear: VVの後方散乱係数（線形、2次元）
+        vh_linear: VHの後方散乱係数（線形、2次元）
+        data_mask: Sentinel HubのdataMask（0は欠損）。Noneの場合は使わない
+        chunk_rows: 1回に処理する行数
+
+    Returns:
+        (4, 行, 列) のfloat32配列（POLARIMETRIC_PRODUCTSの順）
+    """
+    vv_linear = np.asarray(vv_linear)
+    vh_linear = np.asarray(vh_linear)
+    if vv_linear.shape != vh_linear.shape:
+        raise ValueError(f"VVとVHの形状が一致しません: {vv_linear.shape} と {vh_linear.shape}")
+
+    height = vv_linear.shape[0]
+    products = np.empty((len(POLARIMETRIC_PRODUCTS),) + vv_linear.shape, dtype=np.float32)
+    for row in range(0, height, chunk_rows):
+        rows = slice(row, min(row + chunk_rows, height))
+        vv = vv_linear[rows].astype(np.float32, copy=False)
+        vh = vh_linear[rows].astype(np.float32, copy=False)
+        with np.errstate(invalid='ignore', over='ignore'):
+            valid = (vv > 0) & (vh > 0)
+            if data_mask is not None:
+                valid &= np.asarray(data_mask[rows]) > 0
+            _fill_products(vv, vh, valid, products[:, rows])
+    return products
@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from sentinelhub import SentinelHubDownloadClient
+from sentinelhub.decoding import decode_data
+
+DEFAULT_CACHE_DIR = '.sh_cache'
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2GB
+
+
+class RequestCache:
+    """
+    SentinelHubRequestのレスポンスをディスクに保存するキャッシュ
+
+    キーはリクエストのURLとペイロード（評価スクリプト、データコレクション、
+    時間範囲、bbox、サイズを含む）のハッシュ。容量がmax_bytesを超えると
+    最も長く使われていないエントリから削除する（LRU）。
+    書き込みは一時ファイルからのリネームで行うため、途中で中断しても
+    壊れたエントリは残らない。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        """
+        Args:
+            cache_dir: キャッシュを保存するディレクトリ
+            max_bytes: キャッシュ全体の容量の上限（バイト）
+        """
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        # 既存のエントリを最終アクセス時刻の古い順に読み込む
+        entries = []
+        for path in self.cache_dir.glob('*/*'):
+            if path.name.startswith('.'):
+                continue
+            stat = path.stat()
+            entries.append((stat.st_mtime, path.name, stat.st_size))
+        self.entries = OrderedDict((key, size) for _, key, size in sorted(entries))
+        self.total_bytes = sum(self.entries.values())
+
+    @staticmethod
+    def key_for(download_request):
+        """DownloadRequestからキャッシュキーを計算"""
+        payload = {
+            'url': download_request.url,
+            'post_values': download_request.post_values
+        }
+        hashable = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(hashable.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key):
+        """キャッシュからレスポンスを取得（存在しない場合はNone）"""
+        path = self._path(key)
+        try:
+            content = path.read_bytes()
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+                self.total_bytes -= self.entries.pop(key, 0)
+            return None
+        with self.lock:
+            self.hits += 1
+            # 最終アクセス時刻とLRUの順序はロック内で更新する（読み込み後に他のスレッドの
+            # put()で削除された場合は、読み込んだ内容だけを返してエントリには戻さない）
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                self.total_bytes -= self.entries.pop(key, 0)
+                return content
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            else:
+                self.entries[key] = len(content)
+                self.total_bytes += len(content)
+        return content
+
+    def put(self, key, content):
+        """レスポンスをキャッシュに保存"""
+        path = self._path(key)
+        path.parent.mkdir(exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with self.lock:
+            self.total_bytes -= self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+            self.total_bytes += len(content)
+            self._evict()
+
+    def _evict(self):
+        """容量の上限を超えている間、最も古いエントリを削除"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self._path(key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self):
+        """ヒット数・ミス数とキャッシュの使用量を返す"""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'entries': len(self.entries),
+            'bytes': self.total_bytes
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"キャッシュ: ヒット {stats['hits']}件, ミス {stats['misses']}件, "
+              f"{stats['entries']}エントリ ({stats['bytes'] / 1024 ** 2:.1f}MB)")
+
+
+def get_data(request, cache=None, save_data=False):
+    """
+    キャッシュを考慮してSentinelHubRequestのデータを取得
+
+    SentinelHubRequest.get_dataの代わりに使用する。キャッシュに存在しない
+    レスポンスだけをダウンロードし、取得結果をキャッシュに保存する。
+    save_data=Trueの場合はget_data(save_data=True)と同じ場所にも保存する。
+
+    Args:
+        request: SentinelHubRequest
+        cache: RequestCache（Noneの場合はキャッシュを使わない）
+        save_data: レスポンスをdata_folderにも保存するかどうか
+
+    Returns:
+        デコードされたデータのリスト
+    """
+    if cache is None:
+        return request.get_data(save_data=save_data)
+
+    download_list = request.download_list
+    keys = [RequestCache.key_for(download_request) for download_request in download_list]
+    contents = [cache.get(key) for key in keys]
+
+    missing = [i for i, content in enumerate(contents) if content is None]
+    if missing:
+        client = SentinelHubDownloadClient(config=request.config)
+        responses = client.download([download_list[i] for i in missing], decode_data=False)
+        for i, response in zip(missing, responses):
+            contents[i] = response.content
+            cache.put(keys[i], response.content)
+
+    if save_data:
+        for download_request, content in zip(download_list, contents):
+            _, response_path = download_request.get_storage_paths()
+            if response_path is not None and not os.path.exists(response_path):
+                os.makedirs(os.path.dirname(response_path), exist_ok=True)
+                with open(response_path, 'wb') as f:
+                    f.write(content)
+
+    return [
+        decode_data(content, download_request.data_type)
+        for download_request, content in zip(download_list, contents)
+    ]
@@ -1,26 +1,52 @@
 import os
 import json
+import hashlib
 from datetime import datetime
 import numpy as np
 import rasterio
 from sentinelhub import (
-    SentinelHubDownloadClient,
     SentinelHubSession,
     SHConfig,
     BBox,
     CRS,
     DataCollection,
     DownloadRequest,
-    MimeType,
-    bbox_to_dimensions
+    MimeType
 )
+from sentinelhub.decoding import decode_data
 from pathlib import Path
 
+from aoi_tiling import Mosaic, plan_tiles
+from change_detection import detect_changes
+from scene_downloader import SceneDownloader, is_auth_error
+
+# VVの後方散乱係数（線形）をFLOAT32で返すevalscript
+SAR_EVALSCRIPT = """
+//VERSION=3
+function setup() {
+    return {
+        input: ["VV"],
+        output: { bands: 1, sampleType: "FLOAT32" }
+    };
+}
+function evaluatePixel(sample) {
+    return [sample.VV];
+}
+"""
+
 class SARDataProcessor:
-    def __init__(self, config_path='config.ini'):
+    def __init__(self, config_path='config.ini', max_workers=4, rate=5.0):
+        """
+        Args:
+            config_path: 設定ファイルのパス
+            max_workers: 同時に取得する期間数の上限
+            rate: 1秒あたりのリクエスト数の上限
+        """
         self.config = SHConfig()
         self.load_config(config_path)
         self.session = SentinelHubSession(config=self.config)
+        # すべての取得で共有するダウンロードクライアント（HTTP接続と認証トークンを再利用）
+        self.downloader = SceneDownloader(self.config, max_workers=max_workers, rate=rate, session=self.session)
         self.output_dir = Path("sar_data")
         self.output_dir.mkdir(exist_ok=True)
 
@@ -45,34 +71,31 @@ class SARDataProcessor:
         else:
             raise ValueError("設定ファイルにsentinelhubセクションが見つかりません")
 
-    def get_sar_data(self, bbox, time_interval, resolution=10):
+    def build_request(self, request_bbox, size, time_interval):
         """
-        SARデータを取得する
+        1タイル・1期間分のProcess APIのリクエストを作成する
         
         Args:
-            bbox: (min_x, min_y, max_x, max_y)の形式のBBox
+            request_bbox: タイルのBBox（aoi_tiling.plan_tilesのタイル）
+            size: (width, height) の画素数（Process APIの上限以下）
             time_interval: (start_date, end_date)の形式のタプル
-            resolution: 出力解像度（メートル）
         
         Returns:
-            SARデータのパス
+            DownloadRequest（認証セッションのトークンを付けて送る）
         """
         start_date, end_date = time_interval
-        bbox = BBox(bbox=bbox, crs=CRS.WGS84)
-        
-        width, height = bbox_to_dimensions(bbox, resolution=resolution)
+        width, height = size
         
-        request = DownloadRequest(
-            data_folder=str(self.output_dir),
+        return DownloadRequest(
             request_type='POST',
             url='https://services.sentinel-hub.com/api/v1/process',
             headers={'Content-Type': 'application/json'},
             post_values={
                 "input": {
                     "bounds": {
-                        "bbox": bbox.lower_left + bbox.upper_right,
+                        "bbox": list(request_bbox),
                         "properties": {
-                            "crs": "http://www.opengis.net/def/crs/OGC/1.3/CRS84"
+                            "crs": request_bbox.crs.opengis_string
                         }
                     },
                     "data": [
@@ -91,6 +114,8 @@ class SARDataProcessor:
                     ]
                 },
                 "output": {
+                    "width": width,
+                    "height": height,
                     "responses": [
                         {
                             "identifier": "default",
@@ -99,42 +124,144 @@ class SARDataProcessor:
                             }
                         }
                     ]
-                }
+                },
+                "evalscript": SAR_EVALSCRIPT
             },
-            save_response=True
+            data_type=MimeType.TIFF,
+            use_session=True
         )
+
+    def period_path(self, bbox, time_interval, resolution=10):
+        """
+        1期間分のSARデータの保存先（output_dir/<範囲・期間・解像度のハッシュ>/response.tiff）
+        """
+        key = json.dumps({
+            'bbox': list(bbox),
+            'time_interval': list(time_interval),
+            'resolution': resolution
+        }, sort_keys=True)
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.output_dir, digest, 'response.tiff')
+
+    def check_auth(self):
+        """
+        認証トークンを確認する（期限切れの場合は更新する）
+        
+        認証に失敗した場合は、リクエストを送る前にValueErrorを送出する。
+        """
+        try:
+            self.session.session_headers
+        except Exception as e:
+            raise ValueError(f"Sentinel Hubの認証に失敗しました: {e}") from e
+
+    def get_sar_data_many(self, bbox, intervals, resolution=10):
+        """
+        複数の期間のSARデータを並列に取得する
         
-        client = SentinelHubDownloadClient(config=self.config, session=self.session)
-        response = client.download(request)
+        1つのダウンロードクライアント（接続を再利用するHTTPセッションと認証セッション）で
+        すべての期間のリクエストを同時に送る。保存済みの期間は再取得しない。
+        認証エラーの場合は残りのリクエストを中止して直ちにValueErrorを送出する。
         
-        # 出力ファイルのパスを返す
-        return os.path.join(self.output_dir, response['default']['url'].split('/')[-1])
+        Args:
+            bbox: (min_x, min_y, max_x, max_y)の形式のBBox
+            intervals: (start_date, end_date)の形式のタプルのリスト
+            resolution: 出力解像度（メートル）
+        
+        Returns:
+            intervalsの順序どおりのSARデータのパスのリスト（取得に失敗した期間はNone）
+        """
+        paths, errors = self._download_many(bbox, intervals, resolution)
+        for index, error in errors.items():
+            print(f"期間 {intervals[index]} のSARデータを取得できませんでした: {error}")
+        return paths
 
-    def calculate_difference(self, file1, file2, output_path):
+    def _download_many(self, bbox, intervals, resolution):
+        """
+        期間ごとのパスのリストと {期間の番号: エラー} を返す
+        
+        範囲はProcess APIの画素数の上限以下のタイルに分割し（aoi_tiling.plan_tiles）、
+        全ての期間のタイルをまとめて並列に取得して期間ごとに1枚のGeoTIFFに組み立てる。
+        1タイルでも取得できなかった期間は失敗とし、ファイルを保存しない。
+        """
+        plan = plan_tiles(BBox(bbox=bbox, crs=CRS.WGS84), resolution)
+        paths = [self.period_path(bbox, interval, resolution) for interval in intervals]
+        pending = [index for index, path in enumerate(paths) if not os.path.exists(path)]
+        errors = {}
+        if not pending:
+            return paths, errors
+        
+        tile_requests = [
+            (index, tile_index, self.build_request(tile['bbox'], tile['size'], intervals[index]))
+            for index in pending
+            for tile_index, tile in enumerate(plan.tiles)
+        ]
+        mosaics = {index: Mosaic(plan) for index in pending}
+        
+        self.check_auth()
+        for position, content, error in self.downloader.download([request for _, _, request in tile_requests]):
+            index, tile_index, _ = tile_requests[position]
+            if error is not None and is_auth_error(error):
+                raise ValueError(f"Sentinel Hubの認証に失敗しました: {error}") from error
+            mosaic = mosaics[index]
+            if error is not None:
+                mosaic.add_error(tile_index, error)
+            else:
+                mosaic.add(tile_index, decode_data(content, MimeType.TIFF))
+            if not mosaic.done:
+                continue
+            if mosaic.errors:
+                errors[index] = next(iter(mosaic.errors.values()))
+            else:
+                mosaic.write_geotiff(paths[index])
+            mosaics[index] = None
+        
+        return [None if index in errors else path for index, path in enumerate(paths)], errors
+
+    def get_sar_data(self, bbox, time_interval, resolution=10):
+        """
+        SARデータを取得する
+        
+        Args:
+            bbox: (min_x, min_y, max_x, max_y)の形式のBBox
+            time_interval: (start_date, end_date)の形式のタプル
+            resolution: 出力解像度（メートル）
+        
+        Returns:
+            SARデータのパス
+        """
+        paths, errors = self._download_many(bbox, [time_interval], resolution)
+        if errors:
+            raise errors[0]
+        return paths[0]
+
+    def calculate_difference(self, file1, file2, output_path, method='db_difference'):
         """
         2つのSARデータの差分を計算する
         
+        グリッドが一致するかを確認し、ブロックごとに計算して保存する（change_detection）。
+        
         Args:
             file1: ファイル1のパス
             file2: ファイル2のパス
             output_path: 差分データの出力パス
+            method: 'db_difference'（dBの差）または 'log_ratio'（自然対数の比）
         """
-        with rasterio.open(file1) as src1:
-            data1 = src1.read(1)
-            profile = src1.profile
-
-        with rasterio.open(file2) as src2:
-            data2 = src2.read(1)
+        detect_changes([file1, file2], pairs=[(0, 1)], output_paths=[output_path], method=method)
 
-        # 差分を計算
-        diff = data2 - data1
+    def calculate_changes(self, files, output_dir, method='db_difference', pairs='consecutive'):
+        """
+        複数のSARデータの変化量をまとめて計算する
         
-        # メタデータを更新
-        profile.update(dtype=diff.dtype)
+        Args:
+            files: 取得順のファイルのパスのリスト
+            output_dir: 出力ディレクトリ
+            method: 'db_difference' または 'log_ratio'
+            pairs: 'consecutive'（隣り合う組）または 'all'（すべての組）
         
-        # 差分データを保存
-        with rasterio.open(output_path, 'w', **profile) as dst:
-            dst.write(diff, 1)
+        Returns:
+            組ごとの結果のリスト {'before', 'after', 'path'}
+        """
+        return detect_changes(files, output_dir, method=method, pairs=pairs)
 
     def plot_difference(self, diff_file, output_path):
         """
@@ -148,10 +275,12 @@ class SARDataProcessor:
         
         with rasterio.open(diff_file) as src:
             diff = src.read(1)
-            
+        
+        # 差分（dB）の98パーセンタイルで色の範囲を対称に決める
+        limit = np.nanpercentile(np.abs(diff), 98) if np.isfinite(diff).any() else 1.0
         plt.figure(figsize=(10, 10))
-        plt.imshow(diff, cmap='seismic', vmin=-100, vmax=100)
-        plt.colorbar(label='差分値')
+        plt.imshow(diff, cmap='seismic', vmin=-limit, vmax=limit)
+        plt.colorbar(label='差分値 (dB)')
         plt.title('SARデータの差分')
         plt.savefig(output_path)
         plt.close()
@@ -167,9 +296,11 @@ def main():
     period1 = ('2023-01-01', '2023-01-15')
     period2 = ('2023-06-01', '2023-06-15')
     
-    # SARデータを取得
-    sar1_path = processor.get_sar_data(bbox, period1)
-    sar2_path = processor.get_sar_data(bbox, period2)
+    # SARデータを取得（2つの期間を並列に取得）
+    sar1_path, sar2_path = processor.get_sar_data_many(bbox, [period1, period2])
+    if sar1_path is None or sar2_path is None:
+        print("SARデータを取得できなかったため、差分を計算できません")
+        return
     
     # 差分を計算
     diff_path = processor.output_dir / 'difference.tif'
@@ -0,0 +1,174 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+
+import analyze_sar_data as sar
+
+
+def grid_key(crs, transform, shape):
+    """グリッド（CRS・transform・形状）を識別するキー"""
+    crs_wkt = None if crs is None else CRS.from_user_input(crs).to_wkt()
+    return (crs_wkt, tuple(round(v, 12) for v in tuple(transform)[:6]), (int(shape[0]), int(shape[1])))
+
+
+def scene_grid(tiff_path, aoi):
+    """シーンを読み込んだときのグリッド（ヘッダーのみ読み込む）"""
+    with rasterio.open(tiff_path) as src:
+        window = aoi.window_for(src)
+        if window is None:
+            return None
+        return src.crs, src.window_transform(window), (int(window.height), int(window.width))
+
+
+def share_array(array):
+    """
+    配列を共有メモリにコピー
+
+    Returns:
+        (SharedMemory, ワーカーで復元するための (名前, 形状, 型))
+    """
+    array = np.asarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def attach_array(spec):
+    """共有メモリの配列を復元（コピーしない読み取り専用のビュー）"""
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    array.flags.writeable = False
+    return shm, array
+
+
+# ワーカープロセス内の共有レイヤー（グリッドのキー -> 配列）
+_worker_layers = {}
+_worker_shms = []
+
+
+def _init_worker(layer_specs):
+    """ワーカープロセスの初期化（共有メモリのDEMを復元）"""
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+    for key, spec in layer_specs.items():
+        shm, array = attach_array(spec)
+        _worker_shms.append(shm)
+        _worker_layers[key] = array
+
+
+class SharedDEM:
+    """
+    ワーカープロセス内で共有メモリのDEMを返す（DEMResamplerと同じインターフェース）
+    """
+
+    def resample_to(self, ref_meta):
+        key = grid_key(ref_meta['crs'], ref_meta['transform'], (ref_meta['height'], ref_meta['width']))
+        if key not in _worker_layers:
+            raise ValueError("シーンのグリッドに対応するDEMが共有されていません")
+        return _worker_layers[key]
+
+
+def _process_scene(tiff_path, tag, aoi, products, output_dir, use_dem, speckle):
+    """ワーカープロセスで1シーンを処理"""
+    start = time.perf_counter()
+    try:
+        scene = sar.SARScene(tiff_path, tag, SharedDEM() if use_dem else None, aoi, speckle=speckle)
+        errors = sar.run_products(scene, products, output_dir)
+        error = None
+    except Exception as e:
+        errors = {}
+        error = str(e)
+    return {'tag': tag, 'errors': errors, 'error': error, 'elapsed': time.perf_counter() - start}
+
+
+class SARSceneRunner:
+    """
+    SARシーンをプロセスプールで並列に処理するランナー
+
+    DEMはシーンのグリッドごとに親プロセスで1回だけリサンプリングして共有メモリに置き、
+    ワーカーはコピーせずに参照する。同じグリッドのシーンは同じDEMを共有する。
+    """
+
+    def __init__(self, products, output_dir, aoi=sar.SADO_AOI, dem_resampler=None, max_workers=None, speckle=None):
+        """
+        Args:
+            products: 出力するプロダクト名のリスト
+            output_dir: 出力ディレクトリ
+            aoi: 解析範囲
+            dem_resampler: DEMのリサンプリング（DEMが必要なプロダクトがない場合はNone）
+            max_workers: ワーカープロセス数（Noneの場合はCPUコア数）
+            speckle: 読み込み時にかけるスペックルフィルタ（SpeckleFilter）
+        """
+        self.products = list(products)
+        self.output_dir = output_dir
+        self.aoi = aoi
+        self.dem_resampler = dem_resampler
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.speckle = speckle
+
+    def _share_dems(self, scenes):
+        """シーンのグリッドごとにDEMをリサンプリングして共有メモリに置く"""
+        shms = []
+        specs = {}
+        if self.dem_resampler is None:
+            return shms, specs
+        for tiff_path, _ in scenes:
+            try:
+                grid = scene_grid(tiff_path, self.aoi)
+            except Exception:
+                continue  # 読み込めないシーンはワーカーでエラーとして報告する
+            if grid is None:
+                continue
+            key = grid_key(*grid)
+            if key in specs:
+                continue
+            crs, transform, shape = grid
+            shm, spec = share_array(self.dem_resampler.resample(crs, transform, shape))
+            shms.append(shm)
+            specs[key] = spec
+        return shms, specs
+
+    def run(self, scenes):
+        """
+        シーンを並列に処理
+
+        Args:
+            scenes: (TIFFのパス, タグ) のリスト
+
+        Returns:
+            シーンの順序どおりの結果のリスト
+            {'tag', 'errors': {プロダクト名: エラー}, 'error': シーンのエラーまたはNone, 'elapsed': 処理時間}
+        """
+        scenes = list(scenes)
+        if not scenes:
+            return []
+        shms, specs = self._share_dems(scenes)
+        print(f"{len(scenes)}シーンを{self.max_workers}プロセスで処理します（共有DEM: {len(specs)}グリッド）")
+        try:
+            with ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker,
+                                     initargs=(specs,)) as executor:
+                futures = [
+                    executor.submit(_process_scene, tiff_path, tag, self.aoi, self.products,
+                                    self.output_dir, self.dem_resampler is not None, self.speckle)
+                    for tiff_path, tag in scenes
+                ]
+                results = []
+                for (_, tag), future in zip(scenes, futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'tag': tag, 'errors': {}, 'error': str(e), 'elapsed': None}
+                    if result['error'] is not None:
+                        print(f"{tag} の処理に失敗しました。エラー: {result['error']}")
+                    results.append(result)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+        return results
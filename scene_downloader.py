@@ -0,0 +1,221 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from sentinelhub import SentinelHubSession
+
+# リトライ対象のHTTPステータス（レート制限とサーバ側の一時的なエラー）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 認証エラーのHTTPステータス（リトライしても成功しない）
+AUTH_STATUS_CODES = {401, 403}
+
+
+class SceneDownloadError(Exception):
+    """シーンのダウンロードがリトライ上限を超えて失敗した場合の例外"""
+
+
+class TokenBucket:
+    """
+    スレッドセーフなトークンバケット型のレートリミッタ
+
+    APIのレスポンスヘッダ（Retry-After / X-RateLimit-Remaining）を受け取ると、
+    それに従ってバケットを空にし、指定時間すべてのワーカーを待機させる。
+    """
+
+    RETRY_HEADER = 'Retry-After'
+    REMAINING_HEADER = 'X-RateLimit-Remaining'
+
+    def __init__(self, rate=5.0, capacity=None):
+        """
+        Args:
+            rate: 1秒あたりに補充されるトークン数（リクエスト数）
+            capacity: バケットの容量（バースト可能なリクエスト数）
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated_at
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        """トークンを1つ取得できるまで待機する"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.paused_until:
+                    wait = self.paused_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def update_from_headers(self, headers):
+        """
+        レスポンスヘッダからレート制限の情報を反映する
+
+        Sentinel HubのRetry-Afterはミリ秒単位で返される。
+        """
+        retry_after = headers.get(self.RETRY_HEADER)
+        remaining = headers.get(self.REMAINING_HEADER)
+        with self.lock:
+            now = time.monotonic()
+            if retry_after is not None:
+                try:
+                    wait = float(retry_after) / 1000
+                except ValueError:
+                    wait = 0.0
+                if wait > 0:
+                    self.paused_until = max(self.paused_until, now + wait)
+                    self.tokens = 0.0
+                    self.updated_at = max(now, self.paused_until)
+            if remaining is not None:
+                try:
+                    self.tokens = min(self.tokens, float(remaining))
+                except ValueError:
+                    pass
+
+
+def is_auth_error(error):
+    """認証エラー（HTTP 401/403）かどうか"""
+    response = getattr(error, 'response', None)
+    return response is not None and response.status_code in AUTH_STATUS_CODES
+
+
+def backoff_delay(attempt, base=1.0, cap=30.0):
+    """指数バックオフ（フルジッタ）による待機時間を秒で返す"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+class SceneDownloader:
+    """
+    Process APIへのリクエストを並列に実行するダウンロードエンジン
+
+    同時実行数はスレッドプールのサイズで制限し、リクエストの発行間隔は
+    TokenBucketで制御する。レート制限やサーバエラーはジッタ付きの
+    指数バックオフでリトライする。
+
+    base_urlにローカルのスタブサーバを指定し、sh_configに認証情報を
+    設定しなければ、認証なしでスタブに対してリクエストを送る。
+
+    HTTPセッションはインスタンスで1つを全てのスレッドで共有し（接続プールの大きさは
+    max_workers）、download()を複数回呼び出しても接続を再利用する。
+    """
+
+    def __init__(self, sh_config, max_workers=4, rate=5.0, capacity=None,
+                 max_retries=5, timeout=120, session=None, base_url=None, cache=None):
+        """
+        Args:
+            sh_config: SHConfig
+            max_workers: 同時にダウンロードするシーン数の上限
+            rate: 1秒あたりのリクエスト数の上限
+            capacity: トークンバケットの容量
+            max_retries: 1リクエストあたりの最大リトライ回数
+            timeout: 1リクエストのタイムアウト（秒）
+            session: SentinelHubSession（省略時は認証情報があれば自動作成）
+            base_url: リクエスト先のスキームとホストを差し替える場合のURL
+            cache: RequestCache（指定するとキャッシュ済みのレスポンスは再取得しない）
+        """
+        self.config = sh_config
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.base_url = base_url
+        self.cache = cache
+        self.limiter = TokenBucket(rate=rate, capacity=capacity)
+        if session is None and sh_config.sh_client_id:
+            session = SentinelHubSession(config=sh_config)
+        self.session = session
+        self.session_lock = threading.Lock()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.http = requests.Session()
+        self.http.mount('https://', adapter)
+        self.http.mount('http://', adapter)
+
+    def _url(self, download_request):
+        if self.base_url is None:
+            return download_request.url
+        path = urlsplit(download_request.url)
+        base = urlsplit(self.base_url)
+        return urlunsplit((base.scheme, base.netloc, path.path, path.query, path.fragment))
+
+    def _headers(self, download_request):
+        headers = {}
+        if self.session is not None and download_request.use_session:
+            with self.session_lock:
+                headers.update(self.session.session_headers)
+        headers.update(download_request.headers)
+        return headers
+
+    def fetch(self, download_request):
+        """
+        DownloadRequestを1件実行してレスポンスのバイト列を返す
+        """
+        if self.cache is not None:
+            key = self.cache.key_for(download_request)
+            content = self.cache.get(key)
+            if content is not None:
+                return content
+
+        attempt = 0
+        while True:
+            self.limiter.acquire()
+            try:
+                response = self.http.request(
+                    download_request.request_type.value,
+                    url=self._url(download_request),
+                    json=download_request.post_values,
+                    headers=self._headers(download_request),
+                    timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                error = e
+            else:
+                self.limiter.update_from_headers(response.headers)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    if self.cache is not None:
+                        self.cache.put(key, response.content)
+                    return response.content
+                error = SceneDownloadError(f"HTTP {response.status_code}: {download_request.url}")
+
+            if attempt >= self.max_retries:
+                raise SceneDownloadError(f"リトライ上限に達しました: {error}") from error
+            time.sleep(backoff_delay(attempt))
+            attempt += 1
+
+    def download(self, download_requests):
+        """
+        複数のDownloadRequestを並列に実行する
+
+        完了した順に(index, content, error)を返すジェネレータ。
+        失敗したリクエストはcontentがNoneになり、errorに例外が入る。
+        途中で反復をやめた場合、まだ開始していないリクエストは実行しない。
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self.fetch, request): index
+                for index, request in enumerate(download_requests)
+            }
+            try:
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        yield index, future.result(), None
+                    except Exception as e:
+                        yield index, None, e
+            finally:
+                for future in futures:
+                    future.cancel()
@@ -0,0 +1,60 @@
+from collections import defaultdict
+
+
+def bbox_intersects(bbox_a, bbox_b):
+    """
+    2つのbbox (min_lon, min_lat, max_lon, max_lat) が重なるかどうかを判定
+    """
+    a = [float(v) for v in bbox_a]
+    b = [float(v) for v in bbox_b]
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def plan_scene_requests(metadata_list, aoi_bbox=None):
+    """
+    カタログの検索結果を取得日ごとにまとめ、Process APIのリクエスト計画を作成
+
+    同じ観測（データテイク）はMGRSタイルごとに別エントリとして返されるが、
+    AOIのモザイクとしては1回のリクエストで取得できる。画像は
+    satellite_{date}.png として日付単位で保存されるため、取得日ごとに
+    1リクエストへ集約する。AOIと重ならないエントリは計画から除外する。
+
+    Args:
+        metadata_list: get_satellite_metadataで取得したメタデータのリスト
+        aoi_bbox: AOIのbbox（BBoxまたは(min_lon, min_lat, max_lon, max_lat)）
+
+    Returns:
+        リクエスト計画のリスト。各要素はメタデータと同じ形式の辞書で、
+        モザイクの時間範囲 'time_interval' と元の 'tile_ids' を持つ。
+    """
+    groups = defaultdict(list)
+    for metadata in metadata_list:
+        if aoi_bbox is not None and not bbox_intersects(metadata['bbox'], tuple(aoi_bbox)):
+            continue
+        groups[metadata['datetime'][:10]].append(metadata)
+
+    plan = []
+    for date in sorted(groups, reverse=True):
+        items = groups[date]
+        # 雲量が最も少ないエントリを代表とする（モザイク順序もleastCC）
+        representative = min(
+            items,
+            key=lambda m: m['cloud_cover'] if m['cloud_cover'] is not None else float('inf')
+        )
+        datetimes = sorted(m['datetime'] for m in items)
+        entry = dict(representative)
+        entry['time_interval'] = (datetimes[0], datetimes[-1])
+        entry['tile_ids'] = [m['tile_id'] for m in items]
+        plan.append(entry)
+
+    return plan
+
+
+def print_plan_summary(metadata_list, plan):
+    """
+    リクエスト計画によって削減されたリクエスト数を表示
+    """
+    saved = len(metadata_list) - len(plan)
+    ratio = saved / len(metadata_list) if metadata_list else 0
+    print(f"\nカタログ {len(metadata_list)}件 を {len(plan)}件 のリクエストに集約しました"
+          f"（{saved}件削減, {ratio:.1%}）")
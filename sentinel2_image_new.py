@@ -18,6 +18,8 @@ from pathlib import Path
 import requests
 import base64
 import json
+from request_cache import RequestCache, get_data
+from aoi_tiling import plan_tiles, download_mosaic
 
 
 def save_image(data, output_path):
@@ -36,7 +38,7 @@ def save_image(data, output_path):
     image.save(output_path)
 
 
-def download_sentinel2_image(lat, lon, date, output_dir='sentinel2_images'):
+def download_sentinel2_image(lat, lon, date, output_dir='sentinel2_images', cache=None):
     # 設定ファイルの読み込み
     config_path = Path(__file__).parent / 'config.ini'
     config = configparser.ConfigParser(interpolation=None)
@@ -157,52 +159,40 @@ function evaluatePixel(sample) {
 }
     """
     one_month_ago = (datetime.strptime(date, "%Y%m%d") - timedelta(days=30)).strftime("%Y%m%d")
-    request = SentinelHubRequest(
-        evalscript=evalscript,
-        input_data=[
-            SentinelHubRequest.input_data(
-                data_collection=DataCollection.SENTINEL2_L2A,
-                time_interval=(one_month_ago, date),
-                maxcc=0.1
-            )
-        ],
-        responses=[
-            SentinelHubRequest.output_response('default', MimeType.PNG)
-        ],
-        bbox=bbox,
-        size=bbox_to_dimensions(bbox, resolution=resolution),
-        config=sh_config
-    )
+
+    def make_request(request_bbox, size):
+        return SentinelHubRequest(
+            evalscript=evalscript,
+            input_data=[
+                SentinelHubRequest.input_data(
+                    data_collection=DataCollection.SENTINEL2_L2A,
+                    time_interval=(one_month_ago, date),
+                    maxcc=0.1
+                )
+            ],
+            responses=[
+                SentinelHubRequest.output_response('default', MimeType.PNG)
+            ],
+            bbox=request_bbox,
+            size=size,
+            config=sh_config
+        )
     
     # ダウンロードの実行
     try:
         print("データのダウンロードを開始します...")
-        data = request.get_data()
+        plan = plan_tiles(bbox, resolution)
+        if plan.needs_tiling:
+            # 画素数の上限を超える範囲はタイルに分割して取得し、1枚に組み立てる
+            mosaic, _ = download_mosaic(plan, make_request, sh_config, mime_type=MimeType.PNG, cache=cache)
+            data = [mosaic] if mosaic is not None else []
+        else:
+            request = make_request(bbox, bbox_to_dimensions(bbox, resolution=resolution))
+            data = get_data(request, cache)
         
         if not data:
-            print("データが見つかりませんでした。過去1ヶ月のデータを検索します...")
-            one_month_ago = (datetime.strptime(date, "%Y%m%d") - timedelta(days=30)).strftime("%Y%m%d")
-            request = SentinelHubRequest(
-                evalscript=evalscript,
-                input_data=[
-                    SentinelHubRequest.input_data(
-                        data_collection=DataCollection.SENTINEL2_L2A,
-                        time_interval=(one_month_ago, date),
-                        maxcc=0.1
-                    )
-                ],
-                responses=[
-                    SentinelHubRequest.output_response('default', MimeType.PNG)
-                ],
-                bbox=bbox,
-                size=bbox_to_dimensions(bbox, resolution=resolution),
-                config=config
-            )
-            data = request.get_data()
-            
-            if not data:
-                print("過去1ヶ月のデータも見つかりませんでした。")
-                return None
+            print("過去1ヶ月のデータが見つかりませんでした。")
+            return None
         
         # 緯度-経度フォルダを作成
         coord_dir = os.path.join(output_dir, f"{lat}_{lon}")
@@ -220,7 +210,7 @@ function evaluatePixel(sample) {
         print(f"エラーが発生しました: {str(e)}")
         return None
 
-def download_sentinel2_images_for_month(lat, lon, start_date, output_dir='sentinel2_images'):
+def download_sentinel2_images_for_month(lat, lon, start_date, output_dir='sentinel2_images', cache=None):
     """
     指定座標の指定日付から1か月の画像データを連続で取得する
     
@@ -229,6 +219,7 @@ def download_sentinel2_images_for_month(lat, lon, start_date, output_dir='sentin
         lon (float): 経度
         start_date (str): 開始日付 (YYYYMMDD形式)
         output_dir (str, optional): 出力ディレクトリ
+        cache (RequestCache, optional): レスポンスキャッシュ
     
     Returns:
         list: ダウンロードされた画像のパスのリスト
@@ -242,7 +233,7 @@ def download_sentinel2_images_for_month(lat, lon, start_date, output_dir='sentin
         print(f"\n{date_str}のデータを取得中...")
         
         # 単一の日付の画像を取得
-        image_path = download_sentinel2_image(lat, lon, date_str, output_dir)
+        image_path = download_sentinel2_image(lat, lon, date_str, output_dir, cache)
         
         if image_path:
             downloaded_images.append(image_path)
@@ -260,8 +251,10 @@ if __name__ == "__main__":
     
     # 1か月分の画像を取得
     start_date = "20250601"  # 2025年6月1日から
-    images = download_sentinel2_images_for_month(latitude, longitude, start_date)
+    cache = RequestCache()
+    images = download_sentinel2_images_for_month(latitude, longitude, start_date, cache=cache)
     print(f"\n合計{len(images)}枚の画像を取得しました")
+    cache.print_stats()
     
     # 単一の日付の画像を取得
     #single_date = "20250623"
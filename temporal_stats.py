@@ -0,0 +1,323 @@
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+from analyze_sar_data import SADO_AOI, read_sar_block, sar_block_windows
+from aoi import AOI
+from change_detection import scene_name
+from sar_parallel import grid_key
+
+DEFAULT_STORE_DIR = 'sar_stats'
+MANIFEST_NAME = 'manifest.json'
+# 画素ごとの累積値（ファイル名: 型）。平均と偏差平方和は桁落ちを避けるためfloat64で持つ
+STATS_LAYERS = {
+    'count': np.uint16,
+    'mean': np.float64,
+    'm2': np.float64,
+    'min': np.float32,
+    'max': np.float32
+}
+DEFAULT_MIN_COUNT = 3
+
+
+class TemporalStatsStore:
+    """
+    SARシーンの画素ごとの時系列統計（dB）をディスク上に保持するストア
+
+    画素ごとの件数・平均・偏差平方和（Welfordの方法）・最小・最大を.npyのメモリマップで持ち、
+    新しいシーンを追加するときはそのシーンだけをブロックごとに読み込んで更新する（O(画素数)）。
+    過去のシーンは読み直さない。追加済みのシーンはmanifest.jsonに記録し、二重に追加しない。
+    """
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, aoi=SADO_AOI, speckle=None):
+        """
+        Args:
+            store_dir: ストアのディレクトリ
+            aoi: 統計をとる範囲（AOI）。Noneの場合はシーン全体
+            speckle: 読み込み時にかけるスペックルフィルタ（SpeckleFilter）
+        """
+        self.store_dir = Path(store_dir)
+        self.aoi = aoi
+        self.speckle = speckle
+        self.manifest = self._load_manifest()
+        pending = [entry['name'] for entry in self.manifest['scenes'] if entry['status'] != 'ok']
+        if pending:
+            raise ValueError(f"追加が完了していないシーンがあります（{', '.join(pending)}）。"
+                             f"ストア '{self.store_dir}' を削除して作り直してください")
+
+    def _load_manifest(self):
+        path = self.store_dir / MANIFEST_NAME
+        if not path.exists():
+            return {'grid': None, 'scenes': []}
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _save_manifest(self):
+        """マニフェストを保存（一時ファイルからの置き換え）"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        path = self.store_dir / MANIFEST_NAME
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @property
+    def scene_names(self):
+        return [entry['name'] for entry in self.manifest['scenes']]
+
+    @property
+    def shape(self):
+        grid = self.manifest['grid']
+        return None if grid is None else tuple(grid['shape'])
+
+    @property
+    def profile(self):
+        """ストアのグリッドのGeoTIFFのプロファイル（1バンド・float32）"""
+        grid = self.manifest['grid']
+        return {
+            'driver': 'GTiff',
+            'count': 1,
+            'dtype': 'float32',
+            'nodata': np.nan,
+            'crs': rasterio.crs.CRS.from_wkt(grid['crs']),
+            'transform': rasterio.Affine(*grid['transform']),
+            'height': grid['shape'][0],
+            'width': grid['shape'][1],
+            'tiled': True,
+            'blockxsize': 256,
+            'blockysize': 256,
+            'compress': 'deflate'
+        }
+
+    def layer(self, name, mode='r'):
+        """累積値のメモリマップ（count・mean・m2・min・max）"""
+        return np.load(self.store_dir / f"{name}.npy", mmap_mode=mode)
+
+    def _create_layers(self, crs, transform, shape):
+        """グリッドを記録し、累積値のファイルを初期値で作成"""
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        initial = {'count': 0, 'mean': 0, 'm2': 0, 'min': np.inf, 'max': -np.inf}
+        for name, dtype in STATS_LAYERS.items():
+            layer = np.lib.format.open_memmap(self.store_dir / f"{name}.npy", mode='w+', dtype=dtype, shape=shape)
+            layer[...] = initial[name]
+            layer.flush()
+            del layer
+        self.manifest['grid'] = {
+            'crs': rasterio.crs.CRS.from_user_input(crs).to_wkt(),
+            'transform': list(transform)[:6],
+            'shape': list(shape)
+        }
+        self._save_manifest()
+
+    def _scene_window(self, src):
+        """シーンの読み込み範囲（ストアのグリッドと一致しない場合はValueError）"""
+        window = Window(0, 0, src.width, src.height) if self.aoi is None else self.aoi.window_for(src)
+        if window is None:
+            raise ValueError(f"{src.name} は解析範囲と重なりません")
+        shape = (int(window.height), int(window.width))
+        transform = src.window_transform(window)
+        grid = self.manifest['grid']
+        if grid is None:
+            self._create_layers(src.crs, transform, shape)
+        elif grid_key(src.crs, transform, shape) != grid_key(grid['crs'], grid['transform'], grid['shape']):
+            raise ValueError(f"{src.name} のグリッドがストアのグリッドと一致しません")
+        return window
+
+    def _iter_blocks(self, src, window):
+        """(ストア上のスライス, dBのブロック) を順に返す"""
+        for block_window in sar_block_windows(src, window):
+            row = int(block_window.row_off - window.row_off)
+            col = int(block_window.col_off - window.col_off)
+            block = read_sar_block(src, block_window, speckle=self.speckle)
+            yield (slice(row, row + block.shape[0]), slice(col, col + block.shape[1])), block
+
+    def add_scene(self, tiff_path, name=None):
+        """
+        シーンを統計に追加（Welfordの方法でブロックごとに更新）
+
+        Args:
+            tiff_path: SARデータ（線形の後方散乱係数）のTIFFのパス
+            name: シーン名（Noneの場合はパスから決める）
+
+        Returns:
+            追加した場合はTrue、追加済みの場合はFalse
+        """
+        name = name or scene_name(tiff_path)
+        if name in self.scene_names:
+            return False
+
+        with rasterio.open(tiff_path) as src:
+            window = self._scene_window(src)
+            # 更新中に中断した場合に検出できるよう、先に追加中として記録する
+            entry = {'name': name, 'path': str(tiff_path), 'status': 'adding'}
+            self.manifest['scenes'].append(entry)
+            self._save_manifest()
+
+            layers = {layer_name: self.layer(layer_name, 'r+') for layer_name in STATS_LAYERS}
+            valid_pixels = 0
+            for index, block in self._iter_blocks(src, window):
+                valid = ~np.isnan(block)
+                if not valid.any():
+                    continue
+                values = block[valid].astype(np.float64)
+                count = layers['count'][index][valid].astype(np.float64) + 1
+                mean = layers['mean'][index][valid]
+                delta = values - mean
+                mean += delta / count
+                layers['m2'][index][valid] += delta * (values - mean)
+                layers['mean'][index][valid] = mean
+                layers['count'][index][valid] = count
+                layers['min'][index][valid] = np.minimum(layers['min'][index][valid], block[valid])
+                layers['max'][index][valid] = np.maximum(layers['max'][index][valid], block[valid])
+                valid_pixels += int(values.size)
+            for layer in layers.values():
+                layer.flush()
+
+        entry.update(status='ok', valid_pixels=valid_pixels,
+                     added_at=datetime.now(timezone.utc).isoformat(timespec='seconds'))
+        self._save_manifest()
+        return True
+
+    def add_scenes(self, tiff_paths, names=None):
+        """
+        複数のシーンを順に追加（追加済みのシーンは読み込まない）
+
+        読み込めないシーンは飛ばす。統計の更新中に失敗した場合はストアが不完全になるため、
+        そこで処理を中止して例外を送出する。
+
+        Returns:
+            追加したシーン名のリスト
+        """
+        names = names or [None] * len(tiff_paths)
+        added = []
+        for tiff_path, name in zip(tiff_paths, names):
+            name = name or scene_name(tiff_path)
+            try:
+                if self.add_scene(tiff_path, name):
+                    print(f"{name} を統計に追加しました")
+                    added.append(name)
+            except Exception as e:
+                if any(entry['status'] != 'ok' for entry in self.manifest['scenes']):
+                    raise
+                print(f"{name} を追加できませんでした。エラー: {e}")
+        return added
+
+    def std(self, rows=slice(None), cols=slice(None), ddof=1):
+        """画素ごとの標準偏差（dB、件数がddof以下の画素はNaN）"""
+        count = self.layer('count')[rows, cols].astype(np.float64)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            std = np.sqrt(self.layer('m2')[rows, cols] / (count - ddof))
+        std[count <= ddof] = np.nan
+        return std.astype(np.float32)
+
+    def zscore_block(self, block, index, min_count=DEFAULT_MIN_COUNT):
+        """
+        ブロックの平年値からの偏差（zスコア）
+
+        件数がmin_count未満の画素と、標準偏差が0の画素はNaN。
+        """
+        rows, cols = index
+        count = self.layer('count')[rows, cols]
+        mean = self.layer('mean')[rows, cols]
+        std = self.std(rows, cols)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            zscore = ((block - mean) / std).astype(np.float32)
+        zscore[(count < min_count) | ~(std > 0)] = np.nan
+        return zscore
+
+    def write_zscore(self, tiff_path, output_path, min_count=DEFAULT_MIN_COUNT):
+        """
+        シーンのzスコアの地図をGeoTIFF（タイル構成・deflate圧縮）で保存
+
+        統計は更新しない。追加済みのシーンの場合、その値自体も平年値に含まれる。
+
+        Args:
+            tiff_path: SARデータのTIFFのパス
+            output_path: 保存先
+            min_count: zスコアを求めるのに必要なシーン数
+        """
+        if self.manifest['grid'] is None:
+            raise ValueError("ストアにシーンが追加されていません")
+        os.makedirs(os.path.dirname(str(output_path)) or '.', exist_ok=True)
+        with rasterio.open(tiff_path) as src, rasterio.open(output_path, 'w', **self.profile) as dst:
+            window = self._scene_window(src)
+            for (rows, cols), block in self._iter_blocks(src, window):
+                zscore = self.zscore_block(block, (rows, cols), min_count)
+                dst.write(zscore, 1, window=Window(cols.start, rows.start, block.shape[1], block.shape[0]))
+        return output_path
+
+    def write_summary(self, output_dir):
+        """
+        平均・標準偏差・最小・最大・件数をGeoTIFFで保存
+
+        Returns:
+            {統計名: パス}
+        """
+        if self.manifest['grid'] is None:
+            raise ValueError("ストアにシーンが追加されていません")
+        os.makedirs(output_dir, exist_ok=True)
+        count = self.layer('count')
+        empty = count == 0
+        layers = {
+            'mean': np.where(empty, np.nan, self.layer('mean')),
+            'std': self.std(),
+            'min': np.where(empty, np.nan, self.layer('min')),
+            'max': np.where(empty, np.nan, self.layer('max')),
+            'count': count
+        }
+        paths = {}
+        for name, data in layers.items():
+            path = os.path.join(output_dir, f"temporal_{name}.tif")
+            with rasterio.open(path, 'w', **self.profile) as dst:
+                dst.write(np.asarray(data, dtype=np.float32), 1)
+            paths[name] = path
+        return paths
+
+
+def main():
+    """
+    sar_dataディレクトリのシーンを時系列統計に追加し、指定したシーンのzスコアを出力する
+    """
+    parser = argparse.ArgumentParser(description='SARデータの画素ごとの時系列統計')
+    parser.add_argument('--input-dir', default='sar_data', help='SARデータのディレクトリ')
+    parser.add_argument('--store', default=DEFAULT_STORE_DIR, help='統計のストアのディレクトリ')
+    aoi_group = parser.add_mutually_exclusive_group()
+    aoi_group.add_argument('--aoi', help='解析範囲のポリゴンのベクタファイル（GeoJSON・Shapefileなど）')
+    aoi_group.add_argument('--bbox', nargs=4, type=float, metavar=('MIN_LON', 'MIN_LAT', 'MAX_LON', 'MAX_LAT'),
+                           help='解析範囲のbbox（デフォルトは佐渡島）')
+    parser.add_argument('--zscore', nargs='+', default=[], help='zスコアの地図を出力するシーンのTIFF')
+    parser.add_argument('--min-count', type=int, default=DEFAULT_MIN_COUNT, help='zスコアに必要なシーン数')
+    parser.add_argument('--summary', action='store_true', help='平均・標準偏差などのGeoTIFFを出力する')
+    parser.add_argument('--output-dir', default='analysis_results', help='出力ディレクトリ')
+    args = parser.parse_args()
+
+    if args.aoi:
+        aoi = AOI.from_file(args.aoi)
+    elif args.bbox:
+        aoi = AOI.from_bbox(args.bbox)
+    else:
+        aoi = SADO_AOI
+
+    input_dir = Path(args.input_dir)
+    tiff_files = sorted(input_dir.rglob('*.tiff')) if input_dir.exists() else []
+    store = TemporalStatsStore(args.store, aoi)
+    added = store.add_scenes(tiff_files)
+    print(f"{len(added)}シーンを追加しました（合計 {len(store.scene_names)}シーン）")
+
+    for tiff_path in args.zscore:
+        output_path = Path(args.output_dir) / f"{scene_name(tiff_path)}_zscore.tif"
+        store.write_zscore(tiff_path, output_path, args.min_count)
+        print(f"zスコアの地図を保存しました: {output_path}")
+    if args.summary:
+        for path in store.write_summary(args.output_dir).values():
+            print(f"統計を保存しました: {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@ import matplotlib.pyplot as plt
 from sentinelhub import SHConfig
 from sentinelhub import CRS, BBox, bbox_to_dimensions
 from sentinelhub import MimeType, SentinelHubRequest, SentinelHubDownloadClient, DataCollection, DownloadRequest
+from request_cache import RequestCache, get_data
 
 config = SHConfig()
 config.sh_client_id = "bc6ce102-f635-4d82-9890-e8bd7ea69873"
@@ -61,7 +62,7 @@ request_true_color = SentinelHubRequest(
     config=config
 )
 
-rue_color_imgs = request_true_color.get_data()
+rue_color_imgs = get_data(request_true_color, RequestCache())
 
 plt.imshow(rue_color_imgs[0]*3.5/255)
 plt.axis(False)
@@ -0,0 +1,89 @@
+import pytest
+from sentinelhub import BBox, CRS, SHConfig
+
+import get_sentinel_1_sardata
+from acquisition_planner import plan_acquisitions
+
+BBOX = BBox((138.17, 37.81, 138.61, 38.34), crs=CRS.WGS84)
+
+
+def item(item_id, datetime, platform='sentinel-1a', orbit_state='ascending', absolute_orbit=46000):
+    return {'id': item_id, 'properties': {
+        'datetime': datetime,
+        'platform': platform,
+        'sat:orbit_state': orbit_state,
+        'sat:absolute_orbit': absolute_orbit
+    }}
+
+
+def test_slices_of_one_pass_are_grouped():
+    items = [
+        item('a1', '2023-01-05T08:30:15Z'),
+        item('a2', '2023-01-05T08:30:40Z'),
+        item('d1', '2023-01-05T20:40:00Z', orbit_state='descending', absolute_orbit=46007)
+    ]
+
+    acquisitions = plan_acquisitions(items)
+
+    assert [acquisition['item_ids'] for acquisition in acquisitions] == [['a1', 'a2'], ['d1']]
+    start, end = acquisitions[0]['time_interval']
+    assert start.isoformat() == '2023-01-05T08:30:14+00:00'
+    assert end.isoformat() == '2023-01-05T08:30:41+00:00'
+    assert all(not acquisition['conflicting_item_ids'] for acquisition in acquisitions)
+
+
+def test_other_items_inside_the_time_window_are_reported():
+    items = [
+        item('a1', '2023-01-17T08:30:15Z'),
+        item('a2', '2023-01-17T08:30:41Z'),
+        item('b1', '2023-01-17T08:30:20Z', platform='sentinel-1b', absolute_orbit=35000)
+    ]
+
+    acquisitions = {acquisition['item_ids'][0]: acquisition for acquisition in plan_acquisitions(items)}
+
+    assert acquisitions['a1']['conflicting_item_ids'] == ['b1']
+    assert acquisitions['b1']['conflicting_item_ids'] == []
+
+
+class StubCatalog:
+    """get_featureでアイテムを返すだけのSentinelHubCatalogの代わり"""
+
+    def __init__(self, items):
+        self.items = {entry['id']: entry for entry in items}
+
+    def get_feature(self, collection, feature_id):
+        return self.items[feature_id]
+
+
+def stub_catalog(monkeypatch, items):
+    monkeypatch.setattr(get_sentinel_1_sardata, 'SentinelHubCatalog', lambda config: StubCatalog(items))
+    monkeypatch.setattr(get_sentinel_1_sardata, 'get_sentinel_1_metadata', lambda *args: list(items))
+    downloads = []
+    monkeypatch.setattr(get_sentinel_1_sardata, 'download_sar',
+                        lambda sh_config, bbox, output_dir, input_data, *args, **kwargs: downloads.append(input_data))
+    return downloads
+
+
+def test_get_sar_data_by_id_uses_the_acquisition_window(monkeypatch):
+    downloads = stub_catalog(monkeypatch, [
+        item('a1', '2023-01-05T08:30:15Z'),
+        item('a2', '2023-01-05T08:30:40Z'),
+        item('d1', '2023-01-05T08:31:30Z', orbit_state='descending', absolute_orbit=46001)
+    ])
+
+    get_sentinel_1_sardata.get_sar_data_by_id(SHConfig(), 'a2', BBOX, 'sar_data')
+
+    data_filter = downloads[0]['dataFilter']
+    assert data_filter['timeRange'] == {'from': '2023-01-05T08:30:14Z', 'to': '2023-01-05T08:30:41Z'}
+    assert data_filter['orbitDirection'] == 'ASCENDING'
+
+
+def test_get_sar_data_by_id_rejects_conflicting_items(monkeypatch):
+    downloads = stub_catalog(monkeypatch, [
+        item('a1', '2023-01-05T08:30:15Z'),
+        item('b1', '2023-01-05T08:30:15Z', platform='sentinel-1b', absolute_orbit=24000)
+    ])
+
+    with pytest.raises(ValueError):
+        get_sentinel_1_sardata.get_sar_data_by_id(SHConfig(), 'a1', BBOX, 'sar_data')
+    assert downloads == []
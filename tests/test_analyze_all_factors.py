@@ -0,0 +1,41 @@
+import pandas as pd
+
+from analyze_all_factors import analyze_all_factors, build_factor_frame
+
+
+def make_metadata():
+    return pd.DataFrame({
+        'datetime': pd.to_datetime(['2023-01-05 01:00', '2023-01-05 01:00', '2023-02-10 01:00']),
+        'tile_id': ['T1', 'T2', 'T1'],
+        'platform': ['sentinel-2a', 'sentinel-2a', 'sentinel-2b'],
+        'cloud_cover': [5.0, 12.0, 30.0],
+        'min_lat': [37.8, 37.9, 37.8],
+        'max_lat': [38.0, 38.1, 38.0],
+        'min_lon': [138.2, 138.3, 138.2],
+        'max_lon': [138.4, 138.5, 138.4]
+    })
+
+
+def test_empty_results_keep_index_and_stats_columns():
+    frame = build_factor_frame(make_metadata(), {})
+
+    assert frame.empty
+    assert list(frame.index.names) == ['date', 'tile_id']
+    assert {'mean', 'brightness_range'} <= set(frame.columns)
+
+    results = analyze_all_factors(frame)
+    assert all(result.empty for result in results.values())
+
+
+def test_failed_images_are_dropped():
+    results = {
+        'satellite_images/satellite_2023-01-05.png': {'mean': 100.0, 'brightness_range': 50.0},
+        'satellite_images/satellite_2023-02-10.png': None
+    }
+
+    frame = build_factor_frame(make_metadata(), results)
+
+    assert list(frame.index) == [('2023-01-05', 'T1'), ('2023-01-05', 'T2')]
+    analysis = analyze_all_factors(frame)
+    assert len(analysis['time_series']) == 1
+    assert analysis['seasonal'].loc[1, 'count'] == 1
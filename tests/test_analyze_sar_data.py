@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from shapely.geometry import Polygon
+
+from analyze_sar_data import SARScene, process_sar_tiff, process_scene_blocked
+from aoi import AOI
+from dem_cache import DEMResampler
+from polarimetry import dual_pol_products
+from speckle import SpeckleFilter
+
+HEIGHT, WIDTH = 200, 180
+CRS = 'EPSG:32654'
+TRANSFORM = from_origin(500000, 4200000, 10, 10)
+# ラスタの内側のAOI（ラスタと同じ座標系のbbox、列40-120・行50-150）
+INNER_AOI = AOI.from_bbox((500400, 4198500, 501200, 4199500), crs=CRS)
+# 範囲外の画素のマスクが必要なポリゴンのAOI
+TRIANGLE_AOI = AOI(Polygon([(500200, 4198300), (501600, 4198500), (500600, 4199800)]), crs=CRS)
+# 数ブロックに分かれる小さなブロック
+TARGET_PIXELS = 2000
+
+
+@pytest.fixture(scope='module')
+def sar_tiff(tmp_path_factory):
+    """VV・VH・dataMaskの線形の後方散乱係数の合成データ（欠損を含む）"""
+    rng = np.random.default_rng(0)
+    data = rng.gamma(4.4, 0.05 / 4.4, (3, HEIGHT, WIDTH)).astype(np.float32)
+    data[:2, rng.random((HEIGHT, WIDTH)) < 0.02] = 0
+    data[2] = 1
+    data[2, :10] = 0
+    path = tmp_path_factory.mktemp('sar') / 'response.tiff'
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=3, dtype='float32',
+                       crs=CRS, transform=TRANSFORM) as dst:
+        dst.write(data)
+    return path
+
+
+def aoi_slices(tiff_path, aoi):
+    with rasterio.open(tiff_path) as src:
+        return aoi.window_for(src).toslices()
+
+
+@pytest.mark.parametrize('method', ['boxcar', 'lee', 'refined_lee'])
+def test_aoi_speckle_matches_full_scene(sar_tiff, method):
+    speckle = SpeckleFilter(method, size=7)
+    full, _ = process_sar_tiff(sar_tiff, speckle=speckle)
+    windowed, meta = process_sar_tiff(sar_tiff, aoi=INNER_AOI, speckle=speckle)
+
+    expected = full[aoi_slices(sar_tiff, INNER_AOI)]
+    assert windowed.shape == expected.shape == (meta['height'], meta['width'])
+    np.testing.assert_array_equal(np.isnan(windowed), np.isnan(expected))
+    np.testing.assert_allclose(windowed, expected, rtol=1e-5, atol=1e-5)
+
+
+def test_aoi_polarimetric_speckle_matches_full_scene(sar_tiff):
+    speckle = SpeckleFilter('lee', size=7)
+    scene = SARScene(sar_tiff, 'test', aoi=INNER_AOI, speckle=speckle)
+    with rasterio.open(sar_tiff) as src:
+        vv, vh, data_mask = src.read()
+    rows, cols = aoi_slices(sar_tiff, INNER_AOI)
+    expected = dual_pol_products(speckle(vv)[rows, cols], speckle(vh)[rows, cols], data_mask[rows, cols])
+
+    np.testing.assert_array_equal(np.isnan(scene.polarimetric), np.isnan(expected))
+    np.testing.assert_allclose(scene.polarimetric, expected, rtol=1e-5, atol=1e-5)
+
+
+@pytest.fixture(scope='module')
+def dem_path(tmp_path_factory):
+    """SARデータと同じグリッドの標高（範囲外の標高を含む）"""
+    rng = np.random.default_rng(1)
+    dem = rng.uniform(-50, 2500, (HEIGHT, WIDTH)).astype(np.float32)
+    path = tmp_path_factory.mktemp('dem') / 'dem.tif'
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                       crs=CRS, transform=TRANSFORM) as dst:
+        dst.write(dem, 1)
+    return path
+
+
+def assert_stats_match(summary, values):
+    valid = values[~np.isnan(values)].astype(np.float64)
+    assert summary['count'] == valid.size
+    np.testing.assert_allclose([summary['min'], summary['max'], summary['mean'], summary['std']],
+                               [valid.min(), valid.max(), valid.mean(), valid.std()], rtol=1e-5)
+
+
+def test_blocked_stats_match_whole_array(sar_tiff, tmp_path):
+    speckle = SpeckleFilter('lee', size=7)
+    scene = SARScene(sar_tiff, 'test', aoi=TRIANGLE_AOI, speckle=speckle)
+    stats = process_scene_blocked(sar_tiff, 'test', tmp_path, TRIANGLE_AOI, speckle=speckle,
+                                  target_pixels=TARGET_PIXELS)
+
+    assert_stats_match(stats['raw'], scene.vv_db)
+    assert 'corrected' not in stats
+
+
+def test_blocked_outputs_match_whole_array(sar_tiff, dem_path, tmp_path):
+    speckle = SpeckleFilter('lee', size=7)
+    dem_resampler = DEMResampler(dem_path, cache_dir=str(tmp_path / 'dem_cache'))
+    scene = SARScene(sar_tiff, 'test', dem_resampler, aoi=TRIANGLE_AOI, speckle=speckle)
+    stats = process_scene_blocked(sar_tiff, 'test', tmp_path, TRIANGLE_AOI, dem_resampler, speckle,
+                                  target_pixels=TARGET_PIXELS)
+
+    with rasterio.open(tmp_path / 'test_corrected.tif') as src:
+        corrected = src.read(1)
+        assert src.transform == scene.meta['transform']
+    with rasterio.open(tmp_path / 'test_moisture.tif') as src:
+        moisture_map = src.read(1)
+
+    np.testing.assert_array_equal(np.isnan(corrected), np.isnan(scene.corrected_vv))
+    np.testing.assert_allclose(corrected, scene.corrected_vv, rtol=1e-5, atol=1e-5)
+    np.testing.assert_array_equal(moisture_map, scene.moisture[0])
+    assert_stats_match(stats['raw'], scene.vv_db)
+    assert_stats_match(stats['corrected'], scene.corrected_vv)
@@ -0,0 +1,33 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import transform_bounds
+
+from analyze_sar_data import SARScene
+from aoi import AOI
+
+CRS = 'EPSG:32654'
+# 中央子午線から離れた位置（子午線収差で経度緯度のbboxがUTMの軸に平行にならない）
+TRANSFORM = from_origin(300000, 4200000, 10, 10)
+HEIGHT, WIDTH = 150, 150
+# ラスタの内側の範囲を経度緯度のbboxにしたAOI
+WGS84_AOI = AOI.from_bbox(transform_bounds(CRS, 'EPSG:4326', 300300, 4198800, 301200, 4199700))
+
+
+def test_needs_mask():
+    assert not WGS84_AOI.needs_mask(None)
+    assert not WGS84_AOI.needs_mask('EPSG:4326')
+    assert WGS84_AOI.needs_mask(CRS)
+
+
+def test_wgs84_box_on_utm_raster_masks_window_corners(tmp_path):
+    path = tmp_path / 'response.tiff'
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                       crs=CRS, transform=TRANSFORM) as dst:
+        dst.write(np.full((1, HEIGHT, WIDTH), 0.05, dtype=np.float32))
+
+    scene = SARScene(path, 'test', aoi=WGS84_AOI)
+    mask = WGS84_AOI.mask(scene.meta['transform'], scene.vv_db.shape, CRS)
+
+    assert 0 < mask.sum() < mask.size
+    np.testing.assert_array_equal(np.isnan(scene.vv_db), ~mask)
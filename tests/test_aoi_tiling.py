@@ -0,0 +1,30 @@
+from sentinelhub import BBox, CRS
+
+from aoi_tiling import MAX_REQUEST_PIXELS, plan_tiles
+
+# 10m解像度で 4620x5466 画素（分割が必要）
+LARGE_BBOX = BBox((139.0, 35.5, 139.5, 36.0), crs=CRS.WGS84)
+
+
+def tile_layout(plan):
+    return [(tile['size'], tile['window']) for tile in plan.tiles]
+
+
+def test_plan_tiles_accepts_float_resolution():
+    plan = plan_tiles(LARGE_BBOX, 10.0)
+    reference = plan_tiles(LARGE_BBOX, 10)
+
+    assert plan.needs_tiling
+    assert (plan.width, plan.height) == (reference.width, reference.height)
+    assert tile_layout(plan) == tile_layout(reference)
+    assert all(max(tile['size']) <= MAX_REQUEST_PIXELS for tile in plan.tiles)
+
+
+def test_plan_tiles_covers_aoi_without_overlap():
+    plan = plan_tiles(LARGE_BBOX, 10)
+    covered = sum(width * height for width, height in (tile['size'] for tile in plan.tiles))
+    assert covered == plan.width * plan.height
+    for tile in plan.tiles:
+        window = tile['window']
+        assert 0 <= window.col_off and window.col_off + window.width <= plan.width
+        assert 0 <= window.row_off and window.row_off + window.height <= plan.height
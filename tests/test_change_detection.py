@@ -0,0 +1,47 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+import change_detection
+from change_detection import detect_changes
+
+HEIGHT, WIDTH = 64, 48
+SCENES = 6
+
+
+def write_scenes(directory):
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(SCENES):
+        path = directory / f'scene{i}' / 'response.tiff'
+        path.parent.mkdir()
+        with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                           crs='EPSG:32654', transform=from_origin(500000, 4200000, 10, 10)) as dst:
+            dst.write(rng.gamma(4.4, 0.05 / 4.4, (1, HEIGHT, WIDTH)).astype(np.float32))
+        paths.append(path)
+    return paths
+
+
+def test_all_pairs_in_batches_bound_open_files(tmp_path, monkeypatch):
+    paths = write_scenes(tmp_path)
+    opened = []
+    peak = [0]
+    open_dataset = rasterio.open
+
+    def tracking_open(*args, **kwargs):
+        dataset = open_dataset(*args, **kwargs)
+        opened.append(dataset)
+        peak[0] = max(peak[0], sum(not d.closed for d in opened))
+        return dataset
+
+    monkeypatch.setattr(change_detection.rasterio, 'open', tracking_open)
+    results = detect_changes(paths, tmp_path / 'changes', pairs='all', max_open_outputs=2, target_pixels=512)
+
+    # 6シーンの全ての組（15組）でも、同時に開くのは1バッチ分（出力2 + シーン4）まで
+    assert len(results) == SCENES * (SCENES - 1) // 2
+    assert peak[0] <= 3 * 2
+
+    scenes = [open_dataset(path).read(1) for path in paths]
+    for result, (before, after) in zip(results, change_detection.scene_pairs(SCENES, 'all')):
+        with open_dataset(result['path']) as src:
+            np.testing.assert_allclose(src.read(1), np.log(scenes[after]) - np.log(scenes[before]), rtol=1e-5, atol=1e-6)
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+from rasterio.io import MemoryFile
+from sentinelhub import BBox, CRS, DataCollection, SHConfig, SentinelHubRequest
+
+from aoi_tiling import plan_tiles
+from get_sentinel_1_sardata import download_sar
+
+# 10m解像度で分割が必要な範囲
+BBOX = BBox((139.0, 35.5, 139.5, 36.0), crs=CRS.WGS84)
+
+
+def tiff_content(width, height):
+    with MemoryFile() as memfile:
+        with memfile.open(driver='GTiff', width=width, height=height, count=3, dtype='float32') as dst:
+            dst.write(np.full((3, height, width), 0.05, dtype=np.float32))
+        return memfile.read()
+
+
+class StubDownloader:
+    """failedのタイルだけエラーを返すSceneDownloaderの代わり"""
+
+    def __init__(self, failed=()):
+        self.failed = set(failed)
+
+    def download(self, requests):
+        for index, request in enumerate(requests):
+            if index in self.failed:
+                yield index, None, RuntimeError('タイルの取得に失敗')
+                continue
+            output = request.post_values['output']
+            yield index, tiff_content(output['width'], output['height']), None
+
+
+def run_download(tmp_path, failed=()):
+    input_data = SentinelHubRequest.input_data(data_collection=DataCollection.SENTINEL1_IW,
+                                               time_interval=('2024-01-01', '2024-01-02'))
+    return download_sar(SHConfig(), BBOX, str(tmp_path), input_data, downloader=StubDownloader(failed))
+
+
+def test_download_sar_writes_mosaic(tmp_path):
+    assert len(plan_tiles(BBOX, 10).tiles) > 1
+    path = run_download(tmp_path)
+    assert path is not None and os.path.exists(path)
+
+
+def test_download_sar_returns_none_when_tiles_fail(tmp_path):
+    assert run_download(tmp_path, failed={0}) is None
+    assert not any(name.endswith('.tiff') for _, _, files in os.walk(tmp_path) for name in files)
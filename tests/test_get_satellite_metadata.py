@@ -0,0 +1,78 @@
+import os
+import sys
+
+import numpy as np
+import sentinelhub.api.catalog
+from sentinelhub import BBox, CRS, SHConfig
+
+import get_satellite_metadata
+from get_satellite_metadata import save_metadata
+
+# main() のAOI（138.4147, 38.0410 の周囲0.01度）と重なる範囲
+ITEM_BBOX = [138.3, 37.9, 138.5, 38.1]
+
+
+def metadata(date, tile_id):
+    return {
+        'datetime': f'{date}T01:30:00Z',
+        'cloud_cover': 10.0,
+        'tile_id': tile_id,
+        'platform': 'sentinel-2a',
+        'bbox': ITEM_BBOX,
+        'resolution': 10
+    }
+
+
+def test_incremental_retries_previously_failed_images(tmp_path, monkeypatch):
+    # 2件とも保存済みのメタデータだが、画像は1件目だけ取得できている
+    save_metadata([metadata('2024-05-01', 'tile-a'), metadata('2024-05-11', 'tile-b')], str(tmp_path))
+    images_dir = tmp_path / 'satellite_images'
+    images_dir.mkdir()
+    (images_dir / 'satellite_2024-05-01.png').touch()
+
+    downloaded = []
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(sys, 'argv', ['get_satellite_metadata.py', '--incremental'])
+    # カタログの差分検索では新規のメタデータなし
+    monkeypatch.setattr(get_satellite_metadata, 'get_satellite_metadata', lambda *args: [])
+    monkeypatch.setattr(get_satellite_metadata, 'download_satellite_images',
+                        lambda sh_config, plan, *args, **kwargs: downloaded.extend(plan))
+
+    get_satellite_metadata.main()
+
+    assert [entry['datetime'][:10] for entry in downloaded] == ['2024-05-11']
+    assert os.path.exists(tmp_path / 'satellite_metadata.parquet')
+
+
+def test_sync_metadata_searches_from_latest_stored_datetime(tmp_path, monkeypatch):
+    save_metadata([metadata('2025-06-25', 'tile-a')], str(tmp_path))
+    payloads = []
+
+    class StubSearchIterator:
+        """カタログへの問い合わせをせずに検索条件だけを記録する"""
+
+        def __init__(self, client, url, payload):
+            payloads.append(payload)
+
+        def __iter__(self):
+            return iter([])
+
+    # SentinelHubCatalog.search（parse_time_interval・serialize_timeを含む）はそのまま使う
+    monkeypatch.setattr(sentinelhub.api.catalog, 'CatalogSearchIterator', StubSearchIterator)
+    bbox = BBox(ITEM_BBOX, crs=CRS.WGS84)
+
+    assert get_satellite_metadata.sync_metadata(SHConfig(), bbox, str(tmp_path)) == []
+    start, end = payloads[0]['datetime'].split('/')
+    assert start == '2025-06-25T01:30:00Z'
+    assert end > start
+
+
+def test_skipped_dates_are_not_downloaded_again(tmp_path):
+    images_dir = str(tmp_path)
+    dark = np.zeros((8, 8, 3), dtype=np.uint8)
+    assert get_satellite_metadata.save_satellite_image(dark, metadata('2024-05-01', 'tile-a'), images_dir) is None
+
+    plan = [metadata('2024-05-01', 'tile-a'), metadata('2024-05-11', 'tile-b')]
+    missing = get_satellite_metadata.filter_missing_images(plan, images_dir)
+    assert [entry['datetime'][:10] for entry in missing] == ['2024-05-11']
+    assert get_satellite_metadata.load_skipped_dates(images_dir) == {'2024-05-01': 'dark'}
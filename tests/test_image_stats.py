@@ -0,0 +1,28 @@
+import numpy as np
+
+from image_stats import compute_histograms, compute_image_stats
+
+
+def test_histograms_match_numpy_across_chunks():
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 256, (2, 37, 41, 3), dtype=np.uint8)
+
+    # チャンクの境界が画像の途中に入る大きさで数える
+    hist = compute_histograms(images, chunk_pixels=100)
+
+    for i in range(images.shape[0]):
+        for c in range(images.shape[-1]):
+            expected, _ = np.histogram(images[i, ..., c], bins=256, range=(0, 256))
+            np.testing.assert_array_equal(hist[i, c], expected)
+
+
+def test_image_stats_match_numpy():
+    rng = np.random.default_rng(1)
+    img = rng.integers(20, 240, (50, 60, 3), dtype=np.uint8)
+    stats = compute_image_stats(img)
+
+    assert stats['min'] == img.min() and stats['max'] == img.max()
+    np.testing.assert_allclose([stats['mean'], stats['std']], [img.mean(), img.std()])
+    np.testing.assert_allclose([stats['r_mean'], stats['g_mean'], stats['b_mean']], img.mean(axis=(0, 1)))
+    assert stats['high_brightness_ratio'] == np.mean(img > 200)
+    assert stats['low_brightness_ratio'] == np.mean(img < 50)
@@ -0,0 +1,68 @@
+import threading
+from pathlib import Path
+
+from request_cache import RequestCache
+
+
+def assert_consistent(cache):
+    assert cache.total_bytes == sum(cache.entries.values())
+    for key in cache.entries:
+        assert cache._path(key).exists()
+
+
+def test_get_survives_eviction_after_read(tmp_path, monkeypatch):
+    cache = RequestCache(tmp_path, max_bytes=1024)
+    cache.put('aa' * 32, b'x' * 100)
+    cache.put('bb' * 32, b'y' * 100)
+    original_read_bytes = Path.read_bytes
+
+    def read_then_evict(path):
+        content = original_read_bytes(path)
+        # 読み込みの直後に他のスレッドのput()がこのエントリを削除した状況
+        if path.name == 'aa' * 32:
+            with cache.lock:
+                cache.total_bytes -= cache.entries.pop(path.name)
+                path.unlink()
+        return content
+
+    monkeypatch.setattr(Path, 'read_bytes', read_then_evict)
+
+    assert cache.get('aa' * 32) == b'x' * 100
+    assert 'aa' * 32 not in cache.entries
+    assert_consistent(cache)
+
+
+def test_get_of_evicted_entry_is_a_miss(tmp_path):
+    cache = RequestCache(tmp_path, max_bytes=1024)
+    cache.put('aa' * 32, b'x' * 100)
+    cache._path('aa' * 32).unlink()
+
+    assert cache.get('aa' * 32) is None
+    assert cache.misses == 1
+    assert_consistent(cache)
+
+
+def test_concurrent_get_and_put_keep_accounting(tmp_path):
+    cache = RequestCache(tmp_path, max_bytes=2000)
+    keys = [f'{i:064x}' for i in range(40)]
+    errors = []
+
+    def worker(offset):
+        try:
+            for round_ in range(20):
+                for index in range(offset, len(keys), 4):
+                    key = keys[(index + round_) % len(keys)]
+                    if cache.get(key) is None:
+                        cache.put(key, b'z' * 100)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(offset,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert cache.total_bytes <= cache.max_bytes
+    assert_consistent(cache)
@@ -0,0 +1,111 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.io import MemoryFile
+from sentinelhub import SHConfig
+
+from aoi_tiling import MAX_REQUEST_PIXELS
+from sar_data_processor import SARDataProcessor
+from scene_downloader import SceneDownloader
+
+TOKEN = 'test-token'
+# main() と同じ範囲（10m解像度で 4620x5466 画素、分割が必要）
+MAIN_BBOX = (139.0, 35.5, 139.5, 36.0)
+
+
+class StubSession:
+    """認証トークンを返すだけのSentinelHubSessionの代わり"""
+
+    @property
+    def session_headers(self):
+        return {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture
+def stub_server():
+    """Process APIのスタブ（リクエストを記録し、要求された大きさのTIFFを返す）"""
+    received = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+            received.append({'authorization': self.headers.get('Authorization'), 'body': body})
+            if self.headers.get('Authorization') != f'Bearer {TOKEN}':
+                self.send_response(401)
+                self.end_headers()
+                return
+            width, height = body['output']['width'], body['output']['height']
+            with MemoryFile() as memfile:
+                with memfile.open(driver='GTiff', width=width, height=height, count=1, dtype='float32') as dst:
+                    dst.write(np.full((1, height, width), 0.05, dtype=np.float32))
+                content = memfile.read()
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}', received
+    server.shutdown()
+
+
+@pytest.fixture
+def processor(tmp_path, stub_server):
+    base_url, _ = stub_server
+    processor = SARDataProcessor.__new__(SARDataProcessor)
+    processor.config = SHConfig()
+    processor.session = StubSession()
+    processor.downloader = SceneDownloader(processor.config, max_workers=4, rate=100,
+                                           session=processor.session, base_url=base_url)
+    processor.output_dir = tmp_path
+    return processor
+
+
+def test_requests_carry_token_and_respect_size_limit(processor, stub_server):
+    _, received = stub_server
+    periods = [('2023-01-01', '2023-01-15'), ('2023-06-01', '2023-06-15')]
+
+    paths = processor.get_sar_data_many(MAIN_BBOX, periods)
+
+    assert all(path is not None for path in paths)
+    assert received
+    assert all(request['authorization'] == f'Bearer {TOKEN}' for request in received)
+    for request in received:
+        assert request['body']['output']['width'] <= MAX_REQUEST_PIXELS
+        assert request['body']['output']['height'] <= MAX_REQUEST_PIXELS
+    # 期間ごとに同じ数のタイルを取得し、1枚のGeoTIFFに組み立てる
+    assert len(received) % len(periods) == 0 and len(received) > len(periods)
+    with rasterio.open(paths[0]) as src:
+        assert src.width > MAX_REQUEST_PIXELS or src.height > MAX_REQUEST_PIXELS
+        assert src.crs is not None
+
+
+def test_downloaded_periods_are_not_fetched_again(processor, stub_server):
+    _, received = stub_server
+    periods = [('2023-01-01', '2023-01-15')]
+    small_bbox = (139.0, 35.5, 139.05, 35.55)
+
+    first = processor.get_sar_data_many(small_bbox, periods)
+    count = len(received)
+    second = processor.get_sar_data_many(small_bbox, periods)
+
+    assert first == second
+    assert len(received) == count == 1
+
+
+def test_auth_error_fails_fast(processor, stub_server):
+    processor.session = None
+    processor.downloader.session = None
+    processor.check_auth = lambda: None
+
+    with pytest.raises(ValueError):
+        processor.get_sar_data_many((139.0, 35.5, 139.05, 35.55), [('2023-01-01', '2023-01-15')])
@@ -0,0 +1,50 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from sentinelhub import SHConfig
+from sentinelhub.download.models import DownloadRequest
+from sentinelhub.constants import RequestType
+
+from scene_downloader import SceneDownloader
+
+
+@pytest.fixture
+def keep_alive_server():
+    """接続を維持するスタブ（リクエストごとにクライアントの接続元ポートを記録する）"""
+    ports = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            ports.append(self.client_address[1])
+            body = b'ok'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{server.server_port}/api/v1/process', ports
+    server.shutdown()
+
+
+def test_download_calls_reuse_connections(keep_alive_server):
+    url, ports = keep_alive_server
+    downloader = SceneDownloader(SHConfig(), max_workers=2, rate=100)
+    request = DownloadRequest(url=url, request_type=RequestType.POST, post_values={}, use_session=False)
+
+    # 期間ごとに1回ずつdownload()を呼び出す場合も、同じ接続を使う
+    for _ in range(3):
+        results = list(downloader.download([request]))
+        assert [(index, content, error) for index, content, error in results] == [(0, b'ok', None)]
+
+    assert len(ports) == 3
+    assert len(set(ports)) == 1
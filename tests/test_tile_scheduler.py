@@ -0,0 +1,95 @@
+from functools import partial
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+from analyze_sar_data import apply_terrain_correction, estimate_moisture_by_elevation, process_sar_tiff
+from speckle import SpeckleFilter
+from tile_scheduler import TileScheduler
+
+HEIGHT, WIDTH = 300, 260
+# タイルの境界がスペックルフィルタの窓の内側に入るよう、小さなタイルにする
+TILE_SIZE = 64
+
+
+@pytest.fixture(scope='module')
+def sar_tiff(tmp_path_factory):
+    """欠損（0）を含む線形の後方散乱係数の合成データ"""
+    rng = np.random.default_rng(0)
+    vv = rng.gamma(4.4, 0.05 / 4.4, (HEIGHT, WIDTH)).astype(np.float32)
+    vv[rng.random((HEIGHT, WIDTH)) < 0.02] = 0
+    vv[100:140, 60:70] = 0
+    path = tmp_path_factory.mktemp('sar') / 'response.tiff'
+    with rasterio.open(path, 'w', driver='GTiff', width=WIDTH, height=HEIGHT, count=1, dtype='float32',
+                       crs='EPSG:32654', transform=from_origin(500000, 4200000, 10, 10)) as dst:
+        dst.write(vv, 1)
+    return path
+
+
+@pytest.fixture(scope='module')
+def dem():
+    """範囲外（2000m超・負）とNaNを含む標高"""
+    rng = np.random.default_rng(1)
+    dem = rng.uniform(-50, 2500, (HEIGHT, WIDTH)).astype(np.float32)
+    dem[rng.random((HEIGHT, WIDTH)) < 0.01] = np.nan
+    return dem
+
+
+def make_scheduler(executor, halo=0):
+    return TileScheduler(tile_size=TILE_SIZE, halo=halo, executor=executor, max_workers=2)
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_process_sar_tiff_matches_serial(sar_tiff, executor):
+    serial, serial_meta = process_sar_tiff(sar_tiff)
+    tiled, tiled_meta = process_sar_tiff(sar_tiff, scheduler=make_scheduler(executor))
+
+    np.testing.assert_array_equal(tiled, serial)
+    assert tiled_meta == serial_meta
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+@pytest.mark.parametrize('method', ['boxcar', 'lee', 'refined_lee'])
+def test_speckle_with_halo_matches_serial(sar_tiff, executor, method):
+    speckle = SpeckleFilter(method, size=7)
+    serial, _ = process_sar_tiff(sar_tiff, speckle=speckle)
+    tiled, _ = process_sar_tiff(sar_tiff, scheduler=make_scheduler(executor, halo=speckle.halo), speckle=speckle)
+
+    # 積分画像の丸め誤差はタイルの原点に依存するため、float32の数ulpの差だけ許容する
+    np.testing.assert_array_equal(np.isnan(tiled), np.isnan(serial))
+    np.testing.assert_allclose(tiled, serial, rtol=1e-5, atol=1e-5)
+
+
+def test_speckle_rejects_halo_smaller_than_window(sar_tiff):
+    speckle = SpeckleFilter('lee', size=7)
+    with pytest.raises(ValueError):
+        process_sar_tiff(sar_tiff, scheduler=make_scheduler('thread', halo=speckle.halo - 1), speckle=speckle)
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_terrain_correction_and_moisture_match_serial(sar_tiff, dem, executor):
+    vv_db, meta = process_sar_tiff(sar_tiff)
+    scheduler = make_scheduler(executor)
+
+    serial_corrected = apply_terrain_correction(vv_db, dem, meta, verbose=False)
+    tiled_corrected = scheduler.map(partial(apply_terrain_correction, metadata=None, verbose=False), vv_db, dem)
+    np.testing.assert_array_equal(tiled_corrected, serial_corrected)
+
+    serial_map, serial_levels = estimate_moisture_by_elevation(serial_corrected, dem, meta)
+    tiled_map, tiled_levels = scheduler.map(partial(estimate_moisture_by_elevation, metadata=None),
+                                            tiled_corrected, dem)
+    np.testing.assert_array_equal(tiled_map, serial_map)
+    assert isinstance(tiled_levels, np.ma.MaskedArray)
+    np.testing.assert_array_equal(np.ma.getmaskarray(tiled_levels), np.ma.getmaskarray(serial_levels))
+    np.testing.assert_array_equal(tiled_levels.filled(0), serial_levels.filled(0))
+
+
+def test_tiles_cover_raster_once():
+    scheduler = TileScheduler(tile_size=TILE_SIZE, halo=3)
+    covered = np.zeros((HEIGHT, WIDTH), dtype=int)
+    for core, padded in scheduler.tiles((HEIGHT, WIDTH)):
+        covered[core] += 1
+        assert padded[0].start <= core[0].start and padded[0].stop >= core[0].stop
+    assert (covered == 1).all()
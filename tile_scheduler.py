@@ -0,0 +1,128 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
+
+import numpy as np
+
+DEFAULT_TILE_SIZE = 1024
+
+
+def _run_tile(fn, arrays, kwargs):
+    """1タイルを処理して (結果, 処理時間) を返す"""
+    start = time.perf_counter()
+    result = fn(*arrays, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def _allocate(part, shape):
+    """タイルの結果と同じ型の出力配列を確保"""
+    full_shape = tuple(shape) + part.shape[2:]
+    if isinstance(part, np.ma.MaskedArray):
+        return np.ma.masked_array(np.empty(full_shape, dtype=part.dtype),
+                                  mask=np.zeros(full_shape, dtype=bool))
+    return np.empty(full_shape, dtype=part.dtype)
+
+
+class TileScheduler:
+    """
+    大きなラスタをタイルに分割して並列に処理し、結果をつなぎ合わせるスケジューラ
+
+    各タイルは周囲にhalo画素の重なりを付けて処理し、重なりを切り落として書き戻す。
+    haloを近傍処理の半径以上にすれば、結果はシーン全体を一度に処理した場合と一致する
+    （ラスタの端ではタイルも端になるため、関数自身の境界処理がそのまま使われる）。
+    """
+
+    def __init__(self, tile_size=DEFAULT_TILE_SIZE, halo=0, executor='thread', max_workers=None):
+        """
+        Args:
+            tile_size: タイルの一辺の画素数（haloを除く）
+            halo: タイルの周囲に付ける重なりの画素数
+            executor: 'thread'（スレッドプール）または 'process'（プロセスプール）
+            max_workers: ワーカー数（Noneの場合はCPUコア数）
+        """
+        if executor not in ('thread', 'process'):
+            raise ValueError(f"executorは'thread'か'process'を指定してください: {executor}")
+        self.tile_size = tile_size
+        self.halo = halo
+        self.executor = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timings = []
+
+    def tiles(self, shape):
+        """
+        タイルの範囲のリスト
+
+        Returns:
+            [(書き戻す範囲, haloを含む読み込み範囲)] それぞれ (行のslice, 列のslice)
+        """
+        height, width = shape[:2]
+        tiles = []
+        for row in range(0, height, self.tile_size):
+            for col in range(0, width, self.tile_size):
+                row_stop = min(row + self.tile_size, height)
+                col_stop = min(col + self.tile_size, width)
+                core = (slice(row, row_stop), slice(col, col_stop))
+                padded = (slice(max(row - self.halo, 0), min(row_stop + self.halo, height)),
+                          slice(max(col - self.halo, 0), min(col_stop + self.halo, width)))
+                tiles.append((core, padded))
+        return tiles
+
+    def map(self, fn, *arrays, **kwargs):
+        """
+        関数をタイルごとに並列に適用し、結果をつなぎ合わせる
+
+        Args:
+            fn: 同じ形状のタイル（配列を並べた引数）を受け取り、タイルと同じ形状の配列
+                （または配列のタプル）を返す関数。プロセスプールの場合はpickle可能な関数
+            *arrays: 同じ形状の入力配列（先頭2軸が行・列）
+            **kwargs: fnに渡すキーワード引数
+
+        Returns:
+            入力と同じ形状の配列（fnがタプルを返す場合は配列のタプル）
+        """
+        shape = arrays[0].shape[:2]
+        for array in arrays[1:]:
+            if array.shape[:2] != shape:
+                raise ValueError(f"入力配列の形状が一致しません: {shape} と {array.shape[:2]}")
+
+        tiles = self.tiles(shape)
+        if not tiles:
+            return fn(*arrays, **kwargs)
+        pool_class = ThreadPoolExecutor if self.executor == 'thread' else ProcessPoolExecutor
+        outputs = None
+        single = True
+        with pool_class(max_workers=self.max_workers) as pool:
+            tile_arrays = ([np.asarray(array[padded]) for array in arrays] for _, padded in tiles)
+            results = pool.map(_run_tile, repeat(fn), tile_arrays, repeat(kwargs))
+            for (core, padded), (result, elapsed) in zip(tiles, results):
+                single = not isinstance(result, tuple)
+                parts = (result,) if single else result
+                if outputs is None:
+                    outputs = [_allocate(part, shape) for part in parts]
+                inner = (slice(core[0].start - padded[0].start, core[0].stop - padded[0].start),
+                         slice(core[1].start - padded[1].start, core[1].stop - padded[1].start))
+                for output, part in zip(outputs, parts):
+                    output[core] = part[inner]
+                self.timings.append({
+                    'row_off': core[0].start,
+                    'col_off': core[1].start,
+                    'height': core[0].stop - core[0].start,
+                    'width': core[1].stop - core[1].start,
+                    'seconds': elapsed
+                })
+
+        return outputs[0] if single else tuple(outputs)
+
+    def print_timings(self, reset=True):
+        """記録したタイルごとの処理時間の要約を表示（resetがTrueの場合は記録を消去）"""
+        if not self.timings:
+            print("タイルの処理時間: 記録なし")
+            return
+        seconds = np.array([timing['seconds'] for timing in self.timings])
+        slowest = self.timings[int(np.argmax(seconds))]
+        print(f"タイルの処理時間: {len(seconds)}タイル, 合計 {seconds.sum():.3f}秒, "
+              f"平均 {seconds.mean():.3f}秒, 最大 {seconds.max():.3f}秒 "
+              f"(行 {slowest['row_off']}, 列 {slowest['col_off']})")
+        if reset:
+            self.timings = []